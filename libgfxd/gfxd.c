@@ -2,11 +2,13 @@
 #include <stdarg.h>
 #include <stdint.h>
 #include <stdio.h>
+#include <stdlib.h>
 #include <string.h>
 #ifdef _WIN32
 # include <io.h>
 # define read _read
 # define write _write
+# define lseek _lseek
 #else
 # include <unistd.h>
 #endif
@@ -15,6 +17,7 @@
 #include "priv.h"
 
 static TLOCAL struct gfxd_state state;
+static TLOCAL gfxd_decode_t *decode;
 
 static int buffer_input_fn(void *buf, int count)
 {
@@ -36,6 +39,30 @@ static int buffer_output_fn(const char *buf, int count)
 	return count;
 }
 
+static int growable_output_fn(const char *buf, int count)
+{
+	/* keep room for a null terminator */
+	int n_need = config.output_str_size + count + 1;
+	if (n_need > config.output_str_cap)
+	{
+		int cap = config.output_str_cap != 0 ? config.output_str_cap : 4096;
+		while (cap < n_need)
+			cap *= 2;
+
+		char *p = realloc(config.output_str, cap);
+		if (p == NULL)
+			return 0;
+
+		config.output_str = p;
+		config.output_str_cap = cap;
+	}
+
+	memcpy(&config.output_str[config.output_str_size], buf, count);
+	config.output_str_size += count;
+	config.output_str[config.output_str_size] = '\0';
+	return count;
+}
+
 static int fd_input_fn(void *buf, int count)
 {
 	return read(config.input_fd, buf, count);
@@ -46,79 +73,115 @@ static int fd_output_fn(const char *buf, int count)
 	return write(config.output_fd, buf, count);
 }
 
-static void swap_words(Gfx *gfx)
+/* fd and callback input is read in large chunks through the read-ahead buffer,
+   buffer input is already in memory */
+static int read_input(void *buf, int count)
 {
-	uint8_t b[8];
-	uint8_t *pw = (void *) gfx;
-	uint8_t *pb = b;
-
-	int endian = config.endian;
-	int wordsize = config.wordsize;
+	if (config.input_fn == &buffer_input_fn
+		|| config.input_ra_size <= count)
+	{
+		return config.input_fn(buf, count);
+	}
 
-	for (int i = 0; i < 8 / wordsize; i++)
+	if (config.input_ra_pos == config.input_ra_len)
 	{
-		if (endian == gfxd_endian_host)
+		if (config.input_ra_buf == NULL)
 		{
-			switch (wordsize)
-			{
-				case 1:
-				{
-					uint8_t w = *(uint8_t *) pw;
-					*pb++ = w >> 0;
-					break;
-				}
-				case 2:
-				{
-					uint16_t w = *(uint16_t *) pw;
-					*pb++ = w >> 8;
-					*pb++ = w >> 0;
-					break;
-				}
-				case 4:
-				{
-					uint32_t w = *(uint32_t *) pw;
-					*pb++ = w >> 24;
-					*pb++ = w >> 16;
-					*pb++ = w >> 8;
-					*pb++ = w >> 0;
-					break;
-				}
-				case 8:
-				{
-					uint64_t w = *(uint64_t *) pw;
-					*pb++ = w >> 56;
-					*pb++ = w >> 48;
-					*pb++ = w >> 40;
-					*pb++ = w >> 32;
-					*pb++ = w >> 24;
-					*pb++ = w >> 16;
-					*pb++ = w >> 8;
-					*pb++ = w >> 0;
-					break;
-				}
-			}
+			config.input_ra_buf = malloc(config.input_ra_size);
+			if (config.input_ra_buf == NULL)
+				return config.input_fn(buf, count);
 		}
-		else
+
+		int n_read = config.input_fn(config.input_ra_buf,
+					     config.input_ra_size);
+		config.input_ra_pos = 0;
+		config.input_ra_len = n_read > 0 ? n_read : 0;
+		if (config.input_ra_len == 0)
+			return 0;
+	}
+
+	int n_avail = config.input_ra_len - config.input_ra_pos;
+	if (count > n_avail)
+		count = n_avail;
+	memcpy(buf, &config.input_ra_buf[config.input_ra_pos], count);
+	config.input_ra_pos += count;
+	return count;
+}
+
+static void reset_readahead(void)
+{
+	config.input_ra_pos = 0;
+	config.input_ra_len = 0;
+}
+
+static void return_readahead(void)
+{
+	/* seek fd input back over the data that was read ahead but not used, so
+	   that the file position can be moved between executions as usual */
+	if (config.input_fn == &fd_input_fn
+		&& config.input_ra_pos != config.input_ra_len
+		&& lseek(config.input_fd,
+			 config.input_ra_pos - config.input_ra_len,
+			 SEEK_CUR) != -1)
+	{
+		reset_readahead();
+	}
+}
+
+static uint32_t read_be32(const uint8_t *p)
+{
+	return ((uint32_t) p[0] << 24)
+		| ((uint32_t) p[1] << 16)
+		| ((uint32_t) p[2] << 8)
+		| ((uint32_t) p[3] << 0);
+}
+
+static uint32_t swap32(uint32_t w)
+{
+	return (w << 24)
+		| ((w << 8) & 0x00FF0000)
+		| ((w >> 8) & 0x0000FF00)
+		| (w >> 24);
+}
+
+static void swap_words(Gfx *gfx)
+{
+	/* the packet is read as two big-endian words, and then the bytes of
+	   each little-endian word are reversed as a whole */
+	const uint8_t *p = (void *) gfx;
+	uint32_t hi = read_be32(&p[0]);
+	uint32_t lo = read_be32(&p[4]);
+
+	switch (config.swap_size)
+	{
+		case 2:
+			hi = ((hi << 8) & 0xFF00FF00) | ((hi >> 8) & 0x00FF00FF);
+			lo = ((lo << 8) & 0xFF00FF00) | ((lo >> 8) & 0x00FF00FF);
+			break;
+		case 4:
+			hi = swap32(hi);
+			lo = swap32(lo);
+			break;
+		case 8:
 		{
-			for (int j = 0; j < wordsize; j++)
-			{
-				if (endian == gfxd_endian_little)
-					*pb++ = pw[wordsize - 1 - j];
-				else
-					*pb++ = pw[j];
-			}
+			uint32_t w = hi;
+			hi = swap32(lo);
+			lo = swap32(w);
+			break;
 		}
-		pw += wordsize;
 	}
 
-	gfx->hi = ((uint32_t) b[0] << 24)
-		| ((uint32_t) b[1] << 16)
-		| ((uint32_t) b[2] << 8)
-		| ((uint32_t) b[3] << 0);
-	gfx->lo = ((uint32_t) b[4] << 24)
-		| ((uint32_t) b[5] << 16)
-		| ((uint32_t) b[6] << 8)
-		| ((uint32_t) b[7] << 0);
+	gfx->hi = hi;
+	gfx->lo = lo;
+}
+
+static void copy_macro(gfxd_macro_t *dst, const gfxd_macro_t *src)
+{
+	/* only the arguments of the macro type are meaningful */
+	int n_arg = config.ucode->macro_tbl[src->id].n_arg;
+
+	dst->id = src->id;
+	memcpy(dst->arg, src->arg, n_arg * sizeof(src->arg[0]));
 }
 
 static void get_more_input(void)
@@ -126,20 +189,21 @@ static void get_more_input(void)
 	if (state.end_input != 0)
 		return;
 
-	char *recv_buf = (void *) &state.gfx[0];
+	char *recv_buf = (void *) &state.gfx[state.head];
 
-	while (state.n_gfx < sizeof(state.gfx) / sizeof(state.gfx[0]))
+	while (state.n_gfx < RING_SIZE)
 	{
-		int n_read = sizeof(state.gfx) - state.n_byte;
-		n_read = config.input_fn(&recv_buf[state.n_byte], n_read);
+		int n_read = RING_SIZE * sizeof(Gfx) - state.n_byte;
+		n_read = read_input(&recv_buf[state.n_byte], n_read);
 		if (n_read == 0)
 			return;
 		state.n_byte += n_read;
 
 		while (state.n_gfx < state.n_byte / sizeof(Gfx))
 		{
-			Gfx gfx = state.gfx[state.n_gfx];
-			gfxd_macro_t *m = &state.macro[state.n_gfx];
+			int i = state.head + state.n_gfx;
+			Gfx gfx = state.gfx[i];
+			gfxd_macro_t *m = &state.macro[i];
 
 			swap_words(&gfx);
 
@@ -151,6 +215,14 @@ static void get_more_input(void)
 				return;
 			}
 
+			/* packets in the second copy are still in the window when
+			   head wraps around to the first copy */
+			if (i >= RING_SIZE)
+			{
+				state.gfx[i - RING_SIZE] = state.gfx[i];
+				copy_macro(&state.macro[i - RING_SIZE], m);
+			}
+
 			state.n_gfx++;
 		}
 	}
@@ -180,6 +252,7 @@ TLOCAL struct gfxd_config config =
 	.ucode = NULL,
 	.endian = gfxd_endian_big,
 	.wordsize = 4,
+	.swap_size = 0,
 	.arg = NULL,
 
 	.stop_on_invalid = 1,
@@ -188,17 +261,34 @@ TLOCAL struct gfxd_config config =
 	.emit_q_macro = 0,
 	.emit_ext_macro = 0,
 
+	.input_base = NULL,
+	.input_base_size = 0,
+	.input_offset = 0,
 	.input_buf = NULL,
 	.input_buf_size = 0,
 	.input_fn = &buffer_input_fn,
+	.input_ra_buf = NULL,
+	.input_ra_size = 0x10000,
+	.input_ra_pos = 0,
+	.input_ra_len = 0,
 
 	.output_buf = NULL,
 	.output_buf_size = 0,
+	.output_str = NULL,
+	.output_str_size = 0,
+	.output_str_cap = 0,
 	.output_fn = &buffer_output_fn,
+	.output_co_buf = NULL,
+	.output_co_size = 0,
+	.output_co_len = 0,
 
 	.macro_fn = &gfxd_macro_dflt,
 	.arg_fn = &gfxd_arg_dflt,
 
+	.macro_filter_on = 0,
+	.macro_filter_skip = 0,
+	.ref_sink = NULL,
+
 	.tlut_fn = NULL,
 	.timg_fn = NULL,
 	.cimg_fn = NULL,
@@ -217,26 +307,75 @@ TLOCAL struct gfxd_config config =
 
 void gfxd_input_buffer(const void *buf, int size)
 {
+	config.input_base = buf;
+	config.input_base_size = size;
+	config.input_offset = 0;
 	config.input_buf = buf;
 	config.input_buf_size = size;
 	config.input_fn = &buffer_input_fn;
+
+	/* not needed for buffer input */
+	free(config.input_ra_buf);
+	config.input_ra_buf = NULL;
+	reset_readahead();
+}
+
+void gfxd_input_window(int offset, int size)
+{
+	if (offset < 0)
+		offset = 0;
+	else if (offset > config.input_base_size)
+		offset = config.input_base_size;
+
+	int n_avail = config.input_base_size - offset;
+	if (size < 0 || size > n_avail)
+		size = n_avail;
+
+	config.input_offset = offset;
+	config.input_buf = config.input_base + offset;
+	config.input_buf_size = size;
+	config.input_fn = &buffer_input_fn;
 }
 
 void gfxd_output_buffer(char *buf, int size)
 {
+	gfxd_flush();
 	config.output_buf = buf;
 	config.output_buf_size = size;
 	config.output_fn = &buffer_output_fn;
 }
 
+void gfxd_output_growable(void)
+{
+	gfxd_flush();
+	config.output_str_size = 0;
+	if (config.output_str != NULL)
+		config.output_str[0] = '\0';
+	config.output_fn = &growable_output_fn;
+}
+
+const char *gfxd_output_string(int *size)
+{
+	if (size != NULL)
+		*size = config.output_str_size;
+
+	if (config.output_str == NULL)
+		return "";
+	else
+		return config.output_str;
+}
+
 void gfxd_input_fd(int fd)
 {
+	config.input_offset = 0;
 	config.input_fd = fd;
 	config.input_fn = &fd_input_fn;
+	reset_readahead();
 }
 
 void gfxd_output_fd(int fd)
 {
+	gfxd_flush();
 	config.output_fd = fd;
 	config.output_fn = &fd_output_fn;
 }
@@ -244,19 +383,51 @@ void gfxd_output_fd(int fd)
 void gfxd_input_callback(gfxd_input_fn_t *fn)
 {
 	if (fn != NULL)
+	{
+		config.input_offset = 0;
 		config.input_fn = fn;
+		reset_readahead();
+	}
 	else
 		gfxd_input_buffer(NULL, 0);
 }
 
+void gfxd_input_readahead(int size)
+{
+	if (size < 0)
+		size = 0;
+
+	/* reallocated at the next read */
+	free(config.input_ra_buf);
+	config.input_ra_buf = NULL;
+	config.input_ra_size = size;
+	reset_readahead();
+}
+
 void gfxd_output_callback(gfxd_output_fn_t *fn)
 {
 	if (fn != NULL)
+	{
+		gfxd_flush();
 		config.output_fn = fn;
+	}
 	else
 		gfxd_output_buffer(NULL, 0);
 }
 
+void gfxd_output_coalesce(int size)
+{
+	if (size < 0)
+		size = 0;
+
+	gfxd_flush();
+
+	/* reallocated at the next write */
+	free(config.output_co_buf);
+	config.output_co_buf = NULL;
+	config.output_co_size = size;
+}
+
 void gfxd_macro_fn(gfxd_macro_fn_t *fn)
 {
 	if (fn != NULL)
@@ -265,6 +436,21 @@ void gfxd_macro_fn(gfxd_macro_fn_t *fn)
 		config.macro_fn = gfxd_macro_dflt;
 }
 
+void gfxd_macro_filter(const int *ids, int n_id, int skip)
+{
+	memset(config.macro_filter, 0, sizeof(config.macro_filter));
+
+	for (int i = 0; i < n_id; i++)
+	{
+		int id = ids[i];
+		if (id >= 0 && id <= gfxd_Special1)
+			config.macro_filter[id / 32] |= (uint32_t) 1 << (id % 32);
+	}
+
+	config.macro_filter_on = ids != NULL;
+	config.macro_filter_skip = skip;
+}
+
 void gfxd_arg_fn(gfxd_arg_fn_t *fn)
 {
 	if (fn != NULL)
@@ -275,7 +461,42 @@ void gfxd_arg_fn(gfxd_arg_fn_t *fn)
 
 int gfxd_write(const void *buf, int count)
 {
-	return config.output_fn(buf, count);
+	/* fd and callback output is collected in the coalescing buffer, buffer
+	   output is already in memory */
+	if (config.output_co_size == 0
+		|| config.output_fn == &buffer_output_fn
+		|| config.output_fn == &growable_output_fn)
+	{
+		return config.output_fn(buf, count);
+	}
+
+	if (config.output_co_len + count > config.output_co_size)
+		gfxd_flush();
+	if (count >= config.output_co_size)
+		return config.output_fn(buf, count);
+
+	if (config.output_co_buf == NULL)
+	{
+		/* keep room for a null terminator */
+		config.output_co_buf = malloc(config.output_co_size + 1);
+		if (config.output_co_buf == NULL)
+			return config.output_fn(buf, count);
+	}
+
+	memcpy(&config.output_co_buf[config.output_co_len], buf, count);
+	config.output_co_len += count;
+	return count;
+}
+
+int gfxd_flush(void)
+{
+	if (config.output_co_len == 0)
+		return 0;
+
+	int n = config.output_co_len;
+	config.output_co_buf[n] = '\0';
+	config.output_co_len = 0;
+	return config.output_fn(config.output_co_buf, n);
 }
 
 int gfxd_puts(const char *str)
@@ -348,207 +569,258 @@ int gfxd_macro_dflt(void)
 	return 0;
 }
 
-int gfxd_arg_callbacks(int arg_num)
+/* the address and parameters passed to the callback for an argument, returns
+   zero if the argument is not an address with a callback */
+static int arg_ref(int arg_num, gfxd_ref_t *ref)
 {
 	int id = gfxd_macro_id();
+	int type = gfxd_arg_type(arg_num);
+	int32_t *param = ref->param;
+
+	ref->offset = state.macro_offset;
+	ref->macro_id = id;
+	ref->type = type;
+	for (int i = 0; i < 5; i++)
+		param[i] = 0;
 
-	switch (gfxd_arg_type(arg_num))
+	switch (type)
 	{
 		case gfxd_Tlut:
 		{
-			if (config.tlut_fn != NULL)
-			{
-				int32_t num;
-				if (id == gfxd_DPLoadTLUT_pal16)
-					num = 16;
-				else if (id == gfxd_DPLoadTLUT_pal256)
-					num = 256;
-				else
-					num = typed_arg_i(gfxd_Num, 0);
-				return config.tlut_fn(
-					typed_arg_u(gfxd_Tlut, 0),
-					typed_arg_i(gfxd_Pal, 0),
-					num);
-			}
-			break;
+			int32_t num;
+			if (id == gfxd_DPLoadTLUT_pal16)
+				num = 16;
+			else if (id == gfxd_DPLoadTLUT_pal256)
+				num = 256;
+			else
+				num = typed_arg_i(gfxd_Num, 0);
+			ref->address = typed_arg_u(gfxd_Tlut, 0);
+			param[0] = typed_arg_i(gfxd_Pal, 0);
+			param[1] = num;
+			return 1;
 		}
 		case gfxd_Timg:
 		{
-			if (config.timg_fn != NULL)
-			{
-				int32_t siz = typed_arg_i(gfxd_Siz, 0);
-				if (siz == -1)
-					siz = G_IM_SIZ_4b;
-				return config.timg_fn(
-					typed_arg_u(gfxd_Timg, 0),
-					typed_arg_i(gfxd_Fmt, 0),
-					siz,
-					typed_arg_i(gfxd_Dim, 0),
-					typed_arg_i(gfxd_Dim, 1),
-					typed_arg_i(gfxd_Pal, 0));
-			}
-			break;
+			int32_t siz = typed_arg_i(gfxd_Siz, 0);
+			if (siz == -1)
+				siz = G_IM_SIZ_4b;
+			ref->address = typed_arg_u(gfxd_Timg, 0);
+			param[0] = typed_arg_i(gfxd_Fmt, 0);
+			param[1] = siz;
+			param[2] = typed_arg_i(gfxd_Dim, 0);
+			param[3] = typed_arg_i(gfxd_Dim, 1);
+			param[4] = typed_arg_i(gfxd_Pal, 0);
+			return 1;
 		}
 		case gfxd_Cimg:
 		{
-			if (config.cimg_fn != NULL)
-			{
-				return config.cimg_fn(
-					typed_arg_u(gfxd_Cimg, 0),
-					typed_arg_i(gfxd_Fmt, 0),
-					typed_arg_i(gfxd_Siz, 0),
-					typed_arg_i(gfxd_Dim, 0));
-			}
-			break;
+			ref->address = typed_arg_u(gfxd_Cimg, 0);
+			param[0] = typed_arg_i(gfxd_Fmt, 0);
+			param[1] = typed_arg_i(gfxd_Siz, 0);
+			param[2] = typed_arg_i(gfxd_Dim, 0);
+			return 1;
 		}
 		case gfxd_Zimg:
+		case gfxd_Dl:
+		case gfxd_Mtxptr:
+		case gfxd_Lightptr:
+		case gfxd_Vpptr:
 		{
+			ref->address = typed_arg_u(type, 0);
+			return 1;
+		}
+		case gfxd_Lookatptr:
+		{
+			int32_t num;
+			if (id == gfxd_SPLookAt)
+				num = 2;
+			else
+				num = 1;
+			ref->address = typed_arg_u(gfxd_Lookatptr, 0);
+			param[0] = num;
+			return 1;
+		}
+		case gfxd_Lightsn:
+		{
+			int32_t num;
+			if (id == gfxd_SPSetLights1)
+				num = NUMLIGHTS_1;
+			else if (id == gfxd_SPSetLights2)
+				num = NUMLIGHTS_2;
+			else if (id == gfxd_SPSetLights3)
+				num = NUMLIGHTS_3;
+			else if (id == gfxd_SPSetLights4)
+				num = NUMLIGHTS_4;
+			else if (id == gfxd_SPSetLights5)
+				num = NUMLIGHTS_5;
+			else if (id == gfxd_SPSetLights6)
+				num = NUMLIGHTS_6;
+			else if (id == gfxd_SPSetLights7)
+				num = NUMLIGHTS_7;
+			else
+				num = NUMLIGHTS_0;
+			ref->address = typed_arg_u(gfxd_Lightsn, 0);
+			param[0] = num;
+			return 1;
+		}
+		case gfxd_Segptr:
+		{
+			ref->address = typed_arg_u(gfxd_Segptr, 0);
+			param[0] = typed_arg_i(gfxd_Seg, 0);
+			return 1;
+		}
+		case gfxd_Vtxptr:
+		{
+			ref->address = typed_arg_u(gfxd_Vtxptr, 0);
+			param[0] = typed_arg_i(gfxd_Num, 0);
+			return 1;
+		}
+		case gfxd_Uctext:
+		{
+			ref->address = typed_arg_u(gfxd_Uctext, 0);
+			param[0] = 0x1000;
+			return 1;
+		}
+		case gfxd_Ucdata:
+		{
+			uint32_t size;
+			if (id == gfxd_SPLoadUcodeEx)
+				size = typed_arg_u(gfxd_Size, 0);
+			else
+				size = 0x800;
+			ref->address = typed_arg_u(gfxd_Ucdata, 0);
+			param[0] = size;
+			return 1;
+		}
+		case gfxd_Dram:
+		{
+			ref->address = typed_arg_u(gfxd_Dram, 0);
+			param[0] = typed_arg_u(gfxd_Size, 0);
+			return 1;
+		}
+	}
+
+	return 0;
+}
+
+int gfxd_arg_callbacks(int arg_num)
+{
+	gfxd_ref_t ref;
+	if (arg_ref(arg_num, &ref) == 0)
+		return 0;
+
+	uint32_t address = ref.address;
+	int32_t *param = ref.param;
+
+	switch (ref.type)
+	{
+		case gfxd_Tlut:
+			if (config.tlut_fn != NULL)
+				return config.tlut_fn(address, param[0], param[1]);
+			break;
+		case gfxd_Timg:
+			if (config.timg_fn != NULL)
+				return config.timg_fn(address, param[0], param[1],
+						      param[2], param[3], param[4]);
+			break;
+		case gfxd_Cimg:
+			if (config.cimg_fn != NULL)
+				return config.cimg_fn(address, param[0], param[1],
+						      param[2]);
+			break;
+		case gfxd_Zimg:
 			if (config.zimg_fn != NULL)
-			{
-				return config.zimg_fn(
-					typed_arg_u(gfxd_Zimg, 0));
-			}
+				return config.zimg_fn(address);
 			break;
-		}
 		case gfxd_Dl:
-		{
 			if (config.dl_fn != NULL)
-			{
-				return config.dl_fn(
-					typed_arg_u(gfxd_Dl, 0));
-			}
+				return config.dl_fn(address);
 			break;
-		}
 		case gfxd_Mtxptr:
-		{
 			if (config.mtx_fn != NULL)
-			{
-				return config.mtx_fn(
-					typed_arg_u(gfxd_Mtxptr, 0));
-			}
+				return config.mtx_fn(address);
 			break;
-		}
 		case gfxd_Lookatptr:
-		{
 			if (config.lookat_fn != NULL)
-			{
-				int32_t num;
-				if (id == gfxd_SPLookAt)
-					num = 2;
-				else
-					num = 1;
-				return config.lookat_fn(
-					typed_arg_u(gfxd_Lookatptr, 0),
-					num);
-			}
+				return config.lookat_fn(address, param[0]);
 			break;
-		}
 		case gfxd_Lightptr:
-		{
 			if (config.light_fn != NULL)
-			{
-				return config.light_fn(
-					typed_arg_u(gfxd_Lightptr, 0));
-			}
+				return config.light_fn(address);
 			break;
-		}
 		case gfxd_Lightsn:
-		{
 			if (config.lightsn_fn != NULL)
-			{
-				int32_t num;
-				if (id == gfxd_SPSetLights1)
-					num = NUMLIGHTS_1;
-				else if (id == gfxd_SPSetLights2)
-					num = NUMLIGHTS_2;
-				else if (id == gfxd_SPSetLights3)
-					num = NUMLIGHTS_3;
-				else if (id == gfxd_SPSetLights4)
-					num = NUMLIGHTS_4;
-				else if (id == gfxd_SPSetLights5)
-					num = NUMLIGHTS_5;
-				else if (id == gfxd_SPSetLights6)
-					num = NUMLIGHTS_6;
-				else if (id == gfxd_SPSetLights7)
-					num = NUMLIGHTS_7;
-				else
-					num = NUMLIGHTS_0;
-				return config.lightsn_fn(
-					typed_arg_u(gfxd_Lightsn, 0),
-					num);
-			}
+				return config.lightsn_fn(address, param[0]);
 			break;
-			
-		}
 		case gfxd_Segptr:
-		{
 			if (config.seg_fn != NULL)
-			{
-				return config.seg_fn(
-					typed_arg_u(gfxd_Segptr, 0),
-					typed_arg_i(gfxd_Seg, 0));
-			}
+				return config.seg_fn(address, param[0]);
 			break;
-		}
 		case gfxd_Vtxptr:
-		{
 			if (config.vtx_fn != NULL)
-			{
-				return config.vtx_fn(
-					typed_arg_u(gfxd_Vtxptr, 0),
-					typed_arg_i(gfxd_Num, 0));
-			}
+				return config.vtx_fn(address, param[0]);
 			break;
-		}
 		case gfxd_Vpptr:
-		{
 			if (config.vp_fn != NULL)
-			{
-				return config.vp_fn(
-					typed_arg_u(gfxd_Vpptr, 0));
-			}
+				return config.vp_fn(address);
 			break;
-		}
 		case gfxd_Uctext:
-		{
 			if (config.uctext_fn != NULL)
-			{
-				return config.uctext_fn(
-					typed_arg_u(gfxd_Uctext, 0),
-					0x1000);
-			}
+				return config.uctext_fn(address, param[0]);
 			break;
-		}
 		case gfxd_Ucdata:
-		{
 			if (config.ucdata_fn != NULL)
-			{
-				uint32_t size;
-				if (id == gfxd_SPLoadUcodeEx)
-					size = typed_arg_u(gfxd_Size, 0);
-				else
-					size = 0x800;
-				return config.ucdata_fn(
-					typed_arg_u(gfxd_Ucdata, 0),
-					size);
-			}
+				return config.ucdata_fn(address, param[0]);
 			break;
-		}
 		case gfxd_Dram:
-		{
 			if (config.dram_fn != NULL)
-			{
-				return config.dram_fn(
-					typed_arg_u(gfxd_Dram, 0),
-					typed_arg_u(gfxd_Size, 0));
-			}
+				return config.dram_fn(address, param[0]);
 			break;
+	}
+
+	return 0;
+}
+
+/* record the addresses of the current macro in the reference sink */
+static int collect_refs(void)
+{
+	gfxd_refs_t *r = config.ref_sink;
+	int n_arg = gfxd_arg_count();
+
+	for (int i = 0; i < n_arg; i++)
+	{
+		gfxd_ref_t ref;
+		if (arg_ref(i, &ref) == 0)
+			continue;
+
+		if (r->n_ref >= r->ref_cap)
+		{
+			int cap = r->ref_cap != 0 ? r->ref_cap * 2 : 64;
+			void *p = realloc(r->ref, (size_t) cap * sizeof(*r->ref));
+			if (p == NULL)
+				return -2;
+			r->ref = p;
+			r->ref_cap = cap;
 		}
+		r->ref[r->n_ref++] = ref;
 	}
 
 	return 0;
 }
 
+void gfxd_ref_sink(gfxd_refs_t *r)
+{
+	config.ref_sink = r;
+}
+
+void gfxd_refs_free(gfxd_refs_t *r)
+{
+	free(r->ref);
+	r->n_ref = 0;
+	r->ref = NULL;
+	r->ref_cap = 0;
+}
+
 void gfxd_arg_dflt(int arg_num)
 {
 	if (gfxd_arg_callbacks(arg_num) == 0)
@@ -636,6 +908,10 @@ void gfxd_dram_callback(gfxd_dram_fn_t *fn)
 
 void gfxd_target(gfxd_ucode_t ucode)
 {
+	/* build the ucode's dispatch tables on first use in this thread */
+	if (ucode != NULL)
+		ucode->init_fn();
+
 	config.ucode = ucode;
 }
 
@@ -643,6 +919,21 @@ void gfxd_endian(int endian, int wordsize)
 {
 	config.endian = endian;
 	config.wordsize = wordsize;
+
+	if (endian == gfxd_endian_host)
+	{
+		const uint16_t w = 1;
+		if (*(const uint8_t *) &w == 1)
+			endian = gfxd_endian_little;
+		else
+			endian = gfxd_endian_big;
+	}
+
+	/* big-endian words of any size are already in packet order */
+	if (endian == gfxd_endian_little && wordsize > 1)
+		config.swap_size = wordsize;
+	else
+		config.swap_size = 0;
 }
 
 void gfxd_dynamic(const char *arg)
@@ -712,39 +1003,67 @@ void *gfxd_udata_get(void)
 	return config.udata;
 }
 
-int gfxd_execute(void)
+void gfxd_execute_begin(void)
 {
-	state.macro_offset = 0;
+	state.macro_offset = config.input_offset;
 	state.n_byte = 0;
 	state.n_gfx = 0;
+	state.head = 0;
 	state.end_input = 0;
 	state.ret = 0;
+	state.done = 0;
+}
 
-	for (;;)
+int gfxd_execute_step(int max_macros)
+{
+	for (int n = 0; state.done == 0; n++)
 	{
+		/* suspend, the lookahead is kept in state until the next step */
+		if (max_macros >= 0 && n >= max_macros)
+		{
+			gfxd_flush();
+			return 0;
+		}
+
 		get_more_input();
 		if (state.n_gfx == 0)
+		{
+			state.done = 1;
 			break;
+		}
 
 		gfxd_macro_t *m = &state.cur_macro;
+		gfxd_macro_t *window = &state.macro[state.head];
 
-		*m = state.macro[0];
-		config.ucode->combine_fn(m, state.macro, state.n_gfx);
+		copy_macro(m, &window[0]);
+		config.ucode->combine_fn(m, window, state.n_gfx);
 
 		const gfxd_macro_type_t *t = &config.ucode->macro_tbl[m->id];
 		if (t->ext != 0 && config.emit_ext_macro == 0)
 		{
-			Gfx gfx = state.gfx[0];
+			Gfx gfx = state.gfx[state.head];
 			swap_words(&gfx);
 
 			t = &config.ucode->macro_tbl[gfxd_Invalid];
 			t->disas_fn(m, gfx.hi, gfx.lo);
 		}
 
-		int ret = config.macro_fn();
+		int ret;
+		if (config.ref_sink != NULL && collect_refs() != 0)
+			ret = -2;
+		else if (config.macro_filter_on == 0
+			|| (config.macro_filter[m->id / 32] >> (m->id % 32)) & 1)
+		{
+			ret = config.macro_fn();
+		}
+		else if (config.macro_filter_skip == 0)
+			ret = gfxd_macro_dflt();
+		else
+			ret = 0;
 		if (ret != 0)
 		{
 			state.ret = ret;
+			state.done = 1;
 			break;
 		}
 
@@ -752,27 +1071,152 @@ int gfxd_execute(void)
 			&& (m->id == gfxd_SPBranchList
 				|| m->id == gfxd_SPEndDisplayList))
 		{
+			state.done = 1;
 			break;
 		}
 
 		int n_pop = config.ucode->macro_tbl[m->id].n_gfx;
-		int n_rem = state.n_gfx - n_pop;
-		{
-			int n_byte = n_rem * sizeof(gfxd_macro_t);
-			memmove(&state.macro[0], &state.macro[n_pop], n_byte);
-			state.n_gfx = n_rem;
-		}
+		state.head += n_pop;
+		state.n_gfx -= n_pop;
+		state.n_byte -= n_pop * sizeof(Gfx);
+		if (state.head >= RING_SIZE)
 		{
-			int n_byte = n_rem * sizeof(Gfx);
-			memmove(&state.gfx[0], &state.gfx[n_pop], n_byte);
-			state.n_byte = n_byte;
+			/* continue in the first copy, which holds the complete
+			   packets already, but not a partially received one */
+			int i = state.head + state.n_gfx;
+			int n_part = state.n_byte - state.n_gfx * sizeof(Gfx);
+			memcpy(&state.gfx[i - RING_SIZE], &state.gfx[i], n_part);
+			state.head -= RING_SIZE;
 		}
 		state.macro_offset += n_pop * sizeof(Gfx);
 	}
 
+	return_readahead();
+	gfxd_flush();
 	return state.ret;
 }
 
+int gfxd_execute_done(void)
+{
+	return state.done;
+}
+
+int gfxd_execute(void)
+{
+	gfxd_execute_begin();
+	return gfxd_execute_step(-1);
+}
+
+static int decode_cap(int cap, int n)
+{
+	if (cap == 0)
+		cap = 256;
+	while (cap < n)
+		cap *= 2;
+	return cap;
+}
+
+#define DECODE_GROW(ptr, cap)						\
+	do								\
+	{								\
+		void *p = realloc(ptr, (size_t) (cap) * sizeof(*(ptr)));	\
+		if (p == NULL)						\
+			return -2;					\
+		ptr = p;						\
+	} while (0)
+
+static int decode_macro_fn(void)
+{
+	gfxd_decode_t *d = decode;
+	gfxd_macro_t *m = &state.cur_macro;
+	const gfxd_macro_type_t *t = &config.ucode->macro_tbl[m->id];
+
+	int n_macro = d->n_macro + 1;
+	int n_arg = d->n_arg + t->n_arg;
+
+	/* macro_arg holds one extra entry, the end of the last macro */
+	if (n_macro + 1 > d->macro_cap)
+	{
+		int cap = decode_cap(d->macro_cap, n_macro + 1);
+		DECODE_GROW(d->macro_offset, cap);
+		DECODE_GROW(d->macro_id, cap);
+		DECODE_GROW(d->macro_packets, cap);
+		DECODE_GROW(d->macro_arg, cap);
+		d->macro_cap = cap;
+	}
+	if (n_arg > d->arg_cap)
+	{
+		int cap = decode_cap(d->arg_cap, n_arg);
+		DECODE_GROW(d->arg_type, cap);
+		DECODE_GROW(d->arg_fmt, cap);
+		DECODE_GROW(d->arg_value, cap);
+		DECODE_GROW(d->arg_valid, cap);
+		d->arg_cap = cap;
+	}
+
+	int i = d->n_macro;
+	d->macro_offset[i] = state.macro_offset;
+	d->macro_id[i] = m->id;
+	d->macro_packets[i] = t->n_gfx;
+	d->macro_arg[i] = d->n_arg;
+	d->macro_arg[i + 1] = n_arg;
+
+	for (int j = 0; j < t->n_arg; j++)
+	{
+		const gfxd_arg_t *a = &m->arg[j];
+		int k = d->n_arg + j;
+
+		d->arg_type[k] = a->type;
+		d->arg_fmt[k] = config.ucode->arg_tbl[a->type].fmt;
+		d->arg_value[k] = a->value.u;
+		d->arg_valid[k] = a->bad == 0;
+	}
+
+	d->n_macro = n_macro;
+	d->n_arg = n_arg;
+
+	return 0;
+}
+
+#undef DECODE_GROW
+
+int gfxd_decode_all(gfxd_decode_t *d)
+{
+	gfxd_macro_fn_t *macro_fn = config.macro_fn;
+	int macro_filter_on = config.macro_filter_on;
+	gfxd_decode_t *decode_save = decode;
+
+	d->n_macro = 0;
+	d->n_arg = 0;
+
+	/* every macro is decoded, regardless of the macro filter */
+	decode = d;
+	config.macro_fn = decode_macro_fn;
+	config.macro_filter_on = 0;
+
+	int ret = gfxd_execute();
+
+	config.macro_fn = macro_fn;
+	config.macro_filter_on = macro_filter_on;
+	decode = decode_save;
+
+	return ret;
+}
+
+void gfxd_decode_free(gfxd_decode_t *d)
+{
+	free(d->macro_offset);
+	free(d->macro_id);
+	free(d->macro_packets);
+	free(d->macro_arg);
+	free(d->arg_type);
+	free(d->arg_fmt);
+	free(d->arg_value);
+	free(d->arg_valid);
+
+	memset(d, 0, sizeof(*d));
+}
+
 int gfxd_macro_offset(void)
 {
 	return state.macro_offset;
@@ -785,7 +1229,7 @@ int gfxd_macro_packets(void)
 
 const void *gfxd_macro_data(void)
 {
-	return state.gfx;
+	return &state.gfx[state.head];
 }
 
 int gfxd_macro_id(void)
@@ -878,6 +1322,26 @@ int gfxd_arg_valid(int arg_num)
 	return state.cur_macro.arg[arg_num].bad == 0;
 }
 
+int gfxd_args(gfxd_arg_info_t *args, int max_args)
+{
+	gfxd_macro_t *m = &state.cur_macro;
+	int n_arg = config.ucode->macro_tbl[m->id].n_arg;
+
+	for (int i = 0; i < n_arg && i < max_args; i++)
+	{
+		gfxd_arg_t *a = &m->arg[i];
+		gfxd_arg_info_t *info = &args[i];
+
+		info->type = a->type;
+		info->fmt = config.ucode->arg_tbl[a->type].fmt;
+		info->value = a->value;
+		info->valid = a->bad == 0;
+		info->name = a->name;
+	}
+
+	return n_arg;
+}
+
 int gfxd_foreach_pkt(int (*fn)(void))
 {
 	if (fn == NULL)
@@ -889,12 +1353,12 @@ int gfxd_foreach_pkt(int (*fn)(void))
 
 	for (int i = 0; i < n_pkt; i++)
 	{
-		gfxd_macro_t *m = &state.macro[i];
+		gfxd_macro_t *m = &state.macro[state.head + i];
 
 		const gfxd_macro_type_t *t = &config.ucode->macro_tbl[m->id];
 		if (t->ext != 0 && config.emit_ext_macro == 0)
 		{
-			Gfx gfx = state.gfx[0];
+			Gfx gfx = state.gfx[state.head];
 			swap_words(&gfx);
 
 			t = &config.ucode->macro_tbl[gfxd_Invalid];
@@ -284,17 +284,23 @@ typedef const struct gfxd_ucode *gfxd_ucode_t;
 
 typedef int gfxd_input_fn_t(void *buf, int count);
 void gfxd_input_buffer(const void *buf, int size);
+void gfxd_input_window(int offset, int size);
 void gfxd_input_fd(int fd);
 void gfxd_input_callback(gfxd_input_fn_t *fn);
+void gfxd_input_readahead(int size);
 
 typedef int gfxd_output_fn_t(const char *buf, int count);
 void gfxd_output_buffer(char *buf, int size);
+void gfxd_output_growable(void);
+const char *gfxd_output_string(int *size);
 void gfxd_output_fd(int fd);
 void gfxd_output_callback(gfxd_output_fn_t *fn);
+void gfxd_output_coalesce(int size);
 
 typedef int gfxd_macro_fn_t(void);
 void gfxd_macro_fn(gfxd_macro_fn_t *fn);
 gfxd_macro_fn_t gfxd_macro_dflt;
+void gfxd_macro_filter(const int *ids, int n_id, int skip);
 
 typedef void gfxd_arg_fn_t(int arg_num);
 void gfxd_arg_fn(gfxd_arg_fn_t *fn);
@@ -348,6 +354,7 @@ typedef int gfxd_dram_fn_t(uint32_t dram, uint32_t size);
 void gfxd_dram_callback(gfxd_dram_fn_t *fn);
 
 int gfxd_write(const void *buf, int count);
+int gfxd_flush(void);
 int gfxd_puts(const char *str);
 int gfxd_printf(const char *fmt, ...);
 int gfxd_print_value(int type, const gfxd_value_t *value);
@@ -361,6 +368,45 @@ void gfxd_udata_set(void *ptr);
 void *gfxd_udata_get(void);
 
 int gfxd_execute(void);
+void gfxd_execute_begin(void);
+int gfxd_execute_step(int max_macros);
+int gfxd_execute_done(void);
+
+typedef struct
+{
+	int		n_macro;
+	int32_t *	macro_offset;
+	int32_t *	macro_id;
+	int32_t *	macro_packets;
+	int32_t *	macro_arg;
+	int		n_arg;
+	int32_t *	arg_type;
+	int32_t *	arg_fmt;
+	uint32_t *	arg_value;
+	uint8_t *	arg_valid;
+	int		macro_cap;
+	int		arg_cap;
+} gfxd_decode_t;
+int gfxd_decode_all(gfxd_decode_t *d);
+void gfxd_decode_free(gfxd_decode_t *d);
+
+typedef struct
+{
+	int32_t		offset;
+	int32_t		macro_id;
+	int32_t		type;
+	uint32_t	address;
+	int32_t		param[5];
+} gfxd_ref_t;
+
+typedef struct
+{
+	int		n_ref;
+	gfxd_ref_t *	ref;
+	int		ref_cap;
+} gfxd_refs_t;
+void gfxd_ref_sink(gfxd_refs_t *r);
+void gfxd_refs_free(gfxd_refs_t *r);
 
 int gfxd_macro_offset(void);
 int gfxd_macro_packets(void);
@@ -378,6 +424,16 @@ const gfxd_value_t *gfxd_value_by_type(int type, int idx);
 int gfxd_arg_valid(int arg_num);
 int gfxd_arg_callbacks(int arg_num);
 
+typedef struct
+{
+	int		type;
+	int		fmt;
+	gfxd_value_t	value;
+	int		valid;
+	const char *	name;
+} gfxd_arg_info_t;
+int gfxd_args(gfxd_arg_info_t *args, int max_args);
+
 extern const gfxd_ucode_t gfxd_f3d;
 extern const gfxd_ucode_t gfxd_f3db;
 extern const gfxd_ucode_t gfxd_f3dex;
@@ -16,6 +16,9 @@
 
 #define config gfxd_config__
 
+#define RING_SIZE 9
+#define MACRO_FILTER_WORDS ((gfxd_Special1 + 32) / 32)
+
 typedef int gfxd_argfn_t(const gfxd_value_t *v);
 
 typedef struct
@@ -41,6 +44,7 @@ typedef struct
 typedef int gfxd_disas_fn_t(gfxd_macro_t *macro, uint32_t hi, uint32_t lo);
 typedef int gfxd_combine_fn_t(gfxd_macro_t *macro, gfxd_macro_t *macro_list,
 			      int n_macro);
+typedef void gfxd_init_fn_t(void);
 
 typedef struct
 {
@@ -61,20 +65,25 @@ struct gfxd_ucode
 	gfxd_combine_fn_t *		combine_fn;
 	const gfxd_arg_type_t *		arg_tbl;
 	const gfxd_macro_type_t *	macro_tbl;
+	gfxd_init_fn_t *		init_fn;
 };
 
 struct gfxd_state
 {
 	int			macro_offset;
 
-	Gfx			gfx[9];
+	/* the lookahead window of up to RING_SIZE packets starts at head, the
+	   ring is stored twice so that the window is always contiguous */
+	Gfx			gfx[RING_SIZE * 2];
 	int			n_byte;
 	int			n_gfx;
+	int			head;
 	gfxd_macro_t		cur_macro;
-	gfxd_macro_t		macro[9];
+	gfxd_macro_t		macro[RING_SIZE * 2];
 
 	int			end_input;
 	int			ret;
+	int			done;
 };
 
 struct gfxd_config
@@ -82,6 +91,7 @@ struct gfxd_config
 	gfxd_ucode_t		ucode;
 	int			endian;
 	int			wordsize;
+	int			swap_size;
 	const char *		arg;
 	void *			udata;
 
@@ -91,19 +101,37 @@ struct gfxd_config
 	int			emit_q_macro;
 	int			emit_ext_macro;
 
+	const char *		input_base;
+	int			input_base_size;
+	int			input_offset;
 	const char *		input_buf;
 	int			input_buf_size;
 	int			input_fd;
 	gfxd_input_fn_t *	input_fn;
+	char *			input_ra_buf;
+	int			input_ra_size;
+	int			input_ra_pos;
+	int			input_ra_len;
 
 	char *			output_buf;
 	int			output_buf_size;
+	char *			output_str;
+	int			output_str_size;
+	int			output_str_cap;
 	int			output_fd;
 	gfxd_output_fn_t *	output_fn;
+	char *			output_co_buf;
+	int			output_co_size;
+	int			output_co_len;
 
 	gfxd_macro_fn_t *	macro_fn;
 	gfxd_arg_fn_t *		arg_fn;
 
+	int			macro_filter_on;
+	int			macro_filter_skip;
+	uint32_t		macro_filter[MACRO_FILTER_WORDS];
+	gfxd_refs_t *		ref_sink;
+
 	gfxd_tlut_fn_t *	tlut_fn;
 	gfxd_timg_fn_t *	timg_fn;
 	gfxd_cimg_fn_t *	cimg_fn;
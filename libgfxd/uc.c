@@ -10,30 +10,69 @@
 #include "uc_macrofn.c"
 #include "uc_macrotbl.c"
 
-UCFUNC int disas(gfxd_macro_t *m, uint32_t hi, uint32_t lo)
+#define N_MACRO (sizeof(macro_tbl) / sizeof(macro_tbl[0]))
+
+_Static_assert(N_MACRO <= 0x100, "macro ids must fit in the dispatch tables");
+
+/* opcode-indexed dispatch tables, built from macro_tbl by init. these are
+   per-thread like init_done, so that a thread building its tables can never
+   be observed half-way by another thread that is disassembling */
+static TLOCAL uint8_t disas_tbl[0x100];
+/* holds counts of up to N_MACRO candidates, which need not fit in a byte */
+static TLOCAL uint16_t combine_idx[0x100 + 2];
+static TLOCAL uint8_t combine_tbl[N_MACRO];
+static TLOCAL int init_done;
+
+UCFUNC void init(void)
 {
-	int opcode = (hi >> 24) & 0xFF;
+	if (init_done != 0)
+		return;
 
-	for (int i = 0; i < sizeof(macro_tbl) / sizeof(macro_tbl[0]); i++)
+	/* first macro in table order wins, unmatched opcodes are invalid */
+	for (int i = 0; i < 0x100; i++)
+		disas_tbl[i] = gfxd_Invalid;
+	for (int i = N_MACRO - 1; i >= 0; i--)
 	{
 		const gfxd_macro_type_t *t = &macro_tbl[i];
-		if (t->disas_fn != NULL && t->opcode == opcode)
-			return t->disas_fn(m, hi, lo);
+		if (t->disas_fn != NULL && t->opcode >= 0 && t->opcode < 0x100)
+			disas_tbl[t->opcode] = i;
 	}
 
-	return d_Invalid(m, hi, lo);
+	/* combine candidates grouped by opcode (-1 included), in table order */
+	int n = 0;
+	for (int opcode = -1; opcode < 0x100; opcode++)
+	{
+		combine_idx[opcode + 1] = n;
+		for (int i = 0; i < N_MACRO; i++)
+		{
+			const gfxd_macro_type_t *t = &macro_tbl[i];
+			if (t->combine_fn != NULL && t->opcode == opcode)
+				combine_tbl[n++] = i;
+		}
+	}
+	combine_idx[0x100 + 1] = n;
+
+	init_done = 1;
+}
+
+UCFUNC int disas(gfxd_macro_t *m, uint32_t hi, uint32_t lo)
+{
+	int opcode = (hi >> 24) & 0xFF;
+
+	return macro_tbl[disas_tbl[opcode]].disas_fn(m, hi, lo);
 }
 
 UCFUNC int combine(gfxd_macro_t *m, gfxd_macro_t *m_list, int num)
 {
 	int opcode = macro_tbl[m_list[0].id].opcode;
+	if (opcode < -1 || opcode >= 0x100)
+		return -1;
 
-	for (int i = 0; i < sizeof(macro_tbl) / sizeof(macro_tbl[0]); i++)
+	int end = combine_idx[opcode + 2];
+	for (int i = combine_idx[opcode + 1]; i < end; i++)
 	{
-		const gfxd_macro_type_t *t = &macro_tbl[i];
-		if (t->combine_fn != NULL
-			&& t->opcode == opcode
-			&& (t->ext == 0 || config.emit_ext_macro != 0))
+		const gfxd_macro_type_t *t = &macro_tbl[combine_tbl[i]];
+		if (t->ext == 0 || config.emit_ext_macro != 0)
 		{
 			if (t->combine_fn(m, m_list, num) == 0)
 				return 0;
@@ -49,6 +88,7 @@ static const struct gfxd_ucode uc =
 	.combine_fn = combine,
 	.arg_tbl = arg_tbl,
 	.macro_tbl = macro_tbl,
+	.init_fn = init,
 };
 
 const gfxd_ucode_t uc_name = &uc;
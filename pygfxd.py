@@ -4,11 +4,16 @@
 #   https://github.com/glankk/libgfxd/
 #
 
-import io, os, struct
+import argparse, array, asyncio, functools, hashlib, io, mmap, os, struct, sys, tempfile, threading, time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
 from enum import IntEnum, auto
 import ctypes
 from ctypes import Structure, CFUNCTYPE, POINTER, create_string_buffer, byref, CDLL, c_void_p, c_char_p, c_uint32, c_int32, c_int, c_ubyte, c_float
-from typing import Callable, Tuple, Union
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Mapping, NamedTuple, Set, Tuple, Union
+
+__version__ = "1.0.5"
 
 # ====================================================================
 #   Library Internals
@@ -22,10 +27,57 @@ class gfx_ucode(Structure):
     _fields_=[("disas_fn",  gfxd_disas_fn_t),
               ("combine_fn", gfxd_combine_fn_t),
               ("arg_tbl",   c_void_p),
-              ("macro_tbl", c_void_p)]
+              ("macro_tbl", c_void_p),
+              ("init_fn",   CFUNCTYPE(None))]
 
 gfx_ucode_t = POINTER(gfx_ucode)
 
+# entries of gfx_ucode.macro_tbl, gfxd_macro_type_t
+class gfxd_macro_type(Structure):
+    _fields_=[("prefix",     c_char_p),
+              ("suffix",     c_char_p),
+              ("opcode",     c_int),
+              ("n_arg",      c_int),
+              ("n_gfx",      c_int),
+              ("disas_fn",   c_void_p),
+              ("combine_fn", c_void_p),
+              ("alias",      c_int),
+              ("ext",        c_int)]
+
+# argument information, gfxd_arg_info_t
+class gfxd_value(ctypes.Union):
+    _fields_=[("i", c_int32),
+              ("u", c_uint32),
+              ("f", c_float)]
+
+class gfxd_arg_info(Structure):
+    _fields_=[("type",  c_int),
+              ("fmt",   c_int),
+              ("value", gfxd_value),
+              ("valid", c_int),
+              ("name",  c_void_p)]
+
+# bulk decoding results, gfxd_decode_t
+class gfxd_decode(Structure):
+    _fields_=[("n_macro",       c_int),
+              ("macro_offset",  c_void_p),
+              ("macro_id",      c_void_p),
+              ("macro_packets", c_void_p),
+              ("macro_arg",     c_void_p),
+              ("n_arg",         c_int),
+              ("arg_type",      c_void_p),
+              ("arg_fmt",       c_void_p),
+              ("arg_value",     c_void_p),
+              ("arg_valid",     c_void_p),
+              ("macro_cap",     c_int),
+              ("arg_cap",       c_int)]
+
+# address argument records, gfxd_refs_t holding gfxd_ref_t
+class gfxd_refs(Structure):
+    _fields_=[("n_ref",   c_int),
+              ("ref",     c_void_p),
+              ("ref_cap", c_int)]
+
 # argument errors
 class GfxdArgumentError(Exception):
     """
@@ -40,14 +92,94 @@ class GfxdArgumentError(Exception):
         self.expression = expression
         self.message = message
 
-# gross way to prevent garbage collection of wrapped callbacks and buffers
-__gfxd_buffers_callbacks = {}
+# gross way to prevent garbage collection of wrapped callbacks and buffers.
+# libgfxd is built with CONFIG_MT, so its configuration is thread-local and
+# so are the references keeping the configured callbacks and buffers alive.
+class _ThreadLocalDict(threading.local):
+    def __init__(self):
+        self.items = {}
+
+    def get(self, key, default=None):
+        return self.items.get(key, default)
+
+    def update(self, other):
+        self.items.update(other)
+
+    def pop(self, key, default=None):
+        return self.items.pop(key, default)
+
+    def clear(self):
+        self.items.clear()
+
+__gfxd_buffers_callbacks = _ThreadLocalDict()
 
 def free_buffers_callbacks():
+    """
+    Drop the references to callbacks and buffers registered in the calling thread.
+    """
     __gfxd_buffers_callbacks.clear()
 
+def _keep_alive(setter, obj) -> None:
+    # keep obj alive while libgfxd uses it in the calling thread, in place of whatever
+    # was registered with the module-level setter before
+    if obj is not None:
+        __gfxd_buffers_callbacks.update({setter : obj})
+    else:
+        __gfxd_buffers_callbacks.pop(setter, None)
+
+# the Gfxd context whose I/O settings are currently applied in each thread
+_gfxd_thread = threading.local()
+
+def _release_io():
+    _gfxd_thread.context = None
+
+# the GfxdExecution whose state is held by libgfxd in each thread
+def _interrupt_execution():
+    _gfxd_thread.execution = None
+
+# buffer protocol access, used to hand the memory of bytes-like objects to libgfxd without copying
+class _Py_buffer(Structure):
+    _fields_=[("buf",        c_void_p),
+              ("obj",        c_void_p),
+              ("len",        ctypes.c_ssize_t),
+              ("itemsize",   ctypes.c_ssize_t),
+              ("readonly",   c_int),
+              ("ndim",       c_int),
+              ("format",     c_char_p),
+              ("shape",      c_void_p),
+              ("strides",    c_void_p),
+              ("suboffsets", c_void_p),
+              ("internal",   c_void_p)]
+
+ctypes.pythonapi.PyObject_GetBuffer.argtypes = [ctypes.py_object, POINTER(_Py_buffer), c_int]
+ctypes.pythonapi.PyObject_GetBuffer.restype = c_int
+ctypes.pythonapi.PyBuffer_Release.argtypes = [POINTER(_Py_buffer)]
+ctypes.pythonapi.PyBuffer_Release.restype = None
+
+class _PinnedBuffer:
+    """
+    Holds a contiguous buffer export of obj (bytes, bytearray, memoryview, mmap, ...)
+    for as long as this object is alive. While pinned, the exporter is kept alive and
+    cannot be resized or closed, so the address remains valid.
+    """
+    # bound here, module globals may already be cleared when __del__ runs at exit
+    _release = ctypes.pythonapi.PyBuffer_Release
+    _byref = staticmethod(byref)
+
+    def __init__(self, obj):
+        self.view = _Py_buffer()
+        # PyBUF_SIMPLE: contiguous bytes, read-only exports are accepted
+        ctypes.pythonapi.PyObject_GetBuffer(obj, byref(self.view), 0)
+        self.address = self.view.buf
+        self.size = self.view.len
+
+    def __del__(self):
+        if self.view.obj is not None:
+            self._release(self._byref(self.view))
+
 # Load the shared library into ctypes
-lgfxd = CDLL(os.path.join(os.path.dirname(__file__), "libgfxd.so"))
+_LIBGFXD_PATH = os.path.join(os.path.dirname(__file__), "libgfxd.so")
+lgfxd = CDLL(_LIBGFXD_PATH)
 
 # ====================================================================
 #   Constants
@@ -159,13 +291,13 @@ class GfxdMacroId(IntEnum):
     SP1Triangle = auto()
     SP2Triangles = auto()
     SP1Quadrangle = auto()
-    SPBranchLessZ = auto()
-    SPBranchLessZrg = auto()
+    SPBranchLessZraw = auto()
     SPBranchList = auto()
     SPClipRatio = auto()
     SPCullDisplayList = auto()
     SPDisplayList = auto()
     SPEndDisplayList = auto()
+    SPFogFactor = auto()
     SPFogPosition = auto()
     SPForceMatrix = auto()
     SPSetGeometryMode = auto()
@@ -205,8 +337,10 @@ class GfxdMacroId(IntEnum):
     DisplayList = auto()
     DPHalf1 = auto()
     DPHalf2 = auto()
+    DPWord = auto()
     DPLoadTile = auto()
     SPGeometryMode = auto()
+    SPSetOtherMode = auto()
     SPSetOtherModeLo = auto()
     SPSetOtherModeHi = auto()
     DPSetOtherMode = auto()
@@ -330,19 +464,34 @@ class GfxdArgType(IntEnum):
 
 lgfxd.gfxd_input_buffer.argtypes = [c_void_p, c_int]
 lgfxd.gfxd_input_buffer.restype = None
-def gfxd_input_buffer(buf: Union[bytes, None], size: int = -1) -> Union[c_void_p, None]:
+def gfxd_input_buffer(buf: Union[bytes, bytearray, memoryview, None], size: int = -1) -> Union[c_void_p, None]:
     """
     Read input from the buffer pointed to by buf, of size bytes.
     If size is negative, len(buf) is used instead which is
     default.
     buf may be None to unset the input buffer
+
+    buf may be any object supporting the buffer protocol, such as bytes, bytearray,
+    a contiguous memoryview slice or an mmap. The data is not copied, instead buf is
+    kept alive and locked against resizing until the input buffer is replaced.
+
+    A size smaller than len(buf) uses a prefix of buf. A larger size reads a copy of
+    buf padded with zeros to size bytes, as in earlier versions.
     """
+    _release_io()
     if buf is not None:
-        size = len(buf) if size < 0 else size
-
-        buffer = create_string_buffer(buf, size)
+        pin = _PinnedBuffer(buf)
+        if size < 0:
+            size = pin.size
+
+        if size > pin.size:
+            buffer = create_string_buffer(ctypes.string_at(pin.address, pin.size), size)
+            del pin
+        else:
+            buffer = (ctypes.c_char * size).from_address(pin.address)
+            buffer._pin = pin
         __gfxd_buffers_callbacks.update({gfxd_input_buffer : buffer})
-        lgfxd.gfxd_input_buffer(buffer, size)
+        lgfxd.gfxd_input_buffer(ctypes.addressof(buffer), size)
         return buffer
     else:
         if size > 0:
@@ -351,6 +500,49 @@ def gfxd_input_buffer(buf: Union[bytes, None], size: int = -1) -> Union[c_void_p
         __gfxd_buffers_callbacks.pop(gfxd_input_buffer, None)
         return None
 
+lgfxd.gfxd_output_growable.argtypes = None
+lgfxd.gfxd_output_growable.restype = None
+def gfxd_output_growable() -> None:
+    """
+    Output to an internal buffer managed by libgfxd, which grows as needed so
+    that output is never truncated. The buffer is emptied by this call.
+
+    The output can be fetched with gfxd_output_string after gfxd_execute.
+    """
+    _release_io()
+    lgfxd.gfxd_output_growable()
+
+lgfxd.gfxd_output_string.argtypes = [POINTER(c_int)]
+lgfxd.gfxd_output_string.restype = c_void_p
+def gfxd_output_string(as_bytes: bool = False) -> Union[str, bytes]:
+    """
+    Returns the contents of the internal output buffer selected with gfxd_output_growable,
+    as a str, or as bytes if as_bytes is True.
+    """
+    size = c_int()
+    data = ctypes.string_at(lgfxd.gfxd_output_string(byref(size)), size.value)
+    return data if as_bytes else data.decode("utf-8")
+
+lgfxd.gfxd_input_window.argtypes = [c_int, c_int]
+lgfxd.gfxd_input_window.restype = None
+def gfxd_input_window(offset: int, size: int = -1) -> None:
+    """
+    Restrict input to size bytes starting at offset of the buffer registered with
+    gfxd_input_buffer, and select that buffer as input again. If size is negative,
+    the input extends to the end of the buffer.
+
+    gfxd_macro_offset reports offsets from the start of the whole buffer, so one large
+    buffer (e.g. a ROM image or mmap) can be registered once and disassembled at many
+    offsets without slicing or copying.
+    """
+    buffer = __gfxd_buffers_callbacks.get(gfxd_input_buffer)
+    if buffer is None:
+        raise ValueError("No input buffer registered with gfxd_input_buffer")
+    if offset < 0 or offset > len(buffer):
+        raise ValueError(f"Offset 0x{offset:X} is outside of the input buffer")
+
+    lgfxd.gfxd_input_window(offset, size)
+
 lgfxd.gfxd_output_buffer.argtypes = [c_char_p, c_int]
 lgfxd.gfxd_output_buffer.restype = None
 def gfxd_output_buffer(buf: Union[bytes, None], size: int = -1) -> Union[c_void_p, None]:
@@ -360,6 +552,7 @@ def gfxd_output_buffer(buf: Union[bytes, None], size: int = -1) -> Union[c_void_
     default.
     buf may be None to unset the output buffer
     """
+    _release_io()
     if buf is not None:
         size = len(buf) if size < 0 else size
 
@@ -380,6 +573,7 @@ def gfxd_input_fd(stream: io.IOBase) -> None:
     """
     Read input from the provided stream implementing IOBase
     """
+    _release_io()
     lgfxd.gfxd_input_fd(stream.fileno())
 
 lgfxd.gfxd_output_fd.argtypes = [c_int]
@@ -388,6 +582,7 @@ def gfxd_output_fd(stream: io.IOBase) -> None:
     """
     Output to the provided stream implementing IOBase
     """
+    _release_io()
     lgfxd.gfxd_output_fd(stream.fileno())
 
 lgfxd.gfxd_input_callback.argtypes = [CFUNCTYPE(c_int, c_void_p, c_int)]
@@ -400,6 +595,7 @@ def gfxd_input_callback(fn: Union[Callable[[bytes, int], int], None]) -> None:
     fn should copy at most count bytes to/from buf, and return the number of bytes actually copied.
     The input callback should return 0 to signal end of input.
     """
+    _release_io()
     cb_type = CFUNCTYPE(c_int, c_void_p, c_int)
     if fn is not None:
         cb = cb_type(fn)
@@ -409,6 +605,23 @@ def gfxd_input_callback(fn: Union[Callable[[bytes, int], int], None]) -> None:
         lgfxd.gfxd_input_callback(cb_type())
         __gfxd_buffers_callbacks.pop(gfxd_input_callback, None)
 
+lgfxd.gfxd_input_readahead.argtypes = [c_int]
+lgfxd.gfxd_input_readahead.restype = None
+def gfxd_input_readahead(size: int) -> None:
+    """
+    Set the size of the read-ahead buffer for gfxd_input_fd and gfxd_input_callback input,
+    64 KiB by default. Input is read from the stream or callback in chunks of up to size
+    bytes rather than a few packets at a time.
+
+    When gfxd_execute ends, data read ahead from a stream but not used is given back by
+    seeking, so the stream position can be moved between executions as without read-ahead.
+    Data read ahead from a callback or an unseekable stream is kept for the next execution
+    with the same input.
+
+    A size of zero disables read-ahead. Any data already read ahead is discarded.
+    """
+    lgfxd.gfxd_input_readahead(size)
+
 lgfxd.gfxd_output_callback.argtypes = [CFUNCTYPE(c_int, c_char_p, c_int)]
 lgfxd.gfxd_output_callback.restype = None
 def gfxd_output_callback(fn: Union[Callable[[bytes, int], int], None]) -> None:
@@ -418,15 +631,32 @@ def gfxd_output_callback(fn: Union[Callable[[bytes, int], int], None]) -> None:
 
     fn should copy at most count bytes to/from buf, and return the number of bytes actually copied.
     """
+    _release_io()
     cb_type = CFUNCTYPE(c_int, c_char_p, c_int)
     if fn is not None:
         cb = cb_type(fn)
+        # pending output goes to the previous callback, while it is still alive
+        lgfxd.gfxd_flush()
         __gfxd_buffers_callbacks.update({gfxd_output_callback : cb})
         lgfxd.gfxd_output_callback(cb)
     else:
         lgfxd.gfxd_output_callback(cb_type())
         __gfxd_buffers_callbacks.pop(gfxd_output_callback, None)
 
+lgfxd.gfxd_output_coalesce.argtypes = [c_int]
+lgfxd.gfxd_output_coalesce.restype = None
+def gfxd_output_coalesce(size: int) -> None:
+    """
+    Set the size of the coalescing buffer for gfxd_output_fd and gfxd_output_callback output.
+    Output is collected and written to the stream or callback in chunks of up to size bytes
+    rather than one piece of text at a time. Pending output is flushed when the buffer is
+    full, when gfxd_execute returns and when a new output is selected, output written outside
+    of gfxd_execute must be flushed with gfxd_flush.
+
+    A size of zero, which is the default, disables coalescing.
+    """
+    lgfxd.gfxd_output_coalesce(size)
+
 # ====================================================================
 #   Handlers
 # ====================================================================
@@ -466,6 +696,24 @@ def gfxd_macro_fn(fn: Union[Callable[[], int], None]) -> None:
         lgfxd.gfxd_macro_fn(cb_type())
         __gfxd_buffers_callbacks.pop(gfxd_macro_fn, None)
 
+lgfxd.gfxd_macro_filter.argtypes = [POINTER(c_int), c_int, c_int]
+lgfxd.gfxd_macro_filter.restype = None
+def gfxd_macro_filter(ids: Union[Iterable[GfxdMacroId], None], skip: bool = False) -> None:
+    """
+    Restrict the macro handler to the macros in ids. For any other macro, gfxd_macro_dflt
+    is called instead of the macro handler if skip is False, or nothing is called if skip
+    is True. Either way, execution continues with the next macro.
+
+    The filter is checked in libgfxd, so the macro handler is not called at all for other
+    macros. If ids is None, the filter is removed. The filter does not apply to
+    gfxd_decode_all.
+    """
+    if ids is None:
+        lgfxd.gfxd_macro_filter(None, 0, 0)
+    else:
+        ids = [int(macro_id) for macro_id in ids]
+        lgfxd.gfxd_macro_filter((c_int * len(ids))(*ids), len(ids), int(skip))
+
 lgfxd.gfxd_arg_dflt.argtypes = [c_int]
 lgfxd.gfxd_arg_dflt.restype = None
 def gfxd_arg_dflt(arg_num: int) -> None:
@@ -533,9 +781,13 @@ def gfxd_tlut_callback(fn: Union[Callable[[int, int, int], int], None]) -> None:
     The palette index is in idx and the number of colors in count.
     """
     cb_type = CFUNCTYPE(c_int, c_uint32, c_int32, c_int32)
-    cb = cb_type(fn)
-    __gfxd_buffers_callbacks.update({gfxd_tlut_callback : cb})
-    lgfxd.gfxd_tlut_callback(cb)
+    if fn is not None:
+        cb = cb_type(fn)
+        __gfxd_buffers_callbacks.update({gfxd_tlut_callback : cb})
+        lgfxd.gfxd_tlut_callback(cb)
+    else:
+        lgfxd.gfxd_tlut_callback(cb_type())
+        __gfxd_buffers_callbacks.pop(gfxd_tlut_callback, None)
 
 lgfxd.gfxd_timg_callback.argtypes = [CFUNCTYPE(c_int, c_uint32, c_int32, c_int32, c_int32, c_int32, c_int32)]
 lgfxd.gfxd_timg_callback.restype = None
@@ -808,6 +1060,102 @@ def gfxd_dram_callback(fn: Union[Callable[[int, int], int], None]) -> None:
         lgfxd.gfxd_dram_callback(cb_type())
         __gfxd_buffers_callbacks.pop(gfxd_dram_callback, None)
 
+class AddressRef(NamedTuple):
+    """
+    An address argument recorded by a RefSink.
+
+    params are the parameters following the address that the callback for the argument
+    type would receive, for example (fmt, siz, width, height, pal) for GfxdArgType.Timg.
+    """
+    offset: int
+    macro_id: GfxdMacroId
+    type: GfxdArgType
+    address: int
+    params: Tuple[int, ...]
+
+# argument type -> (number of callback parameters, whether they are unsigned)
+_REF_PARAMS = {
+    GfxdArgType.Tlut : (2, False),
+    GfxdArgType.Timg : (5, False),
+    GfxdArgType.Cimg : (3, False),
+    GfxdArgType.Lookatptr : (1, False),
+    GfxdArgType.Lightsn : (1, False),
+    GfxdArgType.Segptr : (1, False),
+    GfxdArgType.Vtxptr : (1, False),
+    GfxdArgType.Uctext : (1, True),
+    GfxdArgType.Ucdata : (1, True),
+    GfxdArgType.Dram : (1, True),
+}
+
+# int32 fields of gfxd_ref_t
+_REF_FIELDS = 9
+
+lgfxd.gfxd_refs_free.argtypes = [POINTER(gfxd_refs)]
+lgfxd.gfxd_refs_free.restype = None
+
+class RefSink:
+    """
+    Native storage for the address arguments of executed macros, see gfxd_ref_sink.
+
+    Every address argument a callback could be registered for is recorded by libgfxd
+    without calling into Python, and the records are read back as a batch after the
+    execution.
+    """
+
+    def __init__(self):
+        self._refs = gfxd_refs()
+
+    def __len__(self) -> int:
+        return self._refs.n_ref
+
+    def raw(self) -> array.array:
+        """
+        Returns the records as a flat array of int32 with 9 entries per record:
+            offset, macro id, arg type, address, 5 params
+        """
+        return _column("i", self._refs.ref, self._refs.n_ref * _REF_FIELDS)
+
+    def refs(self) -> List[AddressRef]:
+        """Returns the records as AddressRef tuples, in the order they were made."""
+        raw = self.raw()
+        addresses = array.array("I", raw[3::_REF_FIELDS].tobytes())
+        refs = []
+        for i, offset, macro_id, arg_type, address in zip(range(4, len(raw), _REF_FIELDS), raw[0::_REF_FIELDS],
+                                                          raw[1::_REF_FIELDS], raw[2::_REF_FIELDS], addresses):
+            arg_type = _ARG_TYPES[arg_type]
+            n, unsigned = _REF_PARAMS.get(arg_type, (0, False))
+            params = tuple(raw[i : i + n])
+            if unsigned:
+                params = tuple(p & 0xFFFFFFFF for p in params)
+            refs.append(AddressRef(offset, _MACRO_IDS[macro_id], arg_type, address, params))
+        return refs
+
+    def clear(self) -> None:
+        """Discard the records, keeping the allocated storage."""
+        self._refs.n_ref = 0
+
+    def __del__(self):
+        lgfxd.gfxd_refs_free(byref(self._refs))
+
+lgfxd.gfxd_ref_sink.argtypes = [POINTER(gfxd_refs)]
+lgfxd.gfxd_ref_sink.restype = None
+def gfxd_ref_sink(sink: Union[RefSink, None]) -> None:
+    """
+    Record every address argument of subsequently executed macros into sink, in addition
+    to calling the macro handler. These are the arguments that gfxd_arg_callbacks would
+    pass to a callback, with the same address and parameters. The macro filter does not
+    apply to the records.
+
+    If sink is None, no more records are made. If memory could not be allocated, execution
+    stops and gfxd_execute returns -2.
+    """
+    if sink is not None:
+        __gfxd_buffers_callbacks.update({gfxd_ref_sink : sink})
+        lgfxd.gfxd_ref_sink(byref(sink._refs))
+    else:
+        lgfxd.gfxd_ref_sink(None)
+        __gfxd_buffers_callbacks.pop(gfxd_ref_sink, None)
+
 # ====================================================================
 #   General Settings
 # ====================================================================
@@ -844,6 +1192,44 @@ def gfxd_endian(endian: GfxdEndian, wordsize: int) -> None:
     """
     lgfxd.gfxd_endian(int(endian), wordsize)
 
+@functools.lru_cache(maxsize=None)
+def _numpy():
+    # numpy is optional, imported on first use
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def normalize_endian(buf: Union[bytes, bytearray, memoryview], endian: GfxdEndian, wordsize: int) -> bytes:
+    """
+    Returns a copy of the data in buf, stored as words of wordsize bytes with the given
+    endianness (see gfxd_endian), converted to big-endian.
+
+    Data that is normalized once can be disassembled any number of times with the default
+    gfxd_endian(GfxdEndian.big, 4), for which libgfxd does not reorder any bytes.
+    The words are swapped with numpy if it is installed, or with array otherwise.
+    """
+    endian = GfxdEndian(endian)
+    if wordsize not in (1, 2, 4, 8):
+        raise ValueError(f"Invalid word size {wordsize}")
+    if endian == GfxdEndian.host:
+        endian = GfxdEndian.little if sys.byteorder == "little" else GfxdEndian.big
+
+    with memoryview(buf) as view, view.cast("B") as data:
+        if data.nbytes % wordsize != 0:
+            raise ValueError(f"Data size 0x{data.nbytes:X} is not a multiple of the word size")
+        if endian == GfxdEndian.big or wordsize == 1:
+            return data.tobytes()
+
+        np = _numpy()
+        if np is not None:
+            return np.frombuffer(data, dtype=f"u{wordsize}").byteswap().tobytes()
+        words = array.array(next(t for t in "HILQ" if array.array(t).itemsize == wordsize))
+        words.frombytes(data)
+        words.byteswap()
+        return words.tobytes()
+
 lgfxd.gfxd_dynamic.argtypes = [c_char_p]
 lgfxd.gfxd_dynamic.restype = None
 def gfxd_dynamic(arg: str) -> None:
@@ -944,8 +1330,59 @@ def gfxd_execute() -> int:
     If execution ends because the macro handler returns non-zero, the return value from the macro handler is returned.
     Otherwise zero is returned.
     """
+    _interrupt_execution()
     return lgfxd.gfxd_execute()
 
+def gfxd_execute_at(offset: int, max_bytes: int = -1) -> int:
+    """
+    Execute gfxd starting at offset of the buffer registered with gfxd_input_buffer,
+    reading at most max_bytes bytes (to the end of the buffer if negative).
+    See gfxd_input_window and gfxd_execute.
+    """
+    gfxd_input_window(offset, max_bytes)
+    return gfxd_execute()
+
+def gfxd_execute_many(offsets: Iterable[int], max_bytes: int = -1) -> List[int]:
+    """
+    Execute gfxd at each offset of the buffer registered with gfxd_input_buffer, in order,
+    as for gfxd_execute_at. Returns the return value of each execution.
+
+    The macro handler can tell the runs apart with gfxd_macro_offset, which reports
+    offsets relative to the start of the buffer.
+    """
+    return [gfxd_execute_at(offset, max_bytes) for offset in offsets]
+
+lgfxd.gfxd_execute_begin.argtypes = None
+lgfxd.gfxd_execute_begin.restype = None
+def gfxd_execute_begin() -> None:
+    """
+    Start an incremental execution with the current settings, to be continued with
+    gfxd_execute_step. See GfxdExecution for a handle that checks it is not interrupted.
+    """
+    _interrupt_execution()
+    lgfxd.gfxd_execute_begin()
+
+lgfxd.gfxd_execute_step.argtypes = [c_int]
+lgfxd.gfxd_execute_step.restype = c_int
+def gfxd_execute_step(max_macros: int = -1) -> int:
+    """
+    Continue the execution started with gfxd_execute_begin for at most max_macros macros,
+    or until it ends if max_macros is negative. The lookahead packets are kept between
+    steps, so no input is read or decoded twice.
+
+    Returns zero while the execution is suspended, and the value gfxd_execute would have
+    returned once it has ended (see gfxd_execute_done).
+    """
+    return lgfxd.gfxd_execute_step(max_macros)
+
+lgfxd.gfxd_execute_done.argtypes = None
+lgfxd.gfxd_execute_done.restype = c_int
+def gfxd_execute_done() -> bool:
+    """
+    Returns True once the execution started with gfxd_execute_begin has ended.
+    """
+    return lgfxd.gfxd_execute_done() != 0
+
 # ====================================================================
 #   Macro Information
 # ====================================================================
@@ -955,7 +1392,8 @@ lgfxd.gfxd_macro_offset.restype = c_int
 def gfxd_macro_offset() -> int:
     """
     Returns the offset in the input data of the current macro.
-    The offset starts at zero when gfxd_execute is called.
+    The offset starts at zero when gfxd_execute is called, or at the start of the
+    input window selected with gfxd_input_window / gfxd_execute_at.
     """
     return lgfxd.gfxd_macro_offset()
 
@@ -985,15 +1423,39 @@ def gfxd_foreach_pkt(fn: Callable[[], int]) -> int:
     # gfxd_foreach_pkt does not store `fn`, no need to keep the callback alive
     return lgfxd.gfxd_foreach_pkt(cb)
 
+# the most packets of any macro, RING_SIZE in libgfxd
+_GFXD_MAX_PACKETS = 9
+_MACRO_DATA_TYPES = [c_ubyte * (8 * n) for n in range(_GFXD_MAX_PACKETS + 1)]
+
 lgfxd.gfxd_macro_data.argtypes = None
 lgfxd.gfxd_macro_data.restype = c_void_p
-def gfxd_macro_data() -> bytearray:
+def _macro_data_array():
+    return _MACRO_DATA_TYPES[lgfxd.gfxd_macro_packets()].from_address(lgfxd.gfxd_macro_data())
+
+def gfxd_macro_data(out: Union[bytearray, memoryview, None] = None) -> Union[bytearray, int]:
     """
     Returns a bytearray object of the input data for the current macro.
     The data is not byte-swapped. The data has a length of 8 * gfxd_macro_packets().
+
+    If out is given, the data is instead copied to the start of out, which may be any writable
+    object supporting the buffer protocol, and the number of bytes copied is returned.
+    """
+    data = _macro_data_array()
+    if out is None:
+        return bytearray(data)
+    n = len(data)
+    out = memoryview(out).cast("B")
+    if len(out) < n:
+        raise ValueError(f"out is too small for {n} bytes of macro data")
+    out[:n] = memoryview(data).cast("B")
+    return n
+
+def gfxd_macro_view() -> memoryview:
+    """
+    Returns a read-only memoryview of the input data for the current macro, as gfxd_macro_data
+    without copying it. The view is only valid until the macro handler returns.
     """
-    lgfxd.gfxd_macro_data.restype = POINTER(c_ubyte * (8 * gfxd_macro_packets()))
-    return bytearray(lgfxd.gfxd_macro_data().contents)
+    return memoryview(_macro_data_array()).cast("B").toreadonly()
 
 lgfxd.gfxd_macro_id.argtypes = None
 lgfxd.gfxd_macro_id.restype = c_int
@@ -1101,21 +1563,71 @@ def gfxd_arg_valid(arg_num: int) -> bool:
     """
     return lgfxd.gfxd_arg_valid(arg_num) != 0
 
+# the most arguments of any macro, gfxd_macro_t.arg
+_GFXD_MAX_ARGS = 18
+_arg_names: Dict[int, str] = {}
+_ARG_TYPES = {t.value : t for t in GfxdArgType}
+_MACRO_IDS = {m.value : m for m in GfxdMacroId}
+_ARG_FMTS = {f.value : f for f in GfxdArgfmt}
+
+lgfxd.gfxd_args.argtypes = [POINTER(gfxd_arg_info), c_int]
+lgfxd.gfxd_args.restype = c_int
+def gfxd_args(raw: bool = False) -> List[Tuple[GfxdArgType, GfxdArgfmt, Tuple[int, int, float], bool, str]]:
+    """
+    Returns all arguments of the current macro at once, as the tuples
+        (arg type, arg fmt, arg value, arg valid, arg name)
+    with the values gfxd_arg_type, gfxd_arg_fmt, gfxd_arg_value, gfxd_arg_valid and gfxd_arg_name
+    would return for each argument.
+
+    If raw is True, the type and fmt are returned as plain ints and the value as only the
+    unsigned int representation, which is faster when many macros are inspected.
+    """
+    args = getattr(_gfxd_thread, "args", None)
+    if args is None:
+        args = _gfxd_thread.args = (gfxd_arg_info * _GFXD_MAX_ARGS)()
+    n = lgfxd.gfxd_args(args, _GFXD_MAX_ARGS)
+
+    result = []
+    for i in range(n):
+        a = args[i]
+        name = _arg_names.get(a.name)
+        if name is None:
+            # argument names are static strings of the ucode tables
+            name = _arg_names[a.name] = ctypes.string_at(a.name).decode('utf-8')
+        v = a.value
+        if raw:
+            result.append((a.type, a.fmt, v.u, a.valid != 0, name))
+        else:
+            result.append((_ARG_TYPES[a.type], _ARG_FMTS[a.fmt], (v.i, v.u, v.f), a.valid != 0, name))
+    return result
+
 # ====================================================================
 #   Custom Output
 # ====================================================================
 
-lgfxd.gfxd_write.argtypes = [c_void_p]
+lgfxd.gfxd_write.argtypes = [c_void_p, c_int]
 lgfxd.gfxd_write.restype = c_int
-def gfxd_write(data: bytes) -> int:
+def gfxd_write(data: Union[bytes, bytearray, memoryview]) -> int:
     """
     Insert count bytes from the buffer at buf into the output.
 
+    data may be any object supporting the buffer protocol, it is passed to libgfxd without
+    copying.
+
     The number of characters written is returned.
     """
-    buffer = create_string_buffer(data, len(data))
-    __gfxd_buffers_callbacks.update({10001 : buffer})
-    return lgfxd.gfxd_write(c_char_p(buffer), len(buffer))
+    pin = _PinnedBuffer(data)
+    return lgfxd.gfxd_write(pin.address, pin.size)
+
+lgfxd.gfxd_flush.argtypes = None
+lgfxd.gfxd_flush.restype = c_int
+def gfxd_flush() -> int:
+    """
+    Write any output pending in the coalescing buffer (see gfxd_output_coalesce).
+
+    The value returned by the output function is returned, or zero if nothing was pending.
+    """
+    return lgfxd.gfxd_flush()
 
 lgfxd.gfxd_puts.argtypes = [c_char_p]
 lgfxd.gfxd_puts.restype = c_int
@@ -1154,6 +1666,1945 @@ def gfxd_print_value(type: GfxdArgType, value: Tuple[int, int, float]) -> int:
     """
     return lgfxd.gfxd_print_value(int(type), byref(c_int32(value[0])))
 
+# ====================================================================
+#   Bulk Decoding
+# ====================================================================
+
+def _column(typecode: str, address: int, count: int) -> array.array:
+    col = array.array(typecode)
+    if count != 0:
+        col.frombytes((c_ubyte * (count * col.itemsize)).from_address(address))
+    return col
+
+def _value_tuple(u: int) -> Tuple[int, int, float]:
+    return (
+        u - 0x100000000 if u & 0x80000000 else u,
+        u,
+        struct.unpack("=f", struct.pack("=I", u))[0],
+    )
+
+class MacroRow:
+    """
+    A view of one macro of a MacroTable, without copying any of its data.
+
+    For compatibility with earlier versions, a row also behaves as the tuple
+        (offset, macro id, packets, [(arg type, arg fmt, arg value, arg valid), ...])
+    """
+    __slots__ = ("table", "index")
+
+    def __init__(self, table: "MacroTable", index: int):
+        self.table = table
+        self.index = index
+
+    @property
+    def offset(self) -> int:
+        return self.table.offset[self.index]
+
+    @property
+    def id(self) -> GfxdMacroId:
+        return GfxdMacroId(self.table.macro_id[self.index])
+
+    @property
+    def packets(self) -> int:
+        return self.table.packets[self.index]
+
+    @property
+    def arg_count(self) -> int:
+        return self.table.arg_start[self.index + 1] - self.table.arg_start[self.index]
+
+    def arg_type(self, arg_num: int) -> GfxdArgType:
+        return GfxdArgType(self.table.arg_type[self._arg(arg_num)])
+
+    def arg_fmt(self, arg_num: int) -> GfxdArgfmt:
+        return GfxdArgfmt(self.table.arg_fmt[self._arg(arg_num)])
+
+    def arg_value(self, arg_num: int) -> Tuple[int, int, float]:
+        return _value_tuple(self.table.arg_value[self._arg(arg_num)])
+
+    def arg_valid(self, arg_num: int) -> bool:
+        return self.table.arg_valid[self._arg(arg_num)] != 0
+
+    def _arg(self, arg_num: int) -> int:
+        if arg_num < 0 or arg_num >= self.arg_count:
+            raise IndexError("argument index out of range")
+        return self.table.arg_start[self.index] + arg_num
+
+    @property
+    def args(self) -> List[Tuple[GfxdArgType, GfxdArgfmt, Tuple[int, int, float], bool]]:
+        t = self.table
+        return [
+            (GfxdArgType(t.arg_type[j]), GfxdArgfmt(t.arg_fmt[j]), _value_tuple(t.arg_value[j]), t.arg_valid[j] != 0)
+            for j in range(t.arg_start[self.index], t.arg_start[self.index + 1])
+        ]
+
+    def as_tuple(self) -> Tuple[int, GfxdMacroId, int, List[Tuple[GfxdArgType, GfxdArgfmt, Tuple[int, int, float], bool]]]:
+        return (self.offset, self.id, self.packets, self.args)
+
+    def __len__(self) -> int:
+        return 4
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __getitem__(self, i):
+        return self.as_tuple()[i]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (MacroRow, tuple)):
+            return self.as_tuple() == tuple(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"MacroRow(offset=0x{self.offset:X}, id={self.id!r}, packets={self.packets}, args={self.args!r})"
+
+class MacroTable:
+    """
+    Columnar result of gfxd_decode_all, stored in typed arrays of a few bytes per macro
+    and argument rather than as Python objects.
+
+    Macro columns (one entry per macro):
+        offset -- offset of the macro in the input data
+        macro_id -- GfxdMacroId of the macro
+        packets -- number of Gfx packets in the macro
+        arg_start -- index of the macro's first argument in the argument columns,
+                     with one extra entry marking the end of the last macro
+
+    Argument columns (one entry per argument):
+        arg_type -- GfxdArgType of the argument
+        arg_fmt -- GfxdArgfmt of the argument
+        arg_value -- raw 32-bit value of the argument, interpret according to arg_fmt
+        arg_valid -- non-zero if the argument is valid, see gfxd_arg_valid
+
+    ret is the return value of the underlying gfxd_execute.
+
+    Indexing with an integer returns a MacroRow view, and iterating yields a MacroRow
+    for each macro. Indexing with a slice, and filter, return a new MacroTable holding
+    only the selected macros. Tables pickle as their arrays, keeping the compact layout.
+    """
+    __slots__ = ("offset", "macro_id", "packets", "arg_start", "arg_type", "arg_fmt", "arg_value", "arg_valid", "ret")
+
+    def __init__(self, offset: array.array, macro_id: array.array, packets: array.array,
+                 arg_start: array.array, arg_type: array.array, arg_fmt: array.array,
+                 arg_value: array.array, arg_valid: array.array, ret: int = 0):
+        self.offset = offset
+        self.macro_id = macro_id
+        self.packets = packets
+        self.arg_start = arg_start
+        self.arg_type = arg_type
+        self.arg_fmt = arg_fmt
+        self.arg_value = arg_value
+        self.arg_valid = arg_valid
+        self.ret = ret
+
+    def __len__(self) -> int:
+        return len(self.offset)
+
+    def __iter__(self):
+        for i in range(len(self.offset)):
+            yield MacroRow(self, i)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[MacroRow, "MacroTable"]:
+        """
+        Returns the macro with index i as a MacroRow, or the macros selected by a slice
+        as a new MacroTable.
+        """
+        if isinstance(i, slice):
+            return self.select(range(*i.indices(len(self))))
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("macro index out of range")
+        return MacroRow(self, i)
+
+    def __reduce__(self):
+        return (MacroTable, (self.offset, self.macro_id, self.packets, self.arg_start, self.arg_type,
+                             self.arg_fmt, self.arg_value, self.arg_valid, self.ret))
+
+    @property
+    def nbytes(self) -> int:
+        """The total size of the arrays, in bytes."""
+        columns = (self.offset, self.macro_id, self.packets, self.arg_start,
+                   self.arg_type, self.arg_fmt, self.arg_value, self.arg_valid)
+        return sum(column.itemsize * len(column) for column in columns)
+
+    def compact(self) -> "MacroTable":
+        """
+        Returns a copy of the table with the macro id, packet count, argument type and
+        argument format columns narrowed to one byte each, for long-lived tables.
+        """
+        narrow = lambda column: array.array("B", column)
+        return MacroTable(array.array(self.offset.typecode, self.offset), narrow(self.macro_id), narrow(self.packets),
+                          array.array(self.arg_start.typecode, self.arg_start), narrow(self.arg_type),
+                          narrow(self.arg_fmt), array.array(self.arg_value.typecode, self.arg_value),
+                          array.array(self.arg_valid.typecode, self.arg_valid), self.ret)
+
+    def select(self, indices: Iterable[int]) -> "MacroTable":
+        """Returns a new MacroTable holding the macros with the given indices, in order."""
+        offset = array.array(self.offset.typecode)
+        macro_id = array.array(self.macro_id.typecode)
+        packets = array.array(self.packets.typecode)
+        arg_start = array.array(self.arg_start.typecode, [0])
+        arg_type = array.array(self.arg_type.typecode)
+        arg_fmt = array.array(self.arg_fmt.typecode)
+        arg_value = array.array(self.arg_value.typecode)
+        arg_valid = array.array(self.arg_valid.typecode)
+
+        for i in indices:
+            offset.append(self.offset[i])
+            macro_id.append(self.macro_id[i])
+            packets.append(self.packets[i])
+            start = self.arg_start[i]
+            end = self.arg_start[i + 1]
+            if start != end:
+                arg_type.extend(self.arg_type[start:end])
+                arg_fmt.extend(self.arg_fmt[start:end])
+                arg_value.extend(self.arg_value[start:end])
+                arg_valid.extend(self.arg_valid[start:end])
+            arg_start.append(len(arg_type))
+
+        return MacroTable(offset, macro_id, packets, arg_start, arg_type, arg_fmt, arg_value, arg_valid, self.ret)
+
+    def filter(self, *macro_ids: GfxdMacroId) -> "MacroTable":
+        """
+        Returns a new MacroTable holding only the macros with one of the given ids.
+
+        Example:
+            table.filter(GfxdMacroId.SPVertex, GfxdMacroId.SPDisplayList)
+        """
+        ids = set(int(macro_id) for macro_id in macro_ids)
+        return self.select(i for i, macro_id in enumerate(self.macro_id) if macro_id in ids)
+
+_macro_names_cache = {}
+
+def _macro_names(target: gfx_ucode_t, dynamic: bool) -> List[Union[str, None]]:
+    """
+    Names of every macro of target indexed by macro id, as gfxd_macro_name would return
+    them with or without a dynamic display list pointer set (g or gs macros).
+    """
+    key = (ctypes.cast(target, c_void_p).value, dynamic)
+    names = _macro_names_cache.get(key)
+    if names is None:
+        tbl = ctypes.cast(target.contents.macro_tbl, POINTER(gfxd_macro_type))
+        names = []
+        for i in range(len(GfxdMacroId)):
+            t = tbl[i]
+            if t.prefix is None and t.suffix is None:
+                names.append(None)
+            else:
+                prefix = t.prefix.decode("ascii") if t.prefix is not None else ""
+                suffix = t.suffix.decode("ascii") if t.suffix is not None else ""
+                names.append(prefix + ("g" if dynamic else "gs") + suffix)
+        _macro_names_cache[key] = names
+    return names
+
+def _decode() -> MacroTable:
+    # decode with the current settings of the calling thread
+    d = gfxd_decode()
+    _interrupt_execution()
+    try:
+        ret = lgfxd.gfxd_decode_all(byref(d))
+
+        n_macro = d.n_macro
+        n_arg = d.n_arg
+        arg_start = _column("i", d.macro_arg, n_macro + 1) if n_macro != 0 else array.array("i", [0])
+
+        return MacroTable(
+            _column("i", d.macro_offset, n_macro),
+            _column("i", d.macro_id, n_macro),
+            _column("i", d.macro_packets, n_macro),
+            arg_start,
+            _column("i", d.arg_type, n_arg),
+            _column("i", d.arg_fmt, n_arg),
+            _column("I", d.arg_value, n_arg),
+            _column("B", d.arg_valid, n_arg),
+            ret,
+        )
+    finally:
+        lgfxd.gfxd_decode_free(byref(d))
+
+lgfxd.gfxd_decode_all.argtypes = [POINTER(gfxd_decode)]
+lgfxd.gfxd_decode_all.restype = c_int
+lgfxd.gfxd_decode_free.argtypes = [POINTER(gfxd_decode)]
+lgfxd.gfxd_decode_free.restype = None
+def gfxd_decode_all(buf: bytes, target: gfx_ucode_t, endian: GfxdEndian = GfxdEndian.big, wordsize: int = 4,
+                    caps: Union[Iterable[GfxdCap], None] = None) -> MacroTable:
+    """
+    Decode every macro in buf in a single native call, without calling into Python
+    for each macro, and return the results as a MacroTable.
+
+    target, endian and wordsize are as for gfxd_target and gfxd_endian. caps is the
+    set of GfxdCap features to enable, all others are disabled. If caps is None, the
+    libgfxd defaults (GfxdCap.stop_on_invalid and GfxdCap.stop_on_end) are used.
+
+    This replaces the current input, target, endian and cap settings. The macro handler
+    is not called and no output is produced.
+    """
+    if caps is None:
+        caps = (GfxdCap.stop_on_invalid, GfxdCap.stop_on_end)
+    caps = set(caps)
+
+    gfxd_input_buffer(buf)
+    gfxd_target(target)
+    gfxd_endian(endian, wordsize)
+    for cap in GfxdCap:
+        if cap in caps:
+            gfxd_enable(cap)
+        else:
+            gfxd_disable(cap)
+
+    return _decode()
+
+# ====================================================================
+#   Caching
+# ====================================================================
+
+class DisassemblyCache:
+    """
+    An in-memory LRU cache of disassembly results, keyed by a hash of the input bytes
+    and every setting that affects the result. Used by Gfxd, see its cache parameter.
+
+    Entries are evicted least recently used first once their total size exceeds
+    max_size bytes. The counters hits, misses and evictions record the cache activity,
+    and bypasses counts executions that were not eligible for caching.
+
+    A cache may be shared by Gfxd contexts in several threads.
+    """
+
+    def __init__(self, max_size: int = 64 << 20):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypasses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def get(self, key):
+        """Returns the value cached for key and marks it as recently used, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size: int) -> None:
+        """Cache value, which takes up size bytes, for key, evicting old entries as needed."""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def _bypass(self):
+        with self._lock:
+            self.bypasses += 1
+
+    def clear(self) -> None:
+        """Drop all entries. The counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the counters, the number of entries and their total size."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size": self.size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bypasses": self.bypasses,
+            }
+
+class _CacheKey(NamedTuple):
+    # everything that affects a cached result, see Gfxd._cache_key
+    kind: str
+    digest: bytes
+    offset: Union[int, None]
+    ucode: Union[str, int]
+    endian: Tuple[int, int]
+    caps: Tuple[int, ...]
+    dynamic: Union[bytes, None]
+
+@functools.lru_cache(maxsize=None)
+def _libgfxd_digest() -> str:
+    # identifies the build of libgfxd that is loaded, which can change without __version__
+    with open(_LIBGFXD_PATH, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+# entry files: header, then the text, or the columns of a MacroTable each as a column
+# header and the little-endian array data
+_ENTRY_MAGIC = b"GXC1"
+_ENTRY_HEADER = struct.Struct("<4sBi")
+_ENTRY_COLUMN = struct.Struct("<cBQ")
+_ENTRY_TEXT = 0
+_ENTRY_TABLE = 1
+
+def _dump_entry(value) -> bytes:
+    if isinstance(value, MacroTable):
+        parts = [_ENTRY_HEADER.pack(_ENTRY_MAGIC, _ENTRY_TABLE, value.ret)]
+        for column in (value.offset, value.macro_id, value.packets, value.arg_start,
+                       value.arg_type, value.arg_fmt, value.arg_value, value.arg_valid):
+            if sys.byteorder != "little":
+                column = array.array(column.typecode, column)
+                column.byteswap()
+            parts.append(_ENTRY_COLUMN.pack(column.typecode.encode("ascii"), column.itemsize, len(column)))
+            parts.append(column.tobytes())
+        return b"".join(parts)
+    ret, text = value
+    return _ENTRY_HEADER.pack(_ENTRY_MAGIC, _ENTRY_TEXT, ret) + text
+
+def _load_entry(data: bytes):
+    # raises ValueError (or struct.error) for anything that is not a valid entry
+    magic, kind, ret = _ENTRY_HEADER.unpack_from(data, 0)
+    if magic != _ENTRY_MAGIC:
+        raise ValueError("not a cache entry")
+    pos = _ENTRY_HEADER.size
+    if kind == _ENTRY_TEXT:
+        return (ret, data[pos:])
+    if kind != _ENTRY_TABLE:
+        raise ValueError("unknown cache entry kind")
+
+    columns = []
+    for _ in range(8):
+        typecode, itemsize, count = _ENTRY_COLUMN.unpack_from(data, pos)
+        pos += _ENTRY_COLUMN.size
+        column = array.array(typecode.decode("ascii"))
+        if column.itemsize != itemsize or pos + count * itemsize > len(data):
+            raise ValueError("malformed cache entry")
+        column.frombytes(data[pos : pos + count * itemsize])
+        if sys.byteorder != "little":
+            column.byteswap()
+        pos += count * itemsize
+        columns.append(column)
+    if pos != len(data):
+        raise ValueError("malformed cache entry")
+    return MacroTable(*columns, ret)
+
+class DiskDisassemblyCache:
+    """
+    A persistent disassembly cache in a directory, shared by every process and run that
+    uses the same directory, with the same interface as DisassemblyCache.
+
+    Each entry is stored in its own file named by a hash of the cache key, __version__
+    and the loaded libgfxd, so results are never reused across pygfxd versions or libgfxd
+    builds. Entries hold plain data, not pickles, so a directory restored from elsewhere
+    can't run code when it is read. Entries are written to a temporary file and renamed
+    into place, so concurrent workers never observe partial entries. A hit refreshes the
+    modification time of the entry, and once the entries exceed max_size bytes the least
+    recently used ones are pruned.
+
+    Results for ucodes not provided by libgfxd are not cached, as they can't be
+    identified across processes.
+
+    The cache directory can be inspected and pruned from the command line:
+        python pygfxd.py cache-stats DIR
+        python pygfxd.py cache-prune DIR --max-size BYTES
+    """
+
+    def __init__(self, path: Union[str, os.PathLike], max_size: int = 1 << 30):
+        self.path = os.fspath(path)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypasses = 0
+        # size of the entries as last scanned plus those written since, rescanned when over max_size
+        self.size = None
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def _entry_path(self, key: _CacheKey) -> Union[str, None]:
+        if not isinstance(key.ucode, str):
+            return None
+        digest = hashlib.sha256(repr((__version__, _libgfxd_digest(), key)).encode("utf-8")).hexdigest()
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def _entries(self) -> List[Tuple[str, int, float]]:
+        # (path, size, mtime) of every entry
+        entries = []
+        for shard in os.scandir(self.path):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.startswith(".tmp"):
+                    # left behind by a writer that was killed
+                    if st.st_mtime < time.time() - 3600:
+                        self._unlink(entry.path)
+                    continue
+                entries.append((entry.path, st.st_size, st.st_mtime))
+        return entries
+
+    @staticmethod
+    def _unlink(path: str) -> bool:
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def __len__(self) -> int:
+        return len(self._entries())
+
+    def __contains__(self, key) -> bool:
+        path = self._entry_path(key)
+        return path is not None and os.path.exists(path)
+
+    def get(self, key):
+        """Returns the value cached for key and marks it as recently used, or None."""
+        path = self._entry_path(key)
+        value = None
+        if path is not None:
+            try:
+                with open(path, "rb") as f:
+                    value = _load_entry(f.read())
+                os.utime(path)
+            except (OSError, ValueError, struct.error):
+                # missing, pruned by another process while reading, or corrupt
+                value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, key, value, size: int) -> None:
+        """Cache value for key, pruning old entries once the cache is over max_size."""
+        path = self._entry_path(key)
+        if path is None:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_dump_entry(value))
+                written = f.tell()
+            os.replace(tmp, path)
+        except BaseException:
+            self._unlink(tmp)
+            raise
+
+        with self._lock:
+            if self.size is None:
+                self.size = sum(entry[1] for entry in self._entries())
+            else:
+                self.size += written
+            over = self.size > self.max_size
+        if over:
+            self.prune()
+
+    def prune(self, max_size: Union[int, None] = None) -> int:
+        """
+        Remove the least recently used entries until the cache takes up at most
+        max_size bytes (the max_size of the cache if None). Returns the number of
+        entries removed.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+        removed = 0
+        for path, entry_size, _ in entries:
+            if size <= max_size:
+                break
+            if self._unlink(path):
+                removed += 1
+            size -= entry_size
+        with self._lock:
+            self.size = size
+            self.evictions += removed
+        return removed
+
+    def _bypass(self):
+        with self._lock:
+            self.bypasses += 1
+
+    def clear(self) -> None:
+        """Remove all entries. The counters are kept."""
+        self.prune(0)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the counters of this object, and the number of entries and their total size on disk."""
+        entries = self._entries()
+        with self._lock:
+            return {
+                "entries": len(entries),
+                "size": sum(entry[1] for entry in entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bypasses": self.bypasses,
+            }
+
+# ====================================================================
+#   Contexts
+# ====================================================================
+
+def _arg_callback_setter(name: str):
+    setter = globals()[f"gfxd_{name}_callback"]
+    cb_type = getattr(lgfxd, f"gfxd_{name}_callback").argtypes[0]
+
+    def set_callback(self, fn):
+        self._callbacks[setter] = cb_type(fn) if fn is not None else None
+        self._apply_if_active()
+
+    set_callback.__name__ = f"{name}_callback"
+    set_callback.__doc__ = f"See gfxd_{name}_callback."
+    return set_callback
+
+class Gfxd:
+    """
+    A disassembler context that owns its own target, endian, caps, dynamic macro
+    argument, input, output, handlers and argument callbacks.
+
+    libgfxd keeps its configuration per thread, so separate Gfxd objects can be
+    executed in separate threads at the same time; ctypes releases the GIL for the
+    duration of each native call. The settings of a Gfxd are applied to the calling
+    thread whenever one of its execute or decode methods is called, replacing any
+    settings made with the module-level gfxd_* functions in that thread.
+
+    The gfxd_* functions that query the current macro (gfxd_macro_id, gfxd_arg_value,
+    etc.) and the custom output functions may be used from handlers and callbacks
+    as usual, they operate on the context executing in the calling thread.
+
+    A single Gfxd object must not be used by several threads at once.
+
+    If a DisassemblyCache or DiskDisassemblyCache is given as cache, execute_at,
+    execute_many and decode_at look their results up in it before executing. Text is
+    cached only while the output is growable and no macro handler, argument handler or
+    argument callback is set, as serving it from the cache would skip their side effects.
+
+    Example:
+        ctx = Gfxd(gfxd_f3dex2)
+        ctx.input_buffer(data)
+        ctx.output_growable()
+        ctx.execute()
+        text = ctx.output_string()
+    """
+
+    def __init__(self, target: Union[gfx_ucode_t, None] = None, endian: GfxdEndian = GfxdEndian.big,
+                 wordsize: int = 4, caps: Union[Iterable[GfxdCap], None] = None, dynamic: Union[str, None] = None,
+                 cache: Union[DisassemblyCache, DiskDisassemblyCache, None] = None):
+        """
+        target, endian, wordsize and dynamic are as for gfxd_target, gfxd_endian and
+        gfxd_dynamic. If target is None, it must be set with target before executing or
+        decoding, which raise ValueError otherwise. caps is the set of GfxdCap features
+        to enable, all others are disabled. If caps is None, the libgfxd defaults
+        (GfxdCap.stop_on_invalid and GfxdCap.stop_on_end) are used. cache is an optional
+        DisassemblyCache or DiskDisassemblyCache.
+        """
+        if caps is None:
+            caps = (GfxdCap.stop_on_invalid, GfxdCap.stop_on_end)
+        caps = set(caps)
+
+        self._target = target
+        self._endian = (int(endian), wordsize)
+        self._caps = {cap : cap in caps for cap in GfxdCap}
+        self._dynamic = None
+        # module-level setter -> arguments, replayed when the context is activated
+        self._input = (gfxd_input_buffer, (None,))
+        self._output = (gfxd_output_buffer, (None,))
+        self._output_buffer = None
+        self._readahead = 0x10000
+        self._coalesce = 0
+        # bumped by every I/O change, so that threads where the context is active
+        # select the new I/O at the next activation
+        self._io_generation = 0
+        # module-level setter -> prebuilt ctypes callback
+        self._callbacks = {}
+        self._macro_filter = (None, False)
+        self._ref_sink = None
+        self.cache = cache
+        self._arg_decoder = None
+        self.dynamic(dynamic)
+
+    # settings
+
+    def _apply_if_active(self):
+        if getattr(_gfxd_thread, "context", None) is self:
+            self._activate()
+
+    def _activate(self):
+        if self._target is None:
+            # the thread's last target would be used, or none at all in a new thread
+            raise ValueError("No target is set for this context, see Gfxd.target")
+        lgfxd.gfxd_target(self._target)
+        lgfxd.gfxd_endian(*self._endian)
+        lgfxd.gfxd_dynamic(self._dynamic)
+        _keep_alive(gfxd_dynamic, self._dynamic)
+        for cap, enabled in self._caps.items():
+            if enabled:
+                lgfxd.gfxd_enable(cap)
+            else:
+                lgfxd.gfxd_disable(cap)
+
+        for setter in Gfxd._CALLBACK_SETTERS:
+            cb = self._callbacks.get(setter)
+            getattr(lgfxd, setter.__name__)(cb if cb is not None else Gfxd._NULL_CALLBACKS[setter])
+            # libgfxd keeps using the handlers after module functions take over the thread
+            _keep_alive(setter, cb)
+        gfxd_macro_filter(*self._macro_filter)
+        lgfxd.gfxd_ref_sink(byref(self._ref_sink._refs) if self._ref_sink is not None else None)
+        _keep_alive(gfxd_ref_sink, self._ref_sink)
+
+        # selecting I/O pins buffers and resets the input position, so it is only
+        # redone when the I/O changed or another context or the module functions took over
+        if (getattr(_gfxd_thread, "context", None) is not self
+                or getattr(_gfxd_thread, "io_generation", None) != self._io_generation):
+            lgfxd.gfxd_input_readahead(self._readahead)
+            lgfxd.gfxd_output_coalesce(self._coalesce)
+            fn, args = self._input
+            fn(*args)
+            fn, args = self._output
+            ret = fn(*args)
+            if fn is gfxd_output_buffer:
+                self._output_buffer = ret
+            _gfxd_thread.context = self
+            _gfxd_thread.io_generation = self._io_generation
+
+    def _set_io(self, attr: str, fn, *args):
+        setattr(self, attr, (fn, args))
+        self._io_generation += 1
+        if getattr(_gfxd_thread, "context", None) is self:
+            self._activate()
+
+    def target(self, target: gfx_ucode_t) -> None:
+        """See gfxd_target."""
+        self._target = target
+        self._apply_if_active()
+
+    def endian(self, endian: GfxdEndian, wordsize: int) -> None:
+        """See gfxd_endian."""
+        self._endian = (int(endian), wordsize)
+        self._apply_if_active()
+
+    def dynamic(self, arg: Union[str, None]) -> None:
+        """See gfxd_dynamic."""
+        if arg is None:
+            self._dynamic = None
+        else:
+            self._dynamic = create_string_buffer(arg.encode("utf-8"))
+        self._apply_if_active()
+
+    def enable(self, cap: GfxdCap) -> None:
+        """See gfxd_enable."""
+        self._caps[GfxdCap(cap)] = True
+        self._apply_if_active()
+
+    def disable(self, cap: GfxdCap) -> None:
+        """See gfxd_disable."""
+        self._caps[GfxdCap(cap)] = False
+        self._apply_if_active()
+
+    # input/output
+
+    def input_buffer(self, buf: Union[bytes, bytearray, memoryview, None], size: int = -1) -> None:
+        """See gfxd_input_buffer. buf stays pinned while it is the input of this context."""
+        self._set_io("_input", gfxd_input_buffer, buf, size)
+
+    def input_fd(self, stream: io.IOBase) -> None:
+        """See gfxd_input_fd."""
+        self._set_io("_input", gfxd_input_fd, stream)
+
+    def input_callback(self, fn: Union[Callable[[bytes, int], int], None]) -> None:
+        """See gfxd_input_callback."""
+        self._set_io("_input", gfxd_input_callback, fn)
+
+    def input_readahead(self, size: int) -> None:
+        """See gfxd_input_readahead."""
+        self._readahead = size
+        self._io_generation += 1
+        if getattr(_gfxd_thread, "context", None) is self:
+            self._activate()
+
+    def output_buffer(self, buf: Union[bytes, None], size: int = -1) -> None:
+        """
+        See gfxd_output_buffer. The buffer that receives the output is returned by
+        output_buffer_contents.
+        """
+        self._output_buffer = None
+        self._set_io("_output", gfxd_output_buffer, buf, size)
+
+    def output_buffer_contents(self) -> Union[c_void_p, None]:
+        """
+        Returns the buffer selected with output_buffer, as returned by gfxd_output_buffer,
+        once this context has been executed.
+        """
+        return self._output_buffer
+
+    def output_fd(self, stream: io.IOBase) -> None:
+        """See gfxd_output_fd."""
+        self._set_io("_output", gfxd_output_fd, stream)
+
+    def output_callback(self, fn: Union[Callable[[bytes, int], int], None]) -> None:
+        """See gfxd_output_callback."""
+        self._set_io("_output", gfxd_output_callback, fn)
+
+    def output_coalesce(self, size: int) -> None:
+        """See gfxd_output_coalesce."""
+        self._coalesce = size
+        self._io_generation += 1
+        if getattr(_gfxd_thread, "context", None) is self:
+            self._activate()
+
+    def flush(self) -> int:
+        """See gfxd_flush. Must be called from the thread that executed the context."""
+        if getattr(_gfxd_thread, "context", None) is not self:
+            return 0
+        return gfxd_flush()
+
+    def output_growable(self) -> None:
+        """
+        See gfxd_output_growable. The buffer is owned by the thread that executes the
+        context, and is emptied when the context is next executed after another
+        context (or the module-level functions) used that thread.
+        """
+        self._set_io("_output", gfxd_output_growable)
+
+    def output_string(self, as_bytes: bool = False) -> Union[str, bytes]:
+        """
+        See gfxd_output_string. Must be called from the thread that executed the context,
+        before another context executes in that thread.
+        """
+        if getattr(_gfxd_thread, "context", None) is not self:
+            raise RuntimeError("The output of this context is not selected in the calling thread")
+        return gfxd_output_string(as_bytes)
+
+    # handlers
+
+    def macro_fn(self, fn: Union[Callable[[], int], None]) -> None:
+        """See gfxd_macro_fn."""
+        self._callbacks[gfxd_macro_fn] = lgfxd.gfxd_macro_fn.argtypes[0](fn) if fn is not None else None
+        self._apply_if_active()
+
+    def macro_filter(self, ids: Union[Iterable[GfxdMacroId], None], skip: bool = False) -> None:
+        """See gfxd_macro_filter."""
+        self._macro_filter = (tuple(ids) if ids is not None else None, skip)
+        self._apply_if_active()
+
+    def ref_sink(self, sink: Union[RefSink, None]) -> None:
+        """See gfxd_ref_sink. While a sink is set, the cache is bypassed."""
+        self._ref_sink = sink
+        self._apply_if_active()
+
+    def arg_fn(self, fn: Union[Callable[[int], None], None]) -> None:
+        """See gfxd_arg_fn."""
+        self._callbacks[gfxd_arg_fn] = lgfxd.gfxd_arg_fn.argtypes[0](fn) if fn is not None else None
+        self._apply_if_active()
+
+    tlut_callback = _arg_callback_setter("tlut")
+    timg_callback = _arg_callback_setter("timg")
+    cimg_callback = _arg_callback_setter("cimg")
+    zimg_callback = _arg_callback_setter("zimg")
+    dl_callback = _arg_callback_setter("dl")
+    mtx_callback = _arg_callback_setter("mtx")
+    lookat_callback = _arg_callback_setter("lookat")
+    light_callback = _arg_callback_setter("light")
+    lightsn_callback = _arg_callback_setter("lightsn")
+    seg_callback = _arg_callback_setter("seg")
+    vtx_callback = _arg_callback_setter("vtx")
+    vp_callback = _arg_callback_setter("vp")
+    uctext_callback = _arg_callback_setter("uctext")
+    ucdata_callback = _arg_callback_setter("ucdata")
+    dram_callback = _arg_callback_setter("dram")
+
+    _CALLBACK_SETTERS = (
+        gfxd_macro_fn, gfxd_arg_fn,
+        gfxd_tlut_callback, gfxd_timg_callback, gfxd_cimg_callback, gfxd_zimg_callback,
+        gfxd_dl_callback, gfxd_mtx_callback, gfxd_lookat_callback, gfxd_light_callback,
+        gfxd_lightsn_callback, gfxd_seg_callback, gfxd_vtx_callback, gfxd_vp_callback,
+        gfxd_uctext_callback, gfxd_ucdata_callback, gfxd_dram_callback,
+    )
+    # NULL resets macro_fn and arg_fn to the defaults and disables the argument callbacks
+    _NULL_CALLBACKS = {setter : getattr(lgfxd, setter.__name__).argtypes[0]() for setter in _CALLBACK_SETTERS}
+
+    def macro_record(self) -> "LazyMacro":
+        """
+        Returns a LazyMacro for the current macro, for use in the macro handler of this
+        context. Only the offset, id and packets of the macro are read; its arguments are
+        decoded with the settings of this context when they are first accessed, which
+        must be after the execution.
+        """
+        if self._target is None:
+            raise ValueError("macro records need the target of the context to be set")
+        caps = tuple(cap for cap, enabled in self._caps.items() if enabled)
+        key = (_ucode_key(self._target), self._endian, caps, self._dynamic is not None)
+        if self._arg_decoder is None or self._arg_decoder[0] != key:
+            self._arg_decoder = (key, _ArgDecoder(self._target, GfxdEndian(self._endian[0]), self._endian[1],
+                                                  caps, self._dynamic is not None))
+        n = lgfxd.gfxd_macro_packets()
+        data = ctypes.string_at(lgfxd.gfxd_macro_data(), 8 * n)
+        return LazyMacro(lgfxd.gfxd_macro_offset(), lgfxd.gfxd_macro_id(), data, self._arg_decoder[1])
+
+    # execution
+
+    def execute(self) -> int:
+        """See gfxd_execute."""
+        self._activate()
+        return gfxd_execute()
+
+    def begin(self) -> "GfxdExecution":
+        """
+        Start an incremental execution of this context, see GfxdExecution. The cache is
+        not used.
+        """
+        return GfxdExecution(self)
+
+    def _activate_buffer(self):
+        fn, args = self._input
+        if fn is not gfxd_input_buffer or args[0] is None:
+            raise ValueError("The input of this context is not a buffer")
+        self._activate()
+
+    def _cache_key(self, kind: str, offset: int, max_bytes: int):
+        # None if this execution must not be served from the cache. decoding calls
+        # none of the handlers or callbacks, so only text depends on them. records of
+        # a ref sink are made while executing, so none are served from the cache
+        if self.cache is None:
+            return None
+        if self._ref_sink is not None:
+            self.cache._bypass()
+            return None
+        if kind == "text":
+            if (self._output[0] is not gfxd_output_growable or any(cb is not None for cb in self._callbacks.values())
+                    or (self._macro_filter[0] is not None and self._macro_filter[1])):
+                self.cache._bypass()
+                return None
+
+        buf, size = self._input[1]
+        with memoryview(buf) as view, view.cast("B") as data:
+            end = data.nbytes if size < 0 else min(size, data.nbytes)
+            if max_bytes >= 0:
+                end = min(end, offset + max_bytes)
+            with data[offset:end] as window:
+                digest = hashlib.blake2b(window, digest_size=16).digest()
+
+        return _CacheKey(
+            kind,
+            digest,
+            # decoded tables hold absolute offsets, text does not
+            offset if kind == "table" else None,
+            _ucode_key(self._target),
+            self._endian,
+            tuple(int(cap) for cap, enabled in self._caps.items() if enabled),
+            self._dynamic.raw if self._dynamic is not None else None,
+        )
+
+    def execute_at(self, offset: int, max_bytes: int = -1) -> int:
+        """See gfxd_execute_at. The input of the context must be a buffer."""
+        self._activate_buffer()
+        key = self._cache_key("text", offset, max_bytes)
+        if key is None:
+            return gfxd_execute_at(offset, max_bytes)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            ret, text = cached
+            gfxd_write(text)
+            return ret
+
+        size = c_int()
+        lgfxd.gfxd_output_string(byref(size))
+        start = size.value
+        ret = gfxd_execute_at(offset, max_bytes)
+        address = lgfxd.gfxd_output_string(byref(size))
+        text = ctypes.string_at(address + start, size.value - start)
+        self.cache.put(key, (ret, text), len(text))
+        return ret
+
+    def execute_many(self, offsets: Iterable[int], max_bytes: int = -1) -> List[int]:
+        """See gfxd_execute_many. The input of the context must be a buffer."""
+        return [self.execute_at(offset, max_bytes) for offset in offsets]
+
+    def decode_all(self) -> MacroTable:
+        """
+        Decode the whole input with the settings of this context, as for gfxd_decode_all.
+        The macro handler is not called and no output is produced.
+        """
+        self._activate()
+        return _decode()
+
+    def decode_at(self, offset: int, max_bytes: int = -1) -> MacroTable:
+        """
+        Decode at most max_bytes bytes starting at offset of the input buffer, as for
+        decode_all. See gfxd_execute_at.
+
+        A table returned from the cache is shared with other callers and should not
+        be modified.
+        """
+        self._activate_buffer()
+        key = self._cache_key("table", offset, max_bytes)
+        if key is not None:
+            table = self.cache.get(key)
+            if table is not None:
+                return table
+
+        gfxd_input_window(offset, max_bytes)
+        table = _decode()
+        if key is not None:
+            self.cache.put(key, table, table.nbytes)
+        return table
+
+class GfxdExecution:
+    """
+    A suspendable execution, started with Gfxd.begin or with the current settings of
+    the calling thread if created directly.
+
+    step runs the execution for a limited number of macros and resume runs it to the
+    end. The lookahead packets are kept by libgfxd between steps, so a long display
+    list can be consumed incrementally (for time slicing, backpressure, paging, ...)
+    without reading or decoding anything twice.
+
+    libgfxd holds the state of one execution per thread. The execution must be stepped
+    from the thread that started it, and it is interrupted if another execution or
+    decoding is started in that thread, or another context is used in it, in between
+    steps, after which step raises RuntimeError.
+
+    Example:
+        run = ctx.begin()
+        while not run.step(100):
+            ...
+        ret = run.ret
+    """
+
+    def __init__(self, ctx: Union[Gfxd, None] = None):
+        self._ctx = ctx
+        self.ret = None
+        if ctx is not None:
+            ctx._activate()
+        gfxd_execute_begin()
+        _gfxd_thread.execution = self
+
+    @property
+    def done(self) -> bool:
+        """True once the execution has ended, ret then holds its return value."""
+        return self.ret is not None
+
+    def step(self, max_macros: int = 1) -> bool:
+        """
+        Continue the execution for at most max_macros macros, or until it ends if max_macros
+        is negative. Returns True once the execution has ended, see gfxd_execute_step.
+        """
+        if self.ret is not None:
+            return True
+        if getattr(_gfxd_thread, "execution", None) is not self:
+            raise RuntimeError("The execution was interrupted by another execution in this thread")
+        if self._ctx is not None:
+            if getattr(_gfxd_thread, "context", None) is not self._ctx:
+                raise RuntimeError("The execution was interrupted by another context in this thread")
+            self._ctx._activate()
+
+        ret = gfxd_execute_step(max_macros)
+        if gfxd_execute_done():
+            self.ret = ret
+            _interrupt_execution()
+        return self.ret is not None
+
+    def resume(self) -> int:
+        """Continue the execution until it ends, and return its return value as for gfxd_execute."""
+        self.step(-1)
+        return self.ret
+
+# ====================================================================
+#   Batch Disassembly
+# ====================================================================
+
+_UCODE_NAMES = ("f3d", "f3db", "f3dex", "f3dexb", "f3dex2")
+
+def _ucode_name(target: gfx_ucode_t) -> str:
+    # ucode pointers can't be pickled, pass them to worker processes by name
+    address = ctypes.cast(target, c_void_p).value
+    for name in _UCODE_NAMES:
+        if ctypes.cast(globals()[f"gfxd_{name}"], c_void_p).value == address:
+            return name
+    raise GfxdArgumentError("target", "Not one of the ucodes provided by libgfxd")
+
+def _ucode_key(target: gfx_ucode_t) -> Union[str, int]:
+    # the name of a libgfxd ucode, or the address of any other (only valid in this process)
+    try:
+        return _ucode_name(target)
+    except GfxdArgumentError:
+        return ctypes.cast(target, c_void_p).value
+
+class DisassemblyResult(NamedTuple):
+    """
+    The result of one disassemble_many job. text is the output of the job, and ret the
+    return value of gfxd_execute. If the job failed, error holds the exception that was
+    raised, text is empty and ret is None.
+    """
+    text: str
+    ret: Union[int, None]
+    error: Union[Exception, None] = None
+
+# per-process state of disassemble_many workers
+_worker_ctx = None
+_worker_sources = {}
+_worker_current = None
+
+def _worker_init(target: str, endian: int, wordsize: int, caps: List[GfxdCap], dynamic: Union[str, None],
+                 macro_fn: Union[Callable[[], int], None]):
+    global _worker_ctx, _worker_current
+
+    _worker_ctx = Gfxd(globals()[f"gfxd_{target}"], GfxdEndian(endian), wordsize, caps, dynamic)
+    _worker_ctx.output_growable()
+    _worker_ctx.macro_fn(macro_fn)
+    _worker_sources.clear()
+    _worker_current = None
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # python < 3.13 always tracks the segment; the workers share the resource
+        # tracker of the caller, which already tracks segments that it created
+        return shared_memory.SharedMemory(name)
+
+def _worker_source(kind: str, name: str) -> None:
+    global _worker_current
+
+    # each source is opened once per worker and reused by all of its jobs
+    source = _worker_sources.get((kind, name))
+    if source is None:
+        if kind == "shm":
+            shm = _attach_shared_memory(name)
+            source = (shm, shm.buf)
+        else:
+            with open(name, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    source = (None, b"")
+                else:
+                    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    source = (m, m)
+        _worker_sources[(kind, name)] = source
+
+    if _worker_current != (kind, name):
+        _worker_ctx.input_buffer(source[1])
+        _worker_current = (kind, name)
+
+def _worker_run(job: Tuple[str, str, int, int]) -> DisassemblyResult:
+    kind, name, offset, length = job
+    try:
+        _worker_source(kind, name)
+        ret = _worker_ctx.execute_at(offset, length)
+        return DisassemblyResult(_worker_ctx.output_string(), ret)
+    except Exception as e:
+        return DisassemblyResult("", None, e)
+    finally:
+        # empty the output for the next job
+        _worker_ctx.output_growable()
+
+def disassemble_many(jobs: Iterable[Tuple[Union[str, os.PathLike, shared_memory.SharedMemory], int, int]],
+                     target: gfx_ucode_t, endian: GfxdEndian = GfxdEndian.big, wordsize: int = 4,
+                     workers: Union[int, None] = None, chunksize: int = 64,
+                     caps: Union[Iterable[GfxdCap], None] = None, dynamic: Union[str, None] = None,
+                     macro_fn: Union[Callable[[], int], None] = None) -> List[DisassemblyResult]:
+    """
+    Disassemble many display lists in a pool of worker processes.
+
+    Each job is a tuple (source, offset, length). source is either the path of a file
+    (e.g. a ROM image), which each worker maps into memory once, or a
+    multiprocessing.shared_memory.SharedMemory, which each worker attaches to once by
+    name. The display list is read from length bytes at offset of the source, or to the
+    end of the source if length is negative. Only these small tuples are sent to the
+    workers, the data itself is never pickled.
+
+    target, endian, wordsize, caps and dynamic are as for Gfxd. macro_fn is the macro
+    handler for the workers, and must be picklable (a module-level function); if None,
+    gfxd_macro_dflt is used. Macro offsets are relative to the start of the source.
+
+    workers is the number of processes, os.cpu_count() if None. Jobs are sent to the
+    workers in batches of chunksize.
+
+    Returns one DisassemblyResult per job, in the order of jobs. A job that fails does
+    not stop the others, its exception is returned in the error field of its result.
+    """
+    if caps is None:
+        caps = (GfxdCap.stop_on_invalid, GfxdCap.stop_on_end)
+
+    tasks = []
+    for source, offset, length in jobs:
+        if isinstance(source, shared_memory.SharedMemory):
+            tasks.append(("shm", source.name, offset, length))
+        else:
+            tasks.append(("file", os.fspath(source), offset, length))
+
+    initargs = (_ucode_name(target), int(endian), wordsize, list(caps), dynamic, macro_fn)
+    with ProcessPoolExecutor(workers, initializer=_worker_init, initargs=initargs) as pool:
+        return list(pool.map(_worker_run, tasks, chunksize=max(1, chunksize)))
+
+# ====================================================================
+#   Display List Graphs
+# ====================================================================
+
+def resolve_segmented(address: int, segments: Mapping[int, int]) -> Union[int, None]:
+    """
+    Resolve a segmented address the way the RSP does: bits 24-27 select the segment,
+    whose base from segments is added to the low 24 bits. Returns None if the segment
+    is not in segments.
+    """
+    base = segments.get((address >> 24) & 0xF)
+    if base is None:
+        return None
+    return base + (address & 0xFFFFFF)
+
+class DisplayListGraph:
+    """
+    Result of walk_display_lists.
+
+    All display lists are identified by their offset in the walked data.
+
+        roots -- offsets of the root display lists
+        lists -- offset -> MacroTable of each display list, decoded exactly once
+        children -- offset -> offsets of the display lists it references, in order
+                    of first reference
+        addresses -- address -> offset, for every address that was resolved
+        unresolved -- addresses that referenced an unknown segment or fell outside of
+                      the data
+    """
+
+    def __init__(self):
+        self.roots: List[int] = []
+        self.lists: Dict[int, MacroTable] = {}
+        self.children: Dict[int, List[int]] = {}
+        self.addresses: Dict[int, int] = {}
+        self.unresolved: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.lists)
+
+    def __contains__(self, offset: int) -> bool:
+        return offset in self.lists
+
+    def parents(self, offset: int) -> List[int]:
+        """Returns the offsets of the display lists that reference the display list at offset."""
+        return [parent for parent, children in self.children.items() if offset in children]
+
+def _dl_targets(table: MacroTable) -> List[int]:
+    # values of all valid Dl arguments (SPDisplayList, SPBranchList, SPBranchLessZ, ...)
+    dl = GfxdArgType.Dl
+    return [
+        table.arg_value[j]
+        for j in range(len(table.arg_type))
+        if table.arg_type[j] == dl and table.arg_valid[j] != 0
+    ]
+
+def walk_display_lists(data: Union[bytes, bytearray, memoryview], roots: Iterable[int], target: gfx_ucode_t,
+                       segments: Mapping[int, int], endian: GfxdEndian = GfxdEndian.big, wordsize: int = 4,
+                       caps: Union[Iterable[GfxdCap], None] = None) -> DisplayListGraph:
+    """
+    Walk the graph of display lists in data reachable from the root addresses, decoding
+    each unique display list exactly once, and return it as a DisplayListGraph.
+
+    Addresses (roots and the targets of SPDisplayList, SPBranchList and every other
+    macro with a GfxdArgType.Dl argument) are resolved to offsets into data with
+    resolve_segmented and the segments table (segment number -> offset of the segment
+    in data). A display list that is shared by several parents is decoded only once,
+    so the cost is proportional to the number of unique display lists.
+
+    SPCullDisplayList takes vertex indices, not a display list, and ends no walk.
+    Segments set by SPSegment within the display lists are not tracked, the segments
+    table applies to all of them.
+
+    target, endian, wordsize and caps are as for Gfxd. caps should include
+    GfxdCap.stop_on_end (the default) so that each display list ends at its
+    SPEndDisplayList or SPBranchList.
+
+    This replaces the settings of the calling thread, see Gfxd.
+    """
+    ctx = Gfxd(target, endian, wordsize, caps)
+    ctx.input_buffer(data)
+    with memoryview(data) as view:
+        size = view.nbytes
+
+    graph = DisplayListGraph()
+
+    def resolve(address: int) -> Union[int, None]:
+        offset = graph.addresses.get(address)
+        if offset is None:
+            offset = resolve_segmented(address, segments)
+            if offset is None or offset < 0 or offset >= size:
+                graph.unresolved.add(address)
+                return None
+            graph.addresses[address] = offset
+        return offset
+
+    pending = []
+    for address in roots:
+        offset = resolve(address)
+        if offset is not None and offset not in graph.roots:
+            graph.roots.append(offset)
+            pending.append(offset)
+
+    seen = set(pending)
+    while len(pending) != 0:
+        offset = pending.pop()
+        table = ctx.decode_at(offset)
+        graph.lists[offset] = table
+
+        children = graph.children[offset] = []
+        for address in _dl_targets(table):
+            child = resolve(address)
+            if child is None or child in children:
+                continue
+            children.append(child)
+            if child not in seen:
+                seen.add(child)
+                pending.append(child)
+
+    return graph
+
+# ====================================================================
+#   Packet Scanning
+# ====================================================================
+
+def _require_numpy():
+    np = _numpy()
+    if np is None:
+        raise ImportError("Packet scanning requires numpy")
+    return np
+
+_opcode_tables = {}
+
+def opcode_table(target: gfx_ucode_t) -> "numpy.ndarray":
+    """
+    Returns an array of 256 macro ids indexed by opcode, holding the single-packet macro
+    that each opcode of target is decoded as, taken from the opcode values in the ucode's
+    macro table. Opcodes that target does not define map to GfxdMacroId.Invalid.
+
+    Requires numpy.
+    """
+    np = _require_numpy()
+    key = ctypes.cast(target, c_void_p).value
+    table = _opcode_tables.get(key)
+    if table is None:
+        table = np.full(256, int(GfxdMacroId.Invalid), dtype=np.int32)
+        defined = np.zeros(256, dtype=bool)
+        tbl = ctypes.cast(target.contents.macro_tbl, POINTER(gfxd_macro_type))
+        for macro_id in GfxdMacroId:
+            t = tbl[macro_id]
+            # the macros the ucode's disassembler produces directly, the first one
+            # listed wins where placeholder entries share an opcode
+            if macro_id == GfxdMacroId.Invalid or t.disas_fn is None or t.n_gfx != 1:
+                continue
+            opcode = t.opcode & 0xFF
+            if not defined[opcode]:
+                table[opcode] = macro_id
+                defined[opcode] = True
+        table.flags.writeable = False
+        _opcode_tables[key] = table
+    return table
+
+class PacketScan:
+    """
+    Result of scan_packets, the packets of a buffer classified by opcode without
+    disassembling them.
+
+        words -- (N, 2) array of the hi and lo word of each packet, big-endian uint32
+        opcode -- opcode of each packet
+        macro_id -- GfxdMacroId of each packet, see opcode_table
+
+    Each packet is classified on its own, so the macros that libgfxd combines from
+    several packets (e.g. DPLoadTextureBlock) appear as their individual packets. Offsets
+    are byte offsets in the scanned data.
+    """
+
+    def __init__(self, words: "numpy.ndarray", target: gfx_ucode_t):
+        self.words = words
+        self.target = target
+        self.opcode = (words[:, 0] >> 24).astype("u1")
+        self.macro_id = opcode_table(target)[self.opcode]
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def histogram(self) -> "numpy.ndarray":
+        """Returns the number of packets with each opcode, as an array of 256 counts."""
+        return _numpy().bincount(self.opcode, minlength=256)
+
+    def macro_histogram(self) -> "numpy.ndarray":
+        """Returns the number of packets of each macro, as an array indexed by GfxdMacroId."""
+        return _numpy().bincount(self.macro_id, minlength=len(GfxdMacroId))
+
+    def indices(self, *macro_ids: GfxdMacroId) -> "numpy.ndarray":
+        """Returns the indices of the packets of any of the given macros."""
+        np = _numpy()
+        return np.flatnonzero(np.isin(self.macro_id, [int(macro_id) for macro_id in macro_ids]))
+
+    def offsets(self, *macro_ids: GfxdMacroId) -> "numpy.ndarray":
+        """Returns the offsets of the packets of any of the given macros."""
+        return self.indices(*macro_ids) * 8
+
+    def addresses(self, *macro_ids: GfxdMacroId) -> "numpy.ndarray":
+        """
+        Returns the lo words of the packets of any of the given macros, which hold the
+        address for e.g. SPVertex, DisplayList and DPSetTextureImage.
+        """
+        return self.words[self.indices(*macro_ids), 1]
+
+    def vertices(self) -> Tuple["numpy.ndarray", "numpy.ndarray", "numpy.ndarray"]:
+        """
+        Returns the offsets, addresses and vertex counts of the SPVertex packets. The count
+        is zero for packets that do not decode as a valid SPVertex.
+        """
+        np = _numpy()
+        index = self.indices(GfxdMacroId.SPVertex)
+        rows, inverse = self._decode_hi(index)
+        counts = np.array([
+            next((value[1] for arg_type, fmt, value, valid in row.args if arg_type == GfxdArgType.Num), 0)
+            for row in rows
+        ], dtype=np.int32)
+        return index * 8, self.words[index, 1], counts[inverse]
+
+    def ends(self) -> "numpy.ndarray":
+        """
+        Returns the offsets of the packets that end a display list, SPEndDisplayList and
+        SPBranchList, in order.
+        """
+        np = _numpy()
+        index = self.indices(GfxdMacroId.DisplayList)
+        rows, inverse = self._decode_hi(index)
+        branch = np.array([row.id == GfxdMacroId.SPBranchList for row in rows], dtype=bool)
+        end = self.macro_id == GfxdMacroId.SPEndDisplayList
+        end[index[branch[inverse]]] = True
+        return np.flatnonzero(end) * 8
+
+    def _decode_hi(self, index: "numpy.ndarray"):
+        # decodes each distinct hi word of the packets at index once, with a zero lo word,
+        # and returns the decoded rows and the row of each packet
+        np = _numpy()
+        hi, inverse = np.unique(self.words[index, 0], return_inverse=True)
+        data = np.zeros((len(hi), 2), dtype=">u4")
+        data[:, 0] = hi
+        rows = []
+        if len(hi) != 0:
+            # the settings of libgfxd are per thread, decode in the helper thread to leave
+            # those of the calling thread alone
+            rows = _scan_executor().submit(_decode_packets, data.tobytes(), self.target).result()
+        return rows, inverse.reshape(-1)
+
+@functools.lru_cache(maxsize=None)
+def _scan_executor() -> ThreadPoolExecutor:
+    # a single thread for PacketScan, started on first use and reused afterwards
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="pygfxd-scan")
+
+def _decode_packets(data: bytes, target: gfx_ucode_t) -> List[MacroRow]:
+    # decodes each packet of data on its own
+    ctx = Gfxd(target, caps=())
+    ctx.input_buffer(data)
+    rows = [ctx.decode_at(offset, 8)[0] for offset in range(0, len(data), 8)]
+    ctx.input_buffer(None)
+    return rows
+
+def scan_packets(buf: Union[bytes, bytearray, memoryview], target: gfx_ucode_t,
+                 endian: GfxdEndian = GfxdEndian.big, wordsize: int = 4) -> PacketScan:
+    """
+    Classify every packet in buf by its opcode for target and return a PacketScan, for
+    triage of large amounts of data where macro text is not needed. Classifying runs in
+    numpy without any per-packet work in Python or libgfxd. PacketScan.vertices and
+    PacketScan.ends also decode each distinct hi word of the packets they look at once
+    with libgfxd, in a helper thread so the settings of the calling thread are kept.
+
+    endian and wordsize are as for gfxd_endian. Big-endian data is viewed without copying,
+    other data is converted with normalize_endian first. A trailing partial packet is
+    ignored.
+
+    Requires numpy.
+    """
+    np = _require_numpy()
+    with memoryview(buf) as view, view.cast("B") as data:
+        n_packet = data.nbytes // 8
+        if endian != GfxdEndian.big and wordsize != 1:
+            buf = normalize_endian(data[: n_packet * 8], endian, wordsize)
+        words = np.frombuffer(buf, dtype=">u4", count=n_packet * 2).reshape(n_packet, 2)
+    return PacketScan(words, target)
+
+# ====================================================================
+#   Display List Discovery
+# ====================================================================
+
+class DisplayListRegion(NamedTuple):
+    """
+    A display list found by discover_display_lists. offset and length are in bytes,
+    ucode is the name of the target it was validated with (e.g. "f3dex2"), and score
+    the fraction of its macro arguments that libgfxd considers valid.
+    """
+    offset: int
+    length: int
+    ucode: str
+    score: float
+
+def _discovery_candidates(buf, target: gfx_ucode_t, endian: GfxdEndian, wordsize: int,
+                          min_packets: int, max_packets: int) -> List[Tuple[int, int]]:
+    """
+    Scores every aligned offset of buf at once, and returns (offset, length) of each run
+    of packets with valid opcodes for target that ends in a SPEndDisplayList or
+    SPBranchList packet.
+    """
+    np = _numpy()
+    scan = scan_packets(buf, target, endian, wordsize)
+    n = len(scan)
+    index = np.arange(n)
+
+    valid = scan.macro_id != GfxdMacroId.Invalid
+    end = np.zeros(n, dtype=bool)
+    end[scan.ends() // 8] = True
+    zero = (scan.words == 0).all(axis=1)
+
+    # index of the next terminator and the next invalid opcode at or after each packet
+    next_end = np.minimum.accumulate(np.where(end, index, n)[::-1])[::-1]
+    next_bad = np.minimum.accumulate(np.where(valid, n, index)[::-1])[::-1]
+    length = next_end - index + 1
+
+    # a list starts after a terminator, an invalid opcode or zero padding, and reaches
+    # its terminator before any invalid opcode
+    brk = ~valid | end | zero
+    start = valid & ~zero & np.concatenate(([True], brk[:-1]))
+    candidate = start & (next_end < n) & (next_end < next_bad)
+    candidate &= (length >= min_packets) & (length <= max_packets)
+
+    # of the starts that share a terminator, only the first is kept
+    first = np.flatnonzero(candidate)
+    _, keep = np.unique(next_end[first], return_index=True)
+    first = first[keep]
+    return list(zip((first * 8).tolist(), (length[first] * 8).tolist()))
+
+def _worker_validate(job: Tuple[str, str, int, int, float]) -> Union[Tuple[int, int, float], None]:
+    kind, name, offset, length, max_invalid = job
+    _worker_source(kind, name)
+
+    # decode with libgfxd, restarting after the macro that failed validation until the
+    # rest of the candidate decodes to a terminator with few enough invalid arguments
+    start = offset
+    end = offset + length
+    while start < end:
+        table = _worker_ctx.decode_at(start, end - start)
+        if len(table) == 0:
+            start += 8
+            continue
+        stop = table.offset[-1] + table.packets[-1] * 8
+        if table.ret != 0:
+            # skip the invalid macro that execution stopped at
+            start = stop + 8
+            continue
+        if table.macro_id[-1] not in (GfxdMacroId.SPEndDisplayList, GfxdMacroId.SPBranchList):
+            return None
+
+        n_arg = len(table.arg_valid)
+        n_invalid = table.arg_valid.count(0)
+        if n_invalid <= max_invalid * n_arg:
+            return (start, stop - start, 1.0 - n_invalid / n_arg if n_arg != 0 else 1.0)
+        # restart after the first macro with an invalid argument
+        first = table.arg_valid.index(0)
+        bad = next(i for i in range(len(table)) if table.arg_start[i + 1] > first)
+        start = table.offset[bad] + table.packets[bad] * 8
+    return None
+
+def discover_display_lists(source: Union[bytes, bytearray, memoryview, str, os.PathLike, shared_memory.SharedMemory],
+                           targets: Union[Iterable[gfx_ucode_t], None] = None,
+                           endian: GfxdEndian = GfxdEndian.big, wordsize: int = 4,
+                           min_packets: int = 2, max_packets: int = 0x10000, max_invalid: float = 0.0,
+                           workers: Union[int, None] = None, chunksize: int = 256) -> List[DisplayListRegion]:
+    """
+    Find the display lists in source, e.g. a ROM image, without disassembling it at every
+    offset.
+
+    For each of targets (all the ucodes provided by libgfxd if None), every aligned offset
+    is scored at once with scan_packets: candidates are runs of min_packets to max_packets
+    packets with opcodes that are valid for the target, ending in a SPEndDisplayList or
+    SPBranchList packet. The candidates are then validated by libgfxd in a pool of
+    workers worker processes (os.cpu_count() if None), in batches of chunksize, as for
+    disassemble_many. A candidate is accepted when it decodes to its terminator without
+    invalid macros, and at most a max_invalid fraction of its arguments are invalid
+    (see gfxd_arg_valid). A candidate that fails is retried after the macro that failed.
+
+    source is a file path or SharedMemory, which the workers open by name, or a bytes-like
+    object, which is copied into shared memory for the workers. endian and wordsize are
+    as for gfxd_endian.
+
+    Returns the regions that were accepted, best first, ranked by score and then length.
+    Regions found for different targets may overlap. Requires numpy.
+    """
+    _require_numpy()
+    if targets is None:
+        targets = [globals()[f"gfxd_{name}"] for name in _UCODE_NAMES]
+
+    shm = None
+    data = None
+    if isinstance(source, shared_memory.SharedMemory):
+        kind, name, data = "shm", source.name, source.buf
+    elif isinstance(source, (str, os.PathLike)):
+        kind, name = "file", os.fspath(source)
+        with open(name, "rb") as f:
+            if os.fstat(f.fileno()).st_size != 0:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        with memoryview(source) as view, view.cast("B") as raw:
+            if raw.nbytes != 0:
+                shm = shared_memory.SharedMemory(create=True, size=raw.nbytes)
+                shm.buf[: raw.nbytes] = raw
+                kind, name, data = "shm", shm.name, shm.buf[: raw.nbytes]
+
+    regions = []
+    try:
+        for target in targets if data is not None else ():
+            ucode = _ucode_name(target)
+            tasks = [
+                (kind, name, offset, length, max_invalid)
+                for offset, length in _discovery_candidates(data, target, endian, wordsize, min_packets, max_packets)
+            ]
+            if len(tasks) == 0:
+                continue
+
+            initargs = (ucode, int(endian), wordsize, [GfxdCap.stop_on_invalid, GfxdCap.stop_on_end], None, None)
+            with ProcessPoolExecutor(workers, initializer=_worker_init, initargs=initargs) as pool:
+                for result in pool.map(_worker_validate, tasks, chunksize=max(1, chunksize)):
+                    if result is not None:
+                        regions.append(DisplayListRegion(result[0], result[1], ucode, result[2]))
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+        if shm is not None:
+            data.release()
+            shm.close()
+            shm.unlink()
+
+    regions.sort(key=lambda r: (-r.score, -r.length, r.offset, r.ucode))
+    return regions
+
+# ====================================================================
+#   Streaming
+# ====================================================================
+
+class Macro(NamedTuple):
+    """
+    A macro yielded by iter_macros.
+
+        offset -- offset of the macro from the start of the source
+        id -- GfxdMacroId of the macro
+        name -- name of the macro as returned by gfxd_macro_name, None for raw Gfx
+        packets -- number of Gfx packets in the macro
+        args -- list of (arg type, arg fmt, arg value, arg valid) as in MacroTable
+    """
+    offset: int
+    id: GfxdMacroId
+    name: Union[str, None]
+    packets: int
+    args: List[Tuple[GfxdArgType, GfxdArgfmt, Tuple[int, int, float], bool]]
+
+class _ArgDecoder:
+    # decodes the arguments of LazyMacro records from their packets, shared by the
+    # records of one source and guarded as the records may be used from any thread
+
+    def __init__(self, target: gfx_ucode_t, endian: GfxdEndian, wordsize: int, caps: Iterable[GfxdCap],
+                 dynamic: bool):
+        self.ctx = Gfxd(target, endian, wordsize, caps)
+        self.names = _macro_names(target, dynamic)
+        self.lock = threading.Lock()
+
+    def args(self, data: bytes) -> List[Tuple[GfxdArgType, GfxdArgfmt, Tuple[int, int, float], bool]]:
+        with self.lock:
+            self.ctx.input_buffer(data)
+            table = self.ctx.decode_at(0)
+            self.ctx.input_buffer(None)
+        return table[0].args if len(table) != 0 else []
+
+class LazyMacro:
+    """
+    A macro record that keeps only the offset, macro id and raw (not byte-swapped)
+    packets of the macro, yielded by iter_macros and aiter_macros with lazy=True and
+    returned by Gfxd.macro_record.
+
+    It has the same attributes as Macro, but args is decoded from the packets by
+    libgfxd when it is first accessed, and then kept. args must not be accessed from
+    within a macro handler or callback, as decoding would interrupt the execution.
+    """
+    __slots__ = ("offset", "_id", "data", "_decoder", "_args")
+
+    def __init__(self, offset: int, macro_id: int, data: bytes, decoder: _ArgDecoder):
+        self.offset = offset
+        self._id = macro_id
+        self.data = data
+        self._decoder = decoder
+        self._args = None
+
+    @property
+    def id(self) -> GfxdMacroId:
+        return GfxdMacroId(self._id)
+
+    @property
+    def name(self) -> Union[str, None]:
+        return self._decoder.names[self._id]
+
+    @property
+    def packets(self) -> int:
+        return len(self.data) // 8
+
+    @property
+    def args(self) -> List[Tuple[GfxdArgType, GfxdArgfmt, Tuple[int, int, float], bool]]:
+        if self._args is None:
+            self._args = self._decoder.args(self.data)
+        return self._args
+
+    def __repr__(self) -> str:
+        return f"LazyMacro(offset=0x{self.offset:X}, id={self.id!r}, packets={self.packets})"
+
+# number of bytes libgfxd looks ahead to combine a macro, RING_SIZE
+_LOOKAHEAD = 8 * _GFXD_MAX_PACKETS
+
+def _split_chunk(chunk, chunk_size: int) -> Iterable[memoryview]:
+    # slice a large chunk without copying it, so that only chunk_size bytes of it are
+    # decoded before the first macros are yielded
+    view = memoryview(chunk).cast("B")
+    for start in range(0, len(view), chunk_size):
+        yield view[start : start + chunk_size]
+
+def _iter_chunks(source, chunk_size: int) -> Iterable[bytes]:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield from _split_chunk(source, chunk_size)
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield from iter(lambda: f.read(chunk_size), b"")
+    elif hasattr(source, "read"):
+        yield from iter(lambda: source.read(chunk_size), b"")
+    else:
+        for chunk in source:
+            if len(chunk) > chunk_size:
+                yield from _split_chunk(chunk, chunk_size)
+            else:
+                yield chunk
+
+class _MacroStream:
+    # incremental decoder behind iter_macros and aiter_macros, fed chunks of the source
+
+    def __init__(self, target: gfx_ucode_t, endian: GfxdEndian, wordsize: int,
+                 caps: Union[Iterable[GfxdCap], None], dynamic: Union[str, None], lazy: bool = False):
+        if caps is None:
+            caps = (GfxdCap.stop_on_invalid, GfxdCap.stop_on_end)
+        caps = set(caps)
+        self.ctx = Gfxd(target, endian, wordsize, caps)
+        self.names = _macro_names(target, dynamic is not None)
+        self.decoder = _ArgDecoder(target, endian, wordsize, caps, dynamic is not None) if lazy else None
+        self.base = 0
+        self.pending = bytearray()
+        self.stopped = False
+
+    def decode(self, final: bool) -> List[Macro]:
+        """
+        Decode the pending data and return the macros that are final, keeping the rest
+        pending. Sets stopped when execution ended before the end of the data.
+        """
+        buf = bytes(self.pending)
+
+        self.ctx.input_buffer(buf)
+        table = self.ctx.decode_at(0)
+        self.ctx.input_buffer(None)
+        if table.ret == -2:
+            raise MemoryError("libgfxd could not allocate the decoded macros")
+
+        n = len(table)
+        end = table.offset[n - 1] + 8 * table.packets[n - 1] if n != 0 else 0
+        # stopped on an invalid macro or by the macro handler, nothing more is decoded
+        stopped = table.ret != 0
+        # a macro is only final once the packets it could be combined with are buffered
+        limit = len(buf) if final or stopped else len(buf) - _LOOKAHEAD
+
+        macros = []
+        i = 0
+        if self.decoder is not None:
+            offsets = table.offset
+            ids = table.macro_id
+            packets = table.packets
+            while i < n and offsets[i] <= limit:
+                offset = offsets[i]
+                data = buf[offset:offset + 8 * packets[i]]
+                macros.append(LazyMacro(self.base + offset, ids[i], data, self.decoder))
+                i += 1
+        else:
+            while i < n and table.offset[i] <= limit:
+                macros.append(Macro(*_table_row(table, i, self.names, self.base)))
+                i += 1
+
+        if i < n:
+            consumed = table.offset[i]
+        elif stopped or end + 8 <= len(buf):
+            # stop_on_end (or an invalid packet) ended execution within the buffer
+            self.stopped = True
+            consumed = len(buf)
+        else:
+            consumed = end
+        self.pending = bytearray(buf[consumed:])
+        self.base += consumed
+        return macros
+
+def iter_macros(source: Union[str, os.PathLike, io.IOBase, Iterable[bytes], bytes], target: gfx_ucode_t,
+                endian: GfxdEndian = GfxdEndian.big, wordsize: int = 4, caps: Union[Iterable[GfxdCap], None] = None,
+                dynamic: Union[str, None] = None, chunk_size: int = 1 << 20,
+                lazy: bool = False) -> Iterable[Union[Macro, LazyMacro]]:
+    """
+    Lazily decode the display list in source and yield a Macro for each macro, reading
+    and decoding chunk_size bytes at a time. Only one chunk is held in memory at once,
+    so sources of any size can be decoded, and nothing past the chunk holding the last
+    macro consumed by the caller is read or decoded.
+
+    source may be the path of a file, a binary file object, an iterable of bytes-like
+    chunks (of any size, not necessarily packet aligned), or a single bytes-like object.
+
+    target, endian, wordsize, caps and dynamic are as for Gfxd. The macros are the same
+    as those decoded from the whole source at once, and as with gfxd_execute the
+    iteration ends early on SPEndDisplayList/SPBranchList or an invalid macro when
+    GfxdCap.stop_on_end or GfxdCap.stop_on_invalid are enabled.
+
+    If lazy is True, LazyMacro records are yielded instead, which decode their arguments
+    only when they are accessed.
+
+    This replaces the settings of the calling thread each time a chunk is decoded,
+    see Gfxd.
+    """
+    stream = _MacroStream(target, endian, wordsize, caps, dynamic, lazy)
+    chunks = iter(_iter_chunks(source, chunk_size))
+    final = False
+    while not final and not stream.stopped:
+        # keep enough past the chunk for the lookahead, so that every round makes progress
+        while len(stream.pending) < chunk_size + _LOOKAHEAD:
+            chunk = next(chunks, None)
+            if chunk is None:
+                final = True
+                break
+            stream.pending += chunk
+
+        yield from stream.decode(final)
+
+def _table_row(table: MacroTable, i: int, names: List[Union[str, None]], base: int = 0):
+    row = MacroRow(table, i)
+    macro_id = row.id
+    return (base + row.offset, macro_id, names[macro_id], row.packets, row.args)
+
+# ====================================================================
+#   Asyncio
+# ====================================================================
+
+async def _achunks(source, chunk_size: int) -> AsyncIterator[bytes]:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        for chunk in _split_chunk(source, chunk_size):
+            yield chunk
+    elif hasattr(source, "read"):
+        # asyncio.StreamReader
+        while True:
+            chunk = await source.read(chunk_size)
+            if len(chunk) == 0:
+                break
+            yield chunk
+    else:
+        async for chunk in source:
+            if len(chunk) > chunk_size:
+                for piece in _split_chunk(chunk, chunk_size):
+                    yield piece
+            else:
+                yield chunk
+
+async def aiter_macros(source: Union[asyncio.StreamReader, AsyncIterator[bytes], bytes], target: gfx_ucode_t,
+                       endian: GfxdEndian = GfxdEndian.big, wordsize: int = 4,
+                       caps: Union[Iterable[GfxdCap], None] = None, dynamic: Union[str, None] = None,
+                       chunk_size: int = 1 << 20, executor=None, lazy: bool = False) -> AsyncIterator[Union[Macro, LazyMacro]]:
+    """
+    Asynchronous version of iter_macros, for use with async for.
+
+    source may be an asyncio.StreamReader, an async iterable of bytes-like chunks, or a
+    single bytes-like object. Each chunk of about chunk_size bytes is decoded in a
+    worker thread of executor (a concurrent.futures.ThreadPoolExecutor, the default
+    executor of the event loop if None), so the event loop is never blocked. The next
+    chunk is only read once the macros of the previous one have been consumed, so a
+    slow consumer holds back reading from source. lazy is as for iter_macros.
+    """
+    loop = asyncio.get_running_loop()
+    stream = _MacroStream(target, endian, wordsize, caps, dynamic, lazy)
+    chunks = _achunks(source, chunk_size).__aiter__()
+    final = False
+    try:
+        while not final and not stream.stopped:
+            while len(stream.pending) < chunk_size + _LOOKAHEAD:
+                try:
+                    stream.pending += await chunks.__anext__()
+                except StopAsyncIteration:
+                    final = True
+                    break
+
+            for macro in await loop.run_in_executor(executor, stream.decode, final):
+                yield macro
+    finally:
+        await chunks.aclose()
+
+def _disassemble(data: bytearray, target: Union[gfx_ucode_t, str], endian: int, wordsize: int, caps: List[GfxdCap],
+                 dynamic: Union[str, None], macro_fn: Union[Callable[[], int], None]) -> DisassemblyResult:
+    # runs in an executor, target is passed by name to worker processes
+    if isinstance(target, str):
+        target = globals()[f"gfxd_{target}"]
+    ctx = Gfxd(target, GfxdEndian(endian), wordsize, caps, dynamic)
+    ctx.input_buffer(data)
+    ctx.output_growable()
+    ctx.macro_fn(macro_fn)
+    try:
+        ret = ctx.execute()
+        return DisassemblyResult(ctx.output_string(), ret)
+    finally:
+        # executor threads are reused, don't keep the input pinned in this one
+        ctx.input_buffer(None)
+        ctx.output_buffer(None)
+
+async def adisassemble(source: Union[asyncio.StreamReader, AsyncIterator[bytes], bytes], target: gfx_ucode_t,
+                       endian: GfxdEndian = GfxdEndian.big, wordsize: int = 4,
+                       caps: Union[Iterable[GfxdCap], None] = None, dynamic: Union[str, None] = None,
+                       macro_fn: Union[Callable[[], int], None] = None, executor=None) -> DisassemblyResult:
+    """
+    Disassemble the display list in source to text without blocking the event loop, and
+    return a DisassemblyResult with the text and the return value of gfxd_execute.
+
+    source is as for aiter_macros, and is read to the end before disassembling. target,
+    endian, wordsize, caps and dynamic are as for Gfxd, and macro_fn is the macro
+    handler (gfxd_macro_dflt if None).
+
+    The disassembly runs in executor, the default executor of the event loop if None.
+    executor may be a concurrent.futures.ProcessPoolExecutor, in which case macro_fn
+    must be picklable (a module-level function). Any number of calls may be awaited
+    concurrently, each runs with its own Gfxd context.
+    """
+    if caps is None:
+        caps = (GfxdCap.stop_on_invalid, GfxdCap.stop_on_end)
+
+    data = bytearray()
+    async for chunk in _achunks(source, 1 << 20):
+        data += chunk
+
+    if isinstance(executor, ProcessPoolExecutor):
+        target = _ucode_name(target)
+    run = functools.partial(_disassemble, data, target, int(endian), wordsize, list(caps), dynamic, macro_fn)
+    return await asyncio.get_running_loop().run_in_executor(executor, run)
+
 # ====================================================================
 #   Python Utilities
 # ====================================================================
@@ -1163,3 +3614,36 @@ def gfxd_buffer_to_string(buffer: c_void_p) -> str:
     Primary purpose is to fetch the contents of the output buffer as a python string.
     """
     return buffer.value.decode('utf-8')
+
+# ====================================================================
+#   Command Line
+# ====================================================================
+
+def _main(argv: Union[List[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(prog="pygfxd", description="pygfxd utilities")
+    parser.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stats = commands.add_parser("cache-stats", help="show the entries and size of a disassembly cache directory")
+    stats.add_argument("path", help="cache directory")
+
+    prune = commands.add_parser("cache-prune", help="remove least recently used entries from a disassembly cache directory")
+    prune.add_argument("path", help="cache directory")
+    prune.add_argument("--max-size", type=int, default=0, help="size in bytes to prune the cache down to (default: 0, remove everything)")
+
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.path):
+        parser.error(f"{args.path} is not a directory")
+
+    cache = DiskDisassemblyCache(args.path)
+    if args.command == "cache-stats":
+        stats = cache.stats()
+        print(f"entries {stats['entries']}")
+        print(f"size    {stats['size']}")
+    else:
+        removed = cache.prune(args.max_size)
+        print(f"removed {removed} entries")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 #  copied from https://stackoverflow.com/questions/4529555/building-a-ctypes-based-c-library-with-distutils
+import os, re
 from setuptools import setup, Extension
 from distutils.command.build_ext import build_ext as build_ext_orig
 
@@ -31,9 +32,13 @@ class build_ext(build_ext_orig):
 with open("README.md", "r", encoding="utf-8") as fh:
     long_description = fh.read()
 
+# __version__ in pygfxd.py is the only copy of the version
+with open(os.path.join(os.path.dirname(__file__) or ".", "pygfxd.py"), "r", encoding="utf-8") as fh:
+    version = re.search(r'^__version__ = "([^"]+)"', fh.read(), re.M).group(1)
+
 setup(
     name="pygfxd",
-    version="1.0.5",
+    version=version,
     author="Tharo",
     description="Python bindings for libgfxd",
     long_description=long_description,
@@ -52,6 +57,7 @@ setup(
                 "libgfxd/uc.c",
             ],
             include_dirs=["libgfxd"],
+            define_macros=[("CONFIG_MT", None)],
             extra_compile_args = [
                 "-std=c11",
                 "-Wall",
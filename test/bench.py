@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+DIR = Path(__file__).parent
+
+sys.path.insert(0, str(DIR.absolute().parent))
+
+from pygfxd import *
+
+
+UCODES = {
+    "f3d": gfxd_f3d,
+    "f3db": gfxd_f3db,
+    "f3dex": gfxd_f3dex,
+    "f3dexb": gfxd_f3dexb,
+    "f3dex2": gfxd_f3dex2,
+}
+
+
+def random_packets(n_packets: int, seed: int = 0) -> bytes:
+    # random words decode to a mix of every opcode, which exercises macro
+    # lookup for the whole table rather than a handful of hot commands
+    return random.Random(seed).randbytes(8 * n_packets)
+
+
+def time_execute(data: bytes, target, repeat: int = 3) -> float:
+    best = None
+    for _ in range(repeat):
+        gfxd_input_buffer(data)
+        gfxd_output_buffer(None)
+        gfxd_target(target)
+        gfxd_endian(GfxdEndian.big, 4)
+        gfxd_disable(GfxdCap.stop_on_invalid)
+        gfxd_disable(GfxdCap.stop_on_end)
+
+        t = time.perf_counter()
+        gfxd_execute()
+        t = time.perf_counter() - t
+
+        best = t if best is None else min(best, t)
+
+    gfxd_enable(GfxdCap.stop_on_invalid)
+    gfxd_enable(GfxdCap.stop_on_end)
+    return best
+
+
+def bench_ucodes(n_packets: int = 1 << 20):
+    """Packets per second through gfxd_execute for each ucode"""
+    data = random_packets(n_packets)
+    for name, target in UCODES.items():
+        t = time_execute(data, target)
+        print(f"{name:8} {n_packets / t:12.0f} packets/s")
+
+
+def bench_single_packet(n_packets: int = 1 << 20):
+    """Packets per second through gfxd_execute for single packet macros, without output"""
+    packets = bytes.fromhex(
+        "e700000000000000"  # gsDPPipeSync
+        "fa000000ffffffff"  # gsDPSetPrimColor
+        "0100a01406000000"  # gsSPVertex
+        "0500020400000000"  # gsSP1Triangle
+        "e300100100000000"  # gsDPSetTextureLUT
+        "d9fffffe00000000"  # gsSPClearGeometryMode
+        "0600020400020406"  # gsSP2Triangles
+        "e600000000000000"  # gsDPLoadSync
+    )
+    data = packets * (n_packets // 8)
+
+    gfxd_macro_filter([], skip=True)
+    t = time_execute(data, gfxd_f3dex2)
+    gfxd_macro_filter(None)
+    print(f"f3dex2   {n_packets / t:12.0f} packets/s")
+
+
+def bench_decode(n_packets: int = 1 << 16):
+    """Structured decoding through Python callbacks versus gfxd_decode_all"""
+    data = random_packets(n_packets)
+
+    def macro_fn():
+        args = [
+            (gfxd_arg_type(i), gfxd_arg_fmt(i), gfxd_arg_value(i), gfxd_arg_valid(i))
+            for i in range(gfxd_arg_count())
+        ]
+        macros.append((gfxd_macro_offset(), gfxd_macro_id(), gfxd_macro_packets(), args))
+        return 0
+
+    macros = []
+    gfxd_input_buffer(data)
+    gfxd_target(gfxd_f3dex2)
+    gfxd_endian(GfxdEndian.big, 4)
+    gfxd_disable(GfxdCap.stop_on_invalid)
+    gfxd_disable(GfxdCap.stop_on_end)
+    gfxd_macro_fn(macro_fn)
+    t = time.perf_counter()
+    gfxd_execute()
+    t_callbacks = time.perf_counter() - t
+    gfxd_macro_fn(None)
+
+    t = time.perf_counter()
+    table = gfxd_decode_all(data, gfxd_f3dex2, caps=())
+    t_decode_all = time.perf_counter() - t
+
+    print(f"callbacks       {len(macros) / t_callbacks:12.0f} macros/s")
+    print(f"gfxd_decode_all {len(table) / t_decode_all:12.0f} macros/s")
+
+
+def bench_threads(n_packets: int = 1 << 18, max_threads: int = os.cpu_count() or 1):
+    """Aggregate packets per second with one Gfxd context per thread"""
+    data = random_packets(n_packets)
+
+    def run():
+        ctx = Gfxd(gfxd_f3dex2, caps=())
+        ctx.input_buffer(data)
+        ctx.execute()
+
+    n_threads = 1
+    while True:
+        threads = [threading.Thread(target=run) for _ in range(n_threads)]
+        t = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        t = time.perf_counter() - t
+        print(f"{n_threads:3} threads {n_threads * n_packets / t:12.0f} packets/s")
+
+        if n_threads >= max_threads:
+            break
+        n_threads = min(n_threads * 2, max_threads)
+
+
+def bench_many(n_jobs: int = 1 << 12, job_packets: int = 256, max_workers: int = os.cpu_count() or 1):
+    """Aggregate packets per second through disassemble_many for 1..max_workers processes"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "rom.bin"
+        path.write_bytes(random_packets(n_jobs * job_packets))
+        jobs = [(path, i * 8 * job_packets, 8 * job_packets) for i in range(n_jobs)]
+
+        workers = 1
+        while True:
+            t = time.perf_counter()
+            disassemble_many(jobs, gfxd_f3dex2, workers=workers, caps=())
+            t = time.perf_counter() - t
+            print(f"{workers:3} workers {n_jobs * job_packets / t:12.0f} packets/s")
+
+            if workers >= max_workers:
+                break
+            workers = min(workers * 2, max_workers)
+
+
+def bench_step(n_packets: int = 1 << 18):
+    """Packets per second through Gfxd.begin and step, by macros per step"""
+    data = random_packets(n_packets)
+    ctx = Gfxd(gfxd_f3dex2, caps=())
+
+    for max_macros in (-1, 4096, 256, 16):
+        ctx.input_buffer(data)
+        run = ctx.begin()
+        t = time.perf_counter()
+        while not run.step(max_macros):
+            pass
+        t = time.perf_counter() - t
+        label = "all" if max_macros < 0 else max_macros
+        print(f"{label:>5} per step {n_packets / t:12.0f} packets/s")
+
+
+if __name__ == "__main__":
+    bench_ucodes()
+    bench_single_packet()
+    bench_decode()
+    bench_threads()
+    bench_many()
+    bench_step()
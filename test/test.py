@@ -2,6 +2,7 @@
 
 from pathlib import Path
 from dataclasses import dataclass
+import threading
 
 
 DIR = Path(__file__).parent
@@ -86,7 +87,19 @@ from pygfxd import *
 
 import unittest
 
+import asyncio
+import contextlib
+import ctypes
+import gc
+import io
+import itertools
+import os
+import pickle
+import struct
 import tempfile
+import unittest.mock
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
 
 
 class TestInputOutput(unittest.TestCase):
@@ -163,6 +176,121 @@ class TestInputOutput(unittest.TestCase):
 
                 self.assertEqual(expected, gfxd_buffer_to_string(outbuf))
 
+    def test_gfxd_input_callback_partial(self):
+        # packets arriving a few bytes at a time cross the end of the lookahead window
+        data = bytes(TEST_DATA.data) * 16 + bytes((i * 37 + 11) & 0xFF for i in range(4096))
+
+        def execute(chunk_sizes):
+            remaining_data = [data]
+
+            def callback(bufP, count):
+                newdata = remaining_data[0][: min(count, next(chunk_sizes))]
+                ctypes.memmove(bufP, newdata, len(newdata))
+                remaining_data[0] = remaining_data[0][len(newdata) :]
+                return len(newdata)
+
+            def macro_fn():
+                gfxd_printf(f"{gfxd_macro_offset()} {bytes(gfxd_macro_data()).hex()} ")
+                gfxd_macro_dflt()
+                gfxd_puts("\n")
+                return 0
+
+            gfxd_input_callback(callback)
+            gfxd_output_growable()
+            gfxd_target(gfxd_f3dex2)
+            gfxd_endian(GfxdEndian.big, 4)
+            gfxd_disable(GfxdCap.stop_on_invalid)
+            gfxd_disable(GfxdCap.stop_on_end)
+            gfxd_macro_fn(macro_fn)
+            gfxd_execute()
+            gfxd_macro_fn(None)
+            gfxd_enable(GfxdCap.stop_on_invalid)
+            gfxd_enable(GfxdCap.stop_on_end)
+            return gfxd_output_string()
+
+        expected = execute(itertools.repeat(len(data)))
+        self.assertEqual(expected.count("\n"), len(gfxd_decode_all(data, gfxd_f3dex2, caps=())))
+        for readahead in [0, 0x10000]:
+            gfxd_input_readahead(readahead)
+            for sizes in [(1,), (3,), (5, 11), (13, 2, 7)]:
+                with self.subTest(readahead=readahead, sizes=sizes):
+                    self.assertEqual(execute(itertools.cycle(sizes)), expected)
+
+    def test_gfxd_input_readahead(self):
+        data = bytes(TEST_DATA.data) * 4096
+        counts = []
+
+        def execute(readahead):
+            remaining_data = [data]
+            calls = [0]
+
+            def callback(bufP, count):
+                calls[0] += 1
+                newdata = remaining_data[0][:count]
+                ctypes.memmove(bufP, newdata, len(newdata))
+                remaining_data[0] = remaining_data[0][len(newdata) :]
+                return len(newdata)
+
+            gfxd_input_readahead(readahead)
+            gfxd_input_callback(callback)
+            gfxd_output_growable()
+            gfxd_target(gfxd_f3dex2)
+            gfxd_endian(GfxdEndian.big, 4)
+            gfxd_disable(GfxdCap.stop_on_end)
+            gfxd_execute()
+            gfxd_enable(GfxdCap.stop_on_end)
+            counts.append(calls[0])
+            return gfxd_output_string()
+
+        expected = execute(0)
+        self.assertEqual(execute(0x10000), expected)
+        self.assertEqual(execute(0x1000), expected)
+        # 72 bytes per call without read-ahead, the end of input is signalled again
+        # for each of the up to 9 packets that remain to be disassembled
+        self.assertGreater(counts[0], len(data) // 72)
+        self.assertLessEqual(counts[1], len(data) // 0x10000 + 1 + 9)
+        self.assertLessEqual(counts[2], len(data) // 0x1000 + 1 + 9)
+
+    def test_gfxd_input_fd_seek(self):
+        # the stream is selected once and moved to each display list in turn
+        data = bytes(TEST_DATA.data) * 256
+        offsets = [k * len(TEST_DATA.data) + sym.offset for k in (200, 3, 100) for sym in TEST_DATA.syms]
+
+        def execute():
+            gfxd_output_growable()
+            gfxd_target(gfxd_f3dex2)
+            gfxd_endian(GfxdEndian.big, 4)
+            gfxd_execute()
+            return gfxd_output_string()
+
+        expected = []
+        for offset in offsets:
+            gfxd_input_buffer(data[offset:])
+            expected.append(execute())
+
+        expected_positions = None
+        for readahead in (0, 0x10000):
+            with self.subTest(readahead=readahead), tempfile.TemporaryFile() as input_file:
+                input_file.write(data)
+                input_file.flush()
+
+                gfxd_input_readahead(readahead)
+                gfxd_input_fd(input_file)
+                output = []
+                positions = []
+                for offset in offsets:
+                    os.lseek(input_file.fileno(), offset, os.SEEK_SET)
+                    output.append(execute())
+                    positions.append(os.lseek(input_file.fileno(), 0, os.SEEK_CUR))
+                gfxd_input_buffer(None)
+
+                self.assertEqual(output, expected)
+                # the same position as without read-ahead
+                if expected_positions is not None:
+                    self.assertEqual(positions, expected_positions)
+                expected_positions = positions
+        gfxd_input_readahead(0x10000)
+
     def test_gfxd_output_buffer(self):
         for sym, data, expected in self.data:
             with self.subTest(sym):
@@ -178,6 +306,32 @@ class TestInputOutput(unittest.TestCase):
 
                 self.assertEqual(expected, gfxd_buffer_to_string(outbuf))
 
+    def test_gfxd_output_growable(self):
+        for sym, data, expected in self.data:
+            with self.subTest(sym):
+                gfxd_input_buffer(data)
+
+                gfxd_output_growable()
+
+                gfxd_target(gfxd_f3dex2)
+                gfxd_endian(GfxdEndian.big, 4)
+
+                gfxd_execute()
+
+                self.assertEqual(expected, gfxd_output_string())
+                self.assertEqual(expected.encode(), gfxd_output_string(as_bytes=True))
+
+    def test_gfxd_output_growable_large(self):
+        # much more output than the initial buffer size
+        gfxd_output_growable()
+        for i in range(10000):
+            gfxd_puts(f"{i},")
+
+        self.assertEqual(",".join(str(i) for i in range(10000)) + ",", gfxd_output_string())
+
+        gfxd_output_growable()
+        self.assertEqual("", gfxd_output_string())
+
     def test_gfxd_output_fd(self):
         for sym, data, expected in self.data:
             with self.subTest(sym):
@@ -215,6 +369,59 @@ class TestInputOutput(unittest.TestCase):
 
                 self.assertEqual(expected, output.getvalue().decode())
 
+    def test_gfxd_output_coalesce(self):
+        data = bytes(TEST_DATA.data) * 64
+        counts = []
+
+        def execute(coalesce):
+            output = io.BytesIO()
+            calls = [0]
+
+            def callback(buf, count):
+                calls[0] += 1
+                self.assertEqual(count, len(buf))
+                output.write(buf)
+                return count
+
+            gfxd_output_coalesce(coalesce)
+            gfxd_input_buffer(data)
+            gfxd_output_callback(callback)
+            gfxd_target(gfxd_f3dex2)
+            gfxd_endian(GfxdEndian.big, 4)
+            gfxd_disable(GfxdCap.stop_on_end)
+            gfxd_execute()
+            gfxd_enable(GfxdCap.stop_on_end)
+            # written outside of execution, pending until flushed
+            gfxd_puts("end")
+            gfxd_flush()
+            gfxd_output_coalesce(0)
+            counts.append(calls[0])
+            return output.getvalue()
+
+        expected = execute(0)
+        self.assertTrue(expected.endswith(b"end"))
+        self.assertEqual(execute(0x1000), expected)
+        self.assertEqual(execute(16), expected)
+        self.assertGreater(counts[0], len(expected) // 16)
+        self.assertLessEqual(counts[1], len(expected) // 0x1000 + 2)
+        self.assertLess(counts[2], counts[0])
+
+    def test_gfxd_output_coalesce_fd(self):
+        sym, data, expected = self.data[1]
+        with tempfile.TemporaryFile() as output:
+            gfxd_output_coalesce(0x1000)
+            gfxd_input_buffer(data)
+            gfxd_output_fd(output)
+            gfxd_target(gfxd_f3dex2)
+            gfxd_endian(GfxdEndian.big, 4)
+            gfxd_execute()
+            gfxd_puts("end")
+            # selecting another output flushes the pending text
+            gfxd_output_buffer(None)
+            gfxd_output_coalesce(0)
+            output.seek(0)
+            self.assertEqual(expected + "end", output.read().decode())
+
     def test_nulling_input_callback(self):
         for sym, data, expected in self.data:
             with self.subTest(sym):
@@ -284,6 +491,171 @@ class TestInputOutput(unittest.TestCase):
                 self.assertEqual("", gfxd_buffer_to_string(outbuf))
 
 
+class TestZeroCopyInput(unittest.TestCase):
+    """Test gfxd_input_buffer and gfxd_write with buffer protocol objects"""
+
+    def setUp(self):
+        self.sym = next(sym for sym in TEST_DATA.syms if sym.name == "oneTriDList")
+        self.expected = "gsSPVertex(0x42042069, 3, 0)gsSP1Triangle(0, 1, 2, 0)gsSPEndDisplayList()"
+
+        gfxd_macro_fn(None)
+
+    def execute(self):
+        outb = bytes(1000)
+        outbuf = gfxd_output_buffer(outb, len(outb))
+
+        gfxd_target(gfxd_f3dex2)
+        gfxd_endian(GfxdEndian.big, 4)
+
+        gfxd_execute()
+
+        return gfxd_buffer_to_string(outbuf)
+
+    def test_memoryview_slice(self):
+        gfxd_input_buffer(TEST_DATA.data[self.sym.offset :][: self.sym.size])
+
+        self.assertEqual(self.expected, self.execute())
+
+    def test_bytearray_not_copied(self):
+        data = bytearray(TEST_DATA.data[self.sym.offset :][: self.sym.size])
+        gfxd_input_buffer(data)
+
+        # replace gsSPVertex by gsSPEndDisplayList after registering
+        data[:8] = data[16:24]
+
+        self.assertEqual("gsSPEndDisplayList()", self.execute())
+
+    def test_bytearray_locked(self):
+        data = bytearray(TEST_DATA.data[self.sym.offset :][: self.sym.size])
+        gfxd_input_buffer(data)
+
+        with self.assertRaises(BufferError):
+            data.extend(bytes(8))
+
+        gfxd_input_buffer(None)
+        data.extend(bytes(8))
+
+    def test_release_at_exit(self):
+        data = bytearray(8)
+        pin = pygfxd._PinnedBuffer(data)
+        # module globals are set to None during interpreter teardown
+        with unittest.mock.patch.object(pygfxd, "ctypes", None), unittest.mock.patch.object(pygfxd, "byref", None):
+            del pin
+        data.extend(bytes(8))
+
+    def test_mmap(self):
+        import mmap
+
+        with tempfile.TemporaryFile() as input_file:
+            input_file.write(bytes(TEST_DATA.data))
+            input_file.flush()
+
+            with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                view = memoryview(m)[self.sym.offset :][: self.sym.size]
+                try:
+                    gfxd_input_buffer(view)
+
+                    output = self.execute()
+                finally:
+                    gfxd_input_buffer(None)
+                    view.release()
+
+                self.assertEqual(self.expected, output)
+
+    def test_size_padded(self):
+        # without the gsSPEndDisplayList, padded with a zero packet (gsDPNoOp)
+        data = bytearray(TEST_DATA.data[self.sym.offset :][: self.sym.size - 8])
+        gfxd_input_buffer(data, len(data) + 8)
+        data.extend(bytes(8))   # padded from a copy, not pinned
+
+        self.assertEqual(self.expected.replace("gsSPEndDisplayList()", "gsDPNoOp()"), self.execute())
+        gfxd_input_buffer(None)
+
+    def test_size_prefix(self):
+        data = bytes(TEST_DATA.data[self.sym.offset :][: self.sym.size])
+        gfxd_input_buffer(data, len(data) - 8)
+
+        self.assertEqual(self.expected.replace("gsSPEndDisplayList()", ""), self.execute())
+        gfxd_input_buffer(None)
+
+    def test_gfxd_write(self):
+        outb = bytes(1000)
+        outbuf = gfxd_output_buffer(outb, len(outb))
+
+        data = bytearray(b"0123456789")
+        self.assertEqual(gfxd_write(memoryview(data)[2:5]), 3)
+        self.assertEqual(gfxd_write(b"abc"), 3)
+
+        self.assertEqual("234abc", gfxd_buffer_to_string(outbuf))
+
+
+class TestInputWindow(unittest.TestCase):
+    """Test gfxd_input_window, gfxd_execute_at and gfxd_execute_many"""
+
+    def setUp(self):
+        gfxd_macro_fn(None)
+        gfxd_input_buffer(TEST_DATA.data)
+        gfxd_target(gfxd_f3dex2)
+        gfxd_endian(GfxdEndian.big, 4)
+
+    def tearDown(self):
+        gfxd_macro_fn(None)
+        gfxd_input_buffer(None)
+
+    def test_gfxd_execute_at(self):
+        for sym in TEST_DATA.syms:
+            expected = {
+                "emptyDList": "gsSPEndDisplayList()",
+                "oneTriDList": "gsSPVertex(0x42042069, 3, 0)gsSP1Triangle(0, 1, 2, 0)gsSPEndDisplayList()",
+                "setLights1DList": "gsSPSetLights1(*(Lightsn *)0x09000000)",
+            }[sym.name]
+            with self.subTest(sym):
+                outb = bytes(1000)
+                outbuf = gfxd_output_buffer(outb, len(outb))
+
+                gfxd_execute_at(sym.offset, sym.size)
+
+                self.assertEqual(expected, gfxd_buffer_to_string(outbuf))
+
+    def test_gfxd_execute_many(self):
+        offsets = []
+
+        def macro_fn():
+            offsets.append(gfxd_macro_offset())
+            return 0
+
+        gfxd_macro_fn(macro_fn)
+
+        rets = gfxd_execute_many([sym.offset for sym in TEST_DATA.syms])
+
+        self.assertEqual(rets, [0] * len(TEST_DATA.syms))
+        # absolute offsets of every macro, setLights1DList runs to the end of the data
+        oneTri = next(sym for sym in TEST_DATA.syms if sym.name == "oneTriDList")
+        self.assertIn(oneTri.offset + 8, offsets)
+        self.assertEqual(
+            sorted(set(sym.offset for sym in TEST_DATA.syms) - set(offsets)), []
+        )
+
+    def test_offset_out_of_range(self):
+        with self.assertRaises(ValueError):
+            gfxd_execute_at(len(TEST_DATA.data) + 8)
+
+    def test_window_reset_by_input_buffer(self):
+        gfxd_input_window(8)
+        gfxd_input_buffer(TEST_DATA.data[:8])
+
+        offsets = []
+
+        def macro_fn():
+            offsets.append(gfxd_macro_offset())
+            return 0
+
+        gfxd_macro_fn(macro_fn)
+        gfxd_execute()
+
+        self.assertEqual(offsets, [0])
+
+
 class TestArgumentCallback(unittest.TestCase):
     def setUp(self):
         self.data: list[Sym, memoryview] = []
@@ -382,6 +754,1343 @@ class TestMacroInfo(unittest.TestCase):
 
                 self.assertEqual(packets_names, expected)
 
+    def test_gfxd_macro_data(self):
+        data = bytes(TEST_DATA.data)
+        gfxd_input_buffer(data)
+        gfxd_target(gfxd_f3dex2)
+        gfxd_endian(GfxdEndian.big, 4)
+        gfxd_disable(GfxdCap.stop_on_end)
+
+        results = []
+        out = bytearray(8 * 9)
+
+        def macro_fn():
+            view = gfxd_macro_view()
+            self.assertTrue(view.readonly)
+            n = gfxd_macro_data(out)
+            results.append((gfxd_macro_offset(), gfxd_macro_packets(), gfxd_macro_data(), bytes(view), out[:n]))
+            with self.assertRaises(ValueError):
+                gfxd_macro_data(bytearray(n - 1))
+            return 0
+
+        gfxd_macro_fn(macro_fn)
+        gfxd_execute()
+        gfxd_macro_fn(None)
+        gfxd_input_buffer(None)
+        gfxd_enable(GfxdCap.stop_on_end)
+
+        self.assertIn(3, [r[1] for r in results])
+        for offset, packets, copy, view, written in results:
+            expected = data[offset : offset + 8 * packets]
+            self.assertEqual(type(copy), bytearray)
+            self.assertEqual(copy, expected)
+            self.assertEqual(view, expected)
+            self.assertEqual(written, expected)
+
+    def test_gfxd_args(self):
+        noise = bytes((i * 37 + 11) & 0xFF for i in range(4096))
+        for data in [bytes(TEST_DATA.data), noise]:
+            with self.subTest(size=len(data)):
+                gfxd_input_buffer(data)
+                gfxd_target(gfxd_f3dex2)
+                gfxd_endian(GfxdEndian.big, 4)
+                gfxd_disable(GfxdCap.stop_on_invalid)
+                gfxd_disable(GfxdCap.stop_on_end)
+
+                results = []
+
+                def macro_fn():
+                    expected = [
+                        (gfxd_arg_type(i), gfxd_arg_fmt(i), gfxd_arg_value(i), gfxd_arg_valid(i), gfxd_arg_name(i))
+                        for i in range(gfxd_arg_count())
+                    ]
+                    results.append((expected, gfxd_args(), gfxd_args(raw=True)))
+                    return 0
+
+                gfxd_macro_fn(macro_fn)
+                gfxd_execute()
+                gfxd_macro_fn(None)
+                gfxd_input_buffer(None)
+                gfxd_enable(GfxdCap.stop_on_invalid)
+                gfxd_enable(GfxdCap.stop_on_end)
+
+                self.assertGreater(len(results), 0)
+                for expected, args, raw in results:
+                    # compare raw values, invalid float arguments may be NaN
+                    self.assertEqual([(*a[:2], a[2][1], *a[3:]) for a in args],
+                                     [(*a[:2], a[2][1], *a[3:]) for a in expected])
+                    self.assertEqual(raw, [(int(a[0]), int(a[1]), a[2][1], a[3], a[4]) for a in expected])
+                    self.assertTrue(all(type(a[0]) is GfxdArgType and type(a[1]) is GfxdArgfmt for a in args))
+                    self.assertTrue(all(type(a[0]) is int and type(a[1]) is int for a in raw))
+
+
+class TestDecodeAll(unittest.TestCase):
+    def setUp(self):
+        self.data: list[Sym, memoryview] = []
+        for sym in TEST_DATA.syms:
+            data = bytes(TEST_DATA.data[sym.offset :][: sym.size])
+            self.data.append((sym, data))
+
+    def decode_with_callbacks(self, data):
+        macros = []
+
+        def macro_fn():
+            args = [
+                (
+                    gfxd_arg_type(i),
+                    gfxd_arg_fmt(i),
+                    gfxd_arg_value(i),
+                    gfxd_arg_valid(i),
+                )
+                for i in range(gfxd_arg_count())
+            ]
+            macros.append(
+                (gfxd_macro_offset(), gfxd_macro_id(), gfxd_macro_packets(), args)
+            )
+            return 0
+
+        gfxd_input_buffer(data)
+        gfxd_target(gfxd_f3dex2)
+        gfxd_endian(GfxdEndian.big, 4)
+        try:
+            gfxd_macro_fn(macro_fn)
+            gfxd_execute()
+        finally:
+            gfxd_macro_fn(None)
+
+        return macros
+
+    def test_macro_ids(self):
+        for sym, data in self.data:
+            expected = {
+                "emptyDList": [GfxdMacroId.SPEndDisplayList],
+                "oneTriDList": [
+                    GfxdMacroId.SPVertex,
+                    GfxdMacroId.SP1Triangle,
+                    GfxdMacroId.SPEndDisplayList,
+                ],
+                "setLights1DList": [GfxdMacroId.SPSetLights1],
+            }[sym.name]
+            with self.subTest(sym):
+                table = gfxd_decode_all(data, gfxd_f3dex2)
+
+                self.assertEqual(list(table.macro_id), expected)
+                self.assertEqual(table.ret, 0)
+
+    def test_matches_callbacks(self):
+        for sym, data in self.data:
+            with self.subTest(sym):
+                expected = self.decode_with_callbacks(data)
+
+                table = gfxd_decode_all(data, gfxd_f3dex2)
+
+                self.assertEqual([table[i] for i in range(len(table))], expected)
+
+    def test_empty(self):
+        table = gfxd_decode_all(b"", gfxd_f3dex2)
+
+        self.assertEqual(len(table), 0)
+        self.assertEqual(list(table.arg_start), [0])
+
+
+class TestGfxdContext(unittest.TestCase):
+    """Test the Gfxd context object and its isolation between threads"""
+
+    def setUp(self):
+        gfxd_macro_fn(None)
+
+    def tearDown(self):
+        gfxd_macro_fn(None)
+        gfxd_input_buffer(None)
+        gfxd_output_buffer(None)
+
+    def expected(self):
+        gfxd_macro_fn(None)
+        gfxd_input_buffer(TEST_DATA.data)
+        gfxd_output_growable()
+        gfxd_target(gfxd_f3dex2)
+        gfxd_endian(GfxdEndian.big, 4)
+        gfxd_disable(GfxdCap.stop_on_end)
+        gfxd_execute()
+        gfxd_enable(GfxdCap.stop_on_end)
+        return gfxd_output_string()
+
+    def test_execute(self):
+        expected = self.expected()
+
+        ctx = Gfxd(gfxd_f3dex2, caps=(GfxdCap.stop_on_invalid,))
+        ctx.input_buffer(TEST_DATA.data)
+        ctx.output_growable()
+        self.assertEqual(ctx.execute(), 0)
+        self.assertEqual(ctx.output_string(), expected)
+
+    def test_settings_are_restored(self):
+        macros = []
+
+        def macro_fn():
+            macros.append(gfxd_macro_id())
+            return 0
+
+        ctx = Gfxd(gfxd_f3dex2)
+        ctx.input_buffer(TEST_DATA.data)
+        ctx.macro_fn(macro_fn)
+
+        ctx.execute()
+        # the module-level functions take over this thread in between
+        self.expected()
+        ctx.execute()
+
+        self.assertEqual(macros, [GfxdMacroId.SPEndDisplayList] * 2)
+
+    def test_handlers_outlive_context(self):
+        macros = []
+
+        def run():
+            ctx = Gfxd(gfxd_f3dex2)
+            ctx.input_buffer(TEST_DATA.data)
+            ctx.macro_fn(lambda: macros.append(gfxd_macro_id()) or 0)
+            ctx.execute()
+
+        run()
+        # the handler installed by the collected context is still in use by libgfxd
+        gfxd_input_buffer(TEST_DATA.data)
+        gfxd_output_growable()
+        gc.collect()
+        self.assertEqual(gfxd_execute(), 0)
+        self.assertEqual(macros, [GfxdMacroId.SPEndDisplayList] * 2)
+
+    def test_input_changed_in_other_thread(self):
+        syms = {sym.name: sym for sym in TEST_DATA.syms}
+        empty, one_tri = syms["emptyDList"], syms["oneTriDList"]
+
+        ctx = Gfxd(gfxd_f3dex2)
+        ctx.input_buffer(TEST_DATA.data[empty.offset :][: empty.size])
+        ctx.output_growable()
+
+        def run():
+            ctx.execute()
+            return ctx.output_string()
+
+        with ThreadPoolExecutor(1) as pool:
+            self.assertEqual(pool.submit(run).result(), "gsSPEndDisplayList()")
+            ctx.input_buffer(TEST_DATA.data[one_tri.offset :][: one_tri.size])
+            self.assertTrue(pool.submit(run).result().startswith("gsSPVertex("))
+            pool.submit(ctx.input_buffer, None).result()
+
+    def test_output_string_after_other_context(self):
+        a = Gfxd(gfxd_f3dex2)
+        a.input_buffer(TEST_DATA.data)
+        a.output_growable()
+        a.execute()
+
+        b = Gfxd(gfxd_f3dex2)
+        b.input_buffer(TEST_DATA.data)
+        b.execute()
+
+        with self.assertRaises(RuntimeError):
+            a.output_string()
+
+    def test_decode_at(self):
+        ctx = Gfxd(gfxd_f3dex2)
+        ctx.input_buffer(TEST_DATA.data)
+        for sym in TEST_DATA.syms:
+            with self.subTest(sym):
+                table = ctx.decode_at(sym.offset, sym.size)
+                self.assertEqual(table[0][0], sym.offset)
+
+    def test_requires_target(self):
+        other = Gfxd(gfxd_f3d)
+        other.input_buffer(TEST_DATA.data)
+        other.execute()
+
+        # the target of another context is not inherited, nor is the thread's last one
+        ctx = Gfxd()
+        ctx.input_buffer(TEST_DATA.data)
+        for run in [ctx.execute, ctx.decode_all, lambda: ctx.decode_at(0), ctx.begin]:
+            with self.assertRaises(ValueError):
+                run()
+        with ThreadPoolExecutor(1) as pool:
+            with self.assertRaises(ValueError):
+                pool.submit(ctx.execute).result()
+
+        ctx.target(gfxd_f3dex2)
+        ctx.output_growable()
+        self.assertEqual(ctx.execute(), 0)
+        self.assertEqual(ctx.output_string(), "gsSPEndDisplayList()")
+        ctx.input_buffer(None)
+        other.input_buffer(None)
+
+    def test_execute_at_requires_buffer(self):
+        ctx = Gfxd(gfxd_f3dex2)
+        with self.assertRaises(ValueError):
+            ctx.execute_at(0)
+
+    def test_threads(self):
+        expected = self.expected()
+        results = [None] * 4
+
+        def run(i):
+            ctx = Gfxd(gfxd_f3dex2, caps=(GfxdCap.stop_on_invalid,))
+            ctx.input_buffer(TEST_DATA.data)
+            ctx.output_growable()
+            outputs = []
+            for _ in range(50):
+                ctx.execute()
+                outputs.append(ctx.output_string())
+            results[i] = outputs
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(results))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for outputs in results:
+            self.assertEqual(outputs, [expected] * 50)
+
+    def test_thread_isolation(self):
+        # settings made in another thread do not leak into this one
+        gfxd_target(gfxd_f3dex2)
+        gfxd_input_buffer(TEST_DATA.data)
+
+        def run():
+            gfxd_target(gfxd_f3d)
+            gfxd_input_buffer(None)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+
+        ids = []
+
+        def macro_fn():
+            ids.append(gfxd_macro_id())
+            return 0
+
+        gfxd_macro_fn(macro_fn)
+        gfxd_execute()
+        self.assertEqual(ids, [GfxdMacroId.SPEndDisplayList])
+
+
+def line_macro_fn():
+    # module-level so that it can be sent to disassemble_many workers
+    gfxd_macro_dflt()
+    gfxd_puts("\n")
+    return 0
+
+
+class TestDisassembleMany(unittest.TestCase):
+    """Test disassemble_many"""
+
+    EXPECTED = {
+        "emptyDList": "gsSPEndDisplayList()\n",
+        "oneTriDList": "gsSPVertex(0x42042069, 3, 0)\ngsSP1Triangle(0, 1, 2, 0)\ngsSPEndDisplayList()\n",
+        "setLights1DList": "gsSPSetLights1(*(Lightsn *)0x09000000)\n",
+    }
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "data.bin"
+        self.path.write_bytes(TEST_DATA.data)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_file(self):
+        jobs = [(self.path, sym.offset, sym.size) for sym in TEST_DATA.syms] * 3
+        results = disassemble_many(jobs, gfxd_f3dex2, workers=2, chunksize=2, macro_fn=line_macro_fn)
+
+        expected = [self.EXPECTED[sym.name] for sym in TEST_DATA.syms] * 3
+        self.assertEqual([r.text for r in results], expected)
+        self.assertEqual([r.error for r in results], [None] * len(jobs))
+
+    def test_shared_memory(self):
+        shm = shared_memory.SharedMemory(create=True, size=len(TEST_DATA.data))
+        try:
+            shm.buf[:len(TEST_DATA.data)] = TEST_DATA.data
+            jobs = [(shm, sym.offset, sym.size) for sym in TEST_DATA.syms]
+            results = disassemble_many(jobs, gfxd_f3dex2, workers=2, macro_fn=line_macro_fn)
+        finally:
+            shm.close()
+            shm.unlink()
+
+        self.assertEqual([r.text for r in results], [self.EXPECTED[sym.name] for sym in TEST_DATA.syms])
+
+    def test_errors(self):
+        jobs = [
+            (Path(self.tmp.name) / "missing.bin", 0, 8),
+            (self.path, len(TEST_DATA.data) + 8, 8),
+            (self.path, 0, 8),
+        ]
+        results = disassemble_many(jobs, gfxd_f3dex2, workers=1, macro_fn=line_macro_fn)
+
+        self.assertIsInstance(results[0].error, FileNotFoundError)
+        self.assertIsInstance(results[1].error, ValueError)
+        self.assertEqual(results[2], DisassemblyResult("gsSPEndDisplayList()\n", 0))
+
+
+class TestWalkDisplayLists(unittest.TestCase):
+    """Test walk_display_lists"""
+
+    @staticmethod
+    def packets(*words):
+        return b"".join(struct.pack(">II", hi, lo) for hi, lo in words)
+
+    def setUp(self):
+        gfxd_macro_fn(None)
+
+    def test_shared_lists(self):
+        root = self.packets(
+            (0xDE000000, 0x06000000),   # gsSPDisplayList(a)
+            (0xDE000000, 0x06000000),   # gsSPDisplayList(a)
+            (0xDE000000, 0x06000010),   # gsSPDisplayList(b)
+            (0xDE000000, 0x0A000000),   # unknown segment
+            (0xDF000000, 0x00000000),   # gsSPEndDisplayList()
+        )
+        a = self.packets(
+            (0xDE010000, 0x06000010),   # gsSPBranchList(b)
+            (0x00000000, 0x00000000),   # not reached
+        )
+        b = self.packets(
+            (0xDF000000, 0x00000000),
+        )
+        data = root + a + b
+        a_ofs = len(root)
+        b_ofs = a_ofs + len(a)
+
+        graph = walk_display_lists(data, [0x00000000], gfxd_f3dex2, {0: 0, 6: a_ofs})
+
+        self.assertEqual(graph.roots, [0])
+        self.assertEqual(sorted(graph.lists), [0, a_ofs, b_ofs])
+        self.assertEqual(graph.children[0], [a_ofs, b_ofs])
+        self.assertEqual(graph.children[a_ofs], [b_ofs])
+        self.assertEqual(graph.children[b_ofs], [])
+        self.assertEqual(sorted(graph.parents(b_ofs)), [0, a_ofs])
+        self.assertEqual(graph.unresolved, {0x0A000000})
+        self.assertEqual(len(graph.lists[a_ofs]), 1)
+        self.assertEqual(graph.lists[a_ofs][0][1], GfxdMacroId.SPBranchList)
+
+    def test_cycle(self):
+        data = self.packets(
+            (0xDE000000, 0x06000008),
+            (0xDE010000, 0x06000000),
+        )
+        graph = walk_display_lists(data, [0x06000000], gfxd_f3dex2, {6: 0})
+
+        # the list at 0 runs on into the branch at 8
+        self.assertEqual(graph.children, {0: [8, 0], 8: [0]})
+
+    def test_resolve_segmented(self):
+        self.assertEqual(resolve_segmented(0x06001234, {6: 0x100}), 0x1334)
+        self.assertEqual(resolve_segmented(0x80001234, {0: 0}), 0x1234)
+        self.assertIsNone(resolve_segmented(0x06001234, {}))
+
+
+@unittest.skipIf(pygfxd._numpy() is None, "numpy is not installed")
+class TestPacketScan(unittest.TestCase):
+    """Test scan_packets"""
+
+    def setUp(self):
+        gfxd_macro_fn(None)
+        self.data = bytes(TEST_DATA.data) + TestWalkDisplayLists.packets(
+            (0xDE000000, 0x06000100),   # gsSPDisplayList
+            (0xFD100000, 0x06000200),   # gsDPSetTextureImage
+            (0x0100A014, 0x06000300),   # gsSPVertex(10, 0)
+            (0xDE010000, 0x06000400),   # gsSPBranchList
+            (0x0100A014, 0x06000500),
+        )
+        self.table = gfxd_decode_all(self.data, gfxd_f3dex2, caps=())
+
+    def rows(self, *macro_ids):
+        return [row for row in self.table if row.id in macro_ids]
+
+    def test_classify(self):
+        scan = scan_packets(self.data, gfxd_f3dex2)
+        self.assertEqual(len(scan), len(self.data) // 8)
+        self.assertEqual(scan.histogram().sum(), len(scan))
+        self.assertEqual(scan.macro_histogram()[GfxdMacroId.SPVertex], 3)
+        # single-packet macros are classified as libgfxd decodes them
+        for row in self.table:
+            if row.packets == 1 and row.id in (GfxdMacroId.SPVertex, GfxdMacroId.SP1Triangle,
+                                               GfxdMacroId.SPEndDisplayList, GfxdMacroId.DPSetTextureImage):
+                self.assertEqual(scan.macro_id[row.offset // 8], row.id)
+
+    def test_fields(self):
+        scan = scan_packets(self.data, gfxd_f3dex2)
+        offsets, addresses, counts = scan.vertices()
+        vertices = self.rows(GfxdMacroId.SPVertex)
+        self.assertEqual(list(offsets), [row.offset for row in vertices])
+        self.assertEqual(list(addresses), [row.args[0][2][1] for row in vertices])
+        self.assertEqual(list(counts), [row.args[1][2][1] for row in vertices])
+
+        dls = self.rows(GfxdMacroId.SPDisplayList, GfxdMacroId.SPBranchList)
+        self.assertEqual(list(scan.addresses(GfxdMacroId.DisplayList)), [row.args[0][2][1] for row in dls])
+        self.assertEqual(list(scan.addresses(GfxdMacroId.DPSetTextureImage)), [0x06000200])
+
+        ends = self.rows(GfxdMacroId.SPEndDisplayList, GfxdMacroId.SPBranchList)
+        self.assertEqual(list(scan.ends()), [row.offset for row in ends])
+
+    def test_thread_settings_kept(self):
+        ids = []
+
+        def macro_fn():
+            ids.append(gfxd_macro_id())
+            return 0
+
+        gfxd_target(gfxd_f3dex2)
+        gfxd_macro_fn(macro_fn)
+        gfxd_input_buffer(TEST_DATA.data)
+        gfxd_execute()
+        expected = ids[:]
+        ids.clear()
+
+        gfxd_input_buffer(TEST_DATA.data)
+        scan = scan_packets(self.data, gfxd_f3dex2)
+        scan.vertices()
+        scan.ends()
+        gfxd_execute()
+        gfxd_macro_fn(None)
+        gfxd_input_buffer(None)
+
+        self.assertEqual(ids, expected)
+        self.assertNotEqual(ids, [])
+
+        # the helper thread is reused
+        threads = threading.active_count()
+        scan.vertices()
+        scan.ends()
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_endian(self):
+        scan = scan_packets(self.data, gfxd_f3dex2)
+        swapped = b"".join(self.data[i : i + 4][::-1] for i in range(0, len(self.data), 4))
+        scan_le = scan_packets(swapped + b"\0\0", gfxd_f3dex2, GfxdEndian.little, 4)
+        self.assertTrue((scan.words == scan_le.words).all())
+        self.assertTrue((scan.macro_id == scan_le.macro_id).all())
+
+    def test_opcode_table(self):
+        table = opcode_table(gfxd_f3d)
+        self.assertEqual(table[0x04], GfxdMacroId.SPVertex)
+        self.assertEqual(table[0xB8], GfxdMacroId.SPEndDisplayList)
+        self.assertEqual(table[0xD0], GfxdMacroId.Invalid)
+        self.assertEqual(opcode_table(gfxd_f3dex2)[0x01], GfxdMacroId.SPVertex)
+
+    def test_no_numpy(self):
+        with unittest.mock.patch.object(pygfxd, "_numpy", lambda: None):
+            with self.assertRaises(ImportError):
+                scan_packets(self.data, gfxd_f3dex2)
+
+
+@unittest.skipIf(pygfxd._numpy() is None, "numpy is not installed")
+class TestDiscoverDisplayLists(unittest.TestCase):
+    """Test discover_display_lists"""
+
+    def setUp(self):
+        gfxd_macro_fn(None)
+        packets = TestWalkDisplayLists.packets
+        self.dl1 = packets(
+            (0x0100A014, 0x06000300),   # gsSPVertex
+            (0x05000204, 0x00000000),   # gsSP1Triangle(0, 1, 2, 0)
+            (0xDF000000, 0x00000000),   # gsSPEndDisplayList()
+        )
+        self.dl2 = packets(
+            (0xDE000000, 0x06000100),   # gsSPDisplayList
+            (0xDE010000, 0x06000200),   # gsSPBranchList
+        )
+        head = bytes(64) + packets(
+            (0x05123457, 0x89ABCDEF),   # valid opcode, rejected by libgfxd
+        )
+        junk = packets((0x12345678, 0x00000000))
+        self.data = head + self.dl1 + junk + self.dl2 + bytes(64)
+        self.dl1_ofs = len(head)
+        self.dl2_ofs = len(head) + len(self.dl1) + len(junk)
+        self.expected = [
+            DisplayListRegion(self.dl1_ofs, len(self.dl1), "f3dex2", 1.0),
+            DisplayListRegion(self.dl2_ofs, len(self.dl2), "f3dex2", 1.0),
+        ]
+
+    def test_buffer(self):
+        regions = discover_display_lists(self.data, [gfxd_f3dex2], workers=1)
+        self.assertEqual(regions, self.expected)
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "rom.bin"
+            path.write_bytes(self.data)
+            regions = discover_display_lists(path, [gfxd_f3dex2], workers=2, chunksize=1)
+        self.assertEqual(regions, self.expected)
+
+    def test_limits(self):
+        regions = discover_display_lists(self.data, [gfxd_f3dex2], max_packets=2, workers=1)
+        self.assertEqual(regions, self.expected[1:])
+        self.assertEqual(discover_display_lists(b"", workers=1), [])
+
+    def test_all_targets(self):
+        regions = discover_display_lists(self.data, workers=1)
+        self.assertEqual([r for r in regions if r.ucode == "f3dex2"], self.expected)
+        for region in regions:
+            target = getattr(pygfxd, f"gfxd_{region.ucode}")
+            table = gfxd_decode_all(self.data[region.offset :][: region.length], target)
+            self.assertEqual(table.ret, 0)
+
+    def test_endian(self):
+        swapped = b"".join(self.data[i : i + 4][::-1] for i in range(0, len(self.data), 4))
+        regions = discover_display_lists(swapped, [gfxd_f3dex2], GfxdEndian.little, 4, workers=1)
+        self.assertEqual(regions, self.expected)
+
+
+class TestDisassemblyCache(unittest.TestCase):
+    """Test DisassemblyCache with Gfxd"""
+
+    def setUp(self):
+        gfxd_macro_fn(None)
+        self.cache = DisassemblyCache()
+        self.ctx = Gfxd(gfxd_f3dex2, cache=self.cache)
+        self.ctx.input_buffer(TEST_DATA.data)
+        self.ctx.output_growable()
+
+    def test_text(self):
+        offsets = [sym.offset for sym in TEST_DATA.syms]
+
+        self.ctx.execute_many(offsets)
+        first = self.ctx.output_string()
+        self.ctx.output_growable()
+        self.ctx.execute_many(offsets)
+
+        self.assertEqual(self.ctx.output_string(), first)
+        self.assertEqual(self.cache.misses, len(offsets))
+        self.assertEqual(self.cache.hits, len(offsets))
+
+    def test_settings_in_key(self):
+        self.ctx.execute_at(0)
+        self.ctx.enable(GfxdCap.emit_ext_macro)
+        self.ctx.execute_at(0)
+        self.ctx.target(gfxd_f3dex)
+        self.ctx.execute_at(0)
+
+        self.assertEqual(self.cache.misses, 3)
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_decode_at(self):
+        for sym in TEST_DATA.syms:
+            with self.subTest(sym):
+                table = self.ctx.decode_at(sym.offset, sym.size)
+                self.assertIs(self.ctx.decode_at(sym.offset, sym.size), table)
+                self.assertEqual(table[0][0], sym.offset)
+
+    def test_callbacks_bypass(self):
+        ids = []
+
+        def macro_fn():
+            ids.append(gfxd_macro_id())
+            return 0
+
+        self.ctx.macro_fn(macro_fn)
+        self.ctx.execute_at(0)
+        self.ctx.execute_at(0)
+
+        self.assertEqual(ids, [GfxdMacroId.SPEndDisplayList] * 2)
+        self.assertEqual(self.cache.bypasses, 2)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_eviction(self):
+        cache = DisassemblyCache(max_size=10)
+        cache.put("a", "a", 6)
+        cache.put("b", "b", 4)
+        cache.get("a")
+        cache.put("c", "c", 4)
+
+        self.assertNotIn("b", cache)
+        self.assertIn("a", cache)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.size, 10)
+
+
+class TestDiskDisassemblyCache(unittest.TestCase):
+    """Test DiskDisassemblyCache"""
+
+    def setUp(self):
+        gfxd_macro_fn(None)
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_ctx(self, cache):
+        ctx = Gfxd(gfxd_f3dex2, cache=cache)
+        ctx.input_buffer(TEST_DATA.data)
+        ctx.output_growable()
+        ctx.execute_many([sym.offset for sym in TEST_DATA.syms])
+        return ctx.output_string(), ctx.decode_at(0)
+
+    def test_persistent(self):
+        first = DiskDisassemblyCache(self.tmp.name)
+        text, table = self.run_ctx(first)
+        self.assertEqual(first.hits, 0)
+
+        # a new instance, as in another process or run
+        second = DiskDisassemblyCache(self.tmp.name)
+        cached_text, cached_table = self.run_ctx(second)
+
+        self.assertEqual(cached_text, text)
+        self.assertEqual(cached_table[0], table[0])
+        self.assertEqual(second.misses, 0)
+        self.assertEqual(second.hits, len(TEST_DATA.syms) + 1)
+
+    def test_prune(self):
+        cache = DiskDisassemblyCache(self.tmp.name)
+        self.run_ctx(cache)
+        entries = len(cache)
+
+        self.assertEqual(cache.prune(cache.stats()["size"] - 1), 1)
+        self.assertEqual(len(cache), entries - 1)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_max_size(self):
+        cache = DiskDisassemblyCache(self.tmp.name, max_size=1)
+        self.run_ctx(cache)
+
+        self.assertEqual(len(cache), 0)
+        self.assertGreater(cache.evictions, 0)
+
+    def test_corrupt_entry(self):
+        cache = DiskDisassemblyCache(self.tmp.name)
+        self.run_ctx(cache)
+        for root, _, files in os.walk(self.tmp.name):
+            for name in files:
+                with open(os.path.join(root, name), "wb") as f:
+                    f.write(b"garbage")
+
+        text, _ = self.run_ctx(cache)
+        self.assertEqual(cache.hits, 0)
+        self.assertIn("gsSPEndDisplayList()", text)
+
+    def test_pickled_entry(self):
+        cache = DiskDisassemblyCache(self.tmp.name)
+        self.run_ctx(cache)
+        for root, _, files in os.walk(self.tmp.name):
+            for name in files:
+                with open(os.path.join(root, name), "wb") as f:
+                    f.write(pickle.dumps((0, b"pickled")))
+
+        # entries are never unpickled
+        text, _ = self.run_ctx(cache)
+        self.assertEqual(cache.hits, 0)
+        self.assertNotIn("pickled", text)
+
+    def test_table_roundtrip(self):
+        first = DiskDisassemblyCache(self.tmp.name)
+        _, table = self.run_ctx(first)
+        _, cached_table = self.run_ctx(DiskDisassemblyCache(self.tmp.name))
+
+        self.assertIsNot(cached_table, table)
+        self.assertEqual(cached_table.ret, table.ret)
+        self.assertEqual(list(cached_table), list(table))
+
+    def test_library_in_key(self):
+        self.run_ctx(DiskDisassemblyCache(self.tmp.name))
+
+        # another libgfxd build with the same __version__
+        cache = DiskDisassemblyCache(self.tmp.name)
+        with unittest.mock.patch.object(pygfxd, "_libgfxd_digest", return_value="0" * 64):
+            self.run_ctx(cache)
+        self.assertEqual(cache.hits, 0)
+
+    def test_command_line(self):
+        cache = DiskDisassemblyCache(self.tmp.name)
+        self.run_ctx(cache)
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            pygfxd._main(["cache-stats", self.tmp.name])
+            pygfxd._main(["cache-prune", self.tmp.name])
+        self.assertIn(f"entries {len(TEST_DATA.syms) + 1}", out.getvalue())
+        self.assertEqual(len(cache), 0)
+
+
+class TestIterMacros(unittest.TestCase):
+    """Test iter_macros"""
+
+    def setUp(self):
+        gfxd_macro_fn(None)
+
+    def reference(self, data, caps):
+        macros = []
+
+        def macro_fn():
+            args = [(gfxd_arg_type(i), gfxd_arg_value(i)[1]) for i in range(gfxd_arg_count())]
+            macros.append((gfxd_macro_offset(), gfxd_macro_id(), gfxd_macro_name(), gfxd_macro_packets(), args))
+            return 0
+
+        gfxd_input_buffer(data)
+        gfxd_target(gfxd_f3dex2)
+        gfxd_endian(GfxdEndian.big, 4)
+        for cap in GfxdCap:
+            (gfxd_enable if cap in caps else gfxd_disable)(cap)
+        gfxd_macro_fn(macro_fn)
+        gfxd_execute()
+        gfxd_macro_fn(None)
+        gfxd_input_buffer(None)
+        gfxd_enable(GfxdCap.stop_on_invalid)
+        gfxd_enable(GfxdCap.stop_on_end)
+        gfxd_disable(GfxdCap.emit_ext_macro)
+        return macros
+
+    @staticmethod
+    def simplify(macros):
+        return [
+            (m.offset, m.id, m.name, m.packets, [(arg[0], arg[2][1]) for arg in m.args])
+            for m in macros
+        ]
+
+    def test_chunks(self):
+        data = bytes(TEST_DATA.data) * 8
+        for caps in [(), (GfxdCap.stop_on_end,)]:
+            expected = self.reference(data, caps)
+            for chunk_size in [1, 8, 13, 100]:
+                with self.subTest(caps=caps, chunk_size=chunk_size):
+                    chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+                    macros = iter_macros(chunks, gfxd_f3dex2, caps=caps, chunk_size=chunk_size)
+                    self.assertEqual(self.simplify(macros), expected)
+
+    def test_file(self):
+        expected = self.reference(TEST_DATA.data, ())
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "data.bin"
+            path.write_bytes(TEST_DATA.data)
+
+            self.assertEqual(self.simplify(iter_macros(path, gfxd_f3dex2, caps=(), chunk_size=16)), expected)
+            with path.open("rb") as f:
+                self.assertEqual(self.simplify(iter_macros(f, gfxd_f3dex2, caps=(), chunk_size=16)), expected)
+
+    def test_dynamic_names(self):
+        macro = next(iter_macros(TEST_DATA.data, gfxd_f3dex2, dynamic="glistp++"))
+        self.assertEqual(macro.name, "gSPEndDisplayList")
+
+    def test_stops_early(self):
+        read = []
+
+        def chunks():
+            for i in range(1000):
+                read.append(i)
+                yield bytes(8)   # gsDPNoOp()
+
+        macros = list(itertools.islice(iter_macros(chunks(), gfxd_f3dex2, chunk_size=64), 3))
+
+        self.assertEqual([m.id for m in macros], [GfxdMacroId.DPNoOp] * 3)
+        self.assertLess(len(read), 100)
+
+    def test_large_chunks(self):
+        data = bytes(8) * 0x10000   # gsDPNoOp()
+        for source in [data, bytearray(data), memoryview(data), [data]]:
+            with self.subTest(type(source)):
+                decoded = []
+                decode = pygfxd._MacroStream.decode
+
+                def record(stream, final):
+                    decoded.append(len(stream.pending))
+                    return decode(stream, final)
+
+                with unittest.mock.patch.object(pygfxd._MacroStream, "decode", record):
+                    macro = next(iter_macros(source, gfxd_f3dex2, caps=(), chunk_size=64))
+
+                # only about one chunk is decoded before the first macro is yielded
+                self.assertEqual(macro.id, GfxdMacroId.DPNoOp)
+                self.assertLess(max(decoded), 256)
+
+        expected = list(iter_macros([data], gfxd_f3dex2, caps=(), chunk_size=len(data)))
+        self.assertEqual(list(iter_macros(data, gfxd_f3dex2, caps=(), chunk_size=64)), expected)
+
+    def test_lazy(self):
+        noise = bytes((i * 37 + 11) & 0xFF for i in range(4096))
+        for data in [bytes(TEST_DATA.data) * 8, noise]:
+            for caps in [(), (GfxdCap.emit_ext_macro,)]:
+                with self.subTest(caps=caps, size=len(data)):
+                    expected = list(iter_macros(data, gfxd_f3dex2, caps=caps, chunk_size=64))
+                    macros = list(iter_macros(data, gfxd_f3dex2, caps=caps, chunk_size=64, lazy=True))
+                    self.assertTrue(all(isinstance(m, LazyMacro) for m in macros))
+                    self.assertEqual([m.data for m in macros],
+                                     [data[m.offset:m.offset + 8 * m.packets] for m in expected])
+                    self.assertEqual([(m.offset, m.id, m.name, m.packets) for m in macros],
+                                     [(m.offset, m.id, m.name, m.packets) for m in expected])
+                    # compare raw values, invalid float arguments may be NaN
+                    self.assertEqual([[(a[0], a[1], a[2][0], a[3]) for a in m.args] for m in macros],
+                                     [[(a[0], a[1], a[2][0], a[3]) for a in m.args] for m in expected])
+
+    def test_lazy_args_cached(self):
+        macro = next(iter_macros(TEST_DATA.data[16:], gfxd_f3dex2, lazy=True))
+        self.assertEqual(macro.id, GfxdMacroId.SPVertex)
+        self.assertIsNone(macro._args)
+        args = macro.args
+        self.assertIs(macro.args, args)
+        self.assertFalse(hasattr(macro, "__dict__"))
+
+    def test_macro_record(self):
+        ctx = Gfxd(gfxd_f3dex2, caps=())
+        records = []
+        ctx.macro_fn(lambda: records.append(ctx.macro_record()) or 0)
+        ctx.input_buffer(TEST_DATA.data)
+        ctx.execute()
+
+        expected = self.reference(TEST_DATA.data, ())
+        self.assertEqual(self.simplify(records), expected)
+
+
+class TestExecution(unittest.TestCase):
+    """Test incremental execution with GfxdExecution"""
+
+    def setUp(self):
+        gfxd_macro_fn(None)
+        self.ctx = Gfxd(gfxd_f3dex2, caps=(GfxdCap.stop_on_invalid,))
+        self.ctx.input_buffer(TEST_DATA.data)
+        self.ctx.output_growable()
+
+        self.offsets = []
+
+        def macro_fn():
+            self.offsets.append(gfxd_macro_offset())
+            return gfxd_macro_dflt()
+
+        self.ctx.macro_fn(macro_fn)
+
+    def test_steps(self):
+        self.ctx.execute()
+        expected = self.ctx.output_string()
+        expected_offsets = self.offsets[:]
+
+        for max_macros in [1, 2, 3, 100]:
+            with self.subTest(max_macros=max_macros):
+                self.ctx.output_growable()
+                self.offsets.clear()
+
+                run = self.ctx.begin()
+                steps = 1
+                while not run.step(max_macros):
+                    self.assertEqual(len(self.offsets), steps * max_macros)
+                    steps += 1
+
+                self.assertEqual(run.ret, 0)
+                self.assertEqual(self.offsets, expected_offsets)
+                self.assertEqual(self.ctx.output_string(), expected)
+
+    def test_resume(self):
+        run = self.ctx.begin()
+        self.assertFalse(run.step(2))
+        self.assertFalse(run.done)
+        self.assertEqual(run.resume(), 0)
+        self.assertTrue(run.done)
+        # stepping a finished execution does nothing
+        self.assertTrue(run.step(1))
+        self.assertEqual(len(self.offsets), len(TEST_DATA.data) // 8 - 2)
+
+    def test_stop(self):
+        self.ctx.macro_fn(lambda: 7)
+        run = self.ctx.begin()
+
+        self.assertTrue(run.step(5))
+        self.assertEqual(run.ret, 7)
+
+    def test_interrupted(self):
+        run = self.ctx.begin()
+        run.step(1)
+        self.ctx.execute()
+        with self.assertRaises(RuntimeError):
+            run.step(1)
+
+    def test_interrupted_by_context(self):
+        run = self.ctx.begin()
+        run.step(1)
+        Gfxd(gfxd_f3dex2).decode_all()
+        with self.assertRaises(RuntimeError):
+            run.step(1)
+
+    def test_module_functions(self):
+        gfxd_input_buffer(TEST_DATA.data)
+        gfxd_output_buffer(None)
+        gfxd_target(gfxd_f3dex2)
+        gfxd_disable(GfxdCap.stop_on_end)
+        try:
+            ids = []
+
+            def macro_fn():
+                ids.append(gfxd_macro_id())
+                return 0
+
+            gfxd_macro_fn(macro_fn)
+            gfxd_execute_begin()
+            self.assertEqual(gfxd_execute_step(3), 0)
+            self.assertFalse(gfxd_execute_done())
+            self.assertEqual(len(ids), 3)
+            self.assertEqual(gfxd_execute_step(-1), 0)
+            self.assertTrue(gfxd_execute_done())
+        finally:
+            gfxd_enable(GfxdCap.stop_on_end)
+            gfxd_macro_fn(None)
+            gfxd_input_buffer(None)
+
+
+class TestAsyncio(unittest.TestCase):
+    """Test aiter_macros and adisassemble"""
+
+    def setUp(self):
+        gfxd_macro_fn(None)
+        self.data = bytes(TEST_DATA.data)
+
+    def reader(self):
+        reader = asyncio.StreamReader()
+        reader.feed_data(self.data)
+        reader.feed_eof()
+        return reader
+
+    def test_aiter_macros(self):
+        expected = list(iter_macros(self.data, gfxd_f3dex2, caps=()))
+
+        async def collect(source):
+            return [m async for m in aiter_macros(source, gfxd_f3dex2, caps=(), chunk_size=16)]
+
+        async def chunks():
+            for i in range(0, len(self.data), 5):
+                yield self.data[i:i + 5]
+
+        async def run():
+            return await asyncio.gather(collect(self.reader()), collect(chunks()), collect(self.data))
+
+        for macros in asyncio.run(run()):
+            self.assertEqual([(m.offset, m.id, m.name) for m in macros],
+                             [(m.offset, m.id, m.name) for m in expected])
+
+    def test_adisassemble(self):
+        expected = "".join(TestDisassembleMany.EXPECTED[sym.name] for sym in TEST_DATA.syms)
+
+        async def run():
+            requests = [adisassemble(self.reader(), gfxd_f3dex2, caps=(GfxdCap.stop_on_invalid,),
+                                     macro_fn=line_macro_fn) for _ in range(8)]
+            return await asyncio.gather(*requests)
+
+        for result in asyncio.run(run()):
+            self.assertEqual(result.ret, 0)
+            self.assertEqual(result.text.replace("gsDPNoOp()\n", ""), expected)
+
+    def test_adisassemble_releases_input(self):
+        keep_alive = getattr(pygfxd, "__gfxd_buffers_callbacks")
+
+        async def run(executor):
+            return await adisassemble(self.data, gfxd_f3dex2, executor=executor)
+
+        with ThreadPoolExecutor(1) as executor:
+            result = asyncio.run(run(executor))
+            # the worker thread does not keep the input of the request alive
+            pinned = executor.submit(keep_alive.get, gfxd_input_buffer).result()
+
+        self.assertEqual(result, DisassemblyResult("gsSPEndDisplayList()", 0))
+        self.assertIsNone(pinned)
+
+    def test_adisassemble_process_pool(self):
+        async def run(executor):
+            return await adisassemble(self.data, gfxd_f3dex2, macro_fn=line_macro_fn, executor=executor)
+
+        with ProcessPoolExecutor(1) as executor:
+            result = asyncio.run(run(executor))
+
+        self.assertEqual(result, DisassemblyResult("gsSPEndDisplayList()\n", 0))
+
+
+class TestMacroTable(unittest.TestCase):
+    """Test MacroTable rows, slicing, filtering and pickling"""
+
+    def setUp(self):
+        gfxd_macro_fn(None)
+        self.table = gfxd_decode_all(TEST_DATA.data, gfxd_f3dex2, caps=())
+
+    def test_row(self):
+        row = self.table[2]
+        self.assertEqual(row.offset, 16)
+        self.assertEqual(row.id, GfxdMacroId.SPVertex)
+        self.assertEqual(row.packets, 1)
+        self.assertEqual(row.arg_count, 3)
+        self.assertEqual(row.arg_type(0), GfxdArgType.Vtxptr)
+        self.assertEqual(row.arg_value(0)[1], 0x42042069)
+        self.assertTrue(row.arg_valid(1))
+        with self.assertRaises(IndexError):
+            row.arg_value(3)
+        # rows still behave as the tuples returned previously
+        offset, macro_id, packets, args = row
+        self.assertEqual((offset, macro_id, packets), (16, GfxdMacroId.SPVertex, 1))
+        self.assertEqual(args, row.args)
+        self.assertFalse(hasattr(row, "__dict__"))
+
+    def test_slice(self):
+        part = self.table[1:5]
+        self.assertIsInstance(part, MacroTable)
+        self.assertEqual(len(part), 4)
+        self.assertEqual([row for row in part], [self.table[i] for i in range(1, 5)])
+        self.assertEqual(list(self.table[::-1])[0], self.table[-1])
+
+    def test_filter(self):
+        ends = self.table.filter(GfxdMacroId.SPEndDisplayList)
+        self.assertEqual(list(ends.offset), [0, 32])
+        self.assertEqual(len(ends.arg_type), 0)
+
+        part = self.table.filter(GfxdMacroId.SPVertex, GfxdMacroId.SP1Triangle)
+        self.assertEqual([row.id for row in part], [GfxdMacroId.SPVertex, GfxdMacroId.SP1Triangle])
+        self.assertEqual(part[1].args, self.table[3].args)
+        self.assertEqual(part.arg_start[-1], len(part.arg_type))
+
+    def test_pickle(self):
+        for table in (self.table, self.table.compact()):
+            with self.subTest(typecode=table.macro_id.typecode):
+                copy = pickle.loads(pickle.dumps(table))
+                self.assertEqual(list(copy), list(self.table))
+                self.assertEqual(copy.macro_id.typecode, table.macro_id.typecode)
+                self.assertEqual(copy.ret, table.ret)
+
+    def test_compact(self):
+        compact = self.table.compact()
+        self.assertLess(compact.nbytes, self.table.nbytes)
+        self.assertEqual(list(compact), list(self.table))
+
+
+class TestMacroFilter(unittest.TestCase):
+    """Test gfxd_macro_filter"""
+
+    IDS = (GfxdMacroId.SPVertex, GfxdMacroId.SP1Triangle)
+
+    def setUp(self):
+        gfxd_macro_fn(None)
+        self.ctx = Gfxd(gfxd_f3dex2, caps=(GfxdCap.stop_on_invalid,))
+        self.ctx.input_buffer(TEST_DATA.data)
+        self.ctx.output_growable()
+        self.seen = []
+
+        def macro_fn():
+            self.seen.append(gfxd_macro_id())
+            gfxd_puts("<")
+            gfxd_macro_dflt()
+            gfxd_puts(">")
+            return 0
+
+        self.ctx.macro_fn(macro_fn)
+
+    def tearDown(self):
+        self.ctx.input_buffer(None)
+        gfxd_macro_filter(None)
+
+    def test_print(self):
+        self.ctx.macro_filter(self.IDS)
+        self.ctx.execute()
+
+        self.assertEqual(self.seen, list(self.IDS))
+        text = self.ctx.output_string()
+        self.assertIn("gsSPEndDisplayList()gsDPNoOp()<gsSPVertex(", text)
+        self.assertIn(")><gsSP1Triangle(", text)
+        self.assertEqual(text.count("gsSPEndDisplayList()"), 2)
+
+    def test_skip(self):
+        self.ctx.macro_filter(self.IDS, skip=True)
+        self.ctx.execute()
+
+        self.assertEqual(self.seen, list(self.IDS))
+        text = self.ctx.output_string()
+        self.assertTrue(text.startswith("<gsSPVertex("))
+        self.assertTrue(text.endswith(")>"))
+        self.assertEqual(text.count("<"), 2)
+
+    def test_stop_on_end(self):
+        self.ctx.disable(GfxdCap.stop_on_invalid)
+        self.ctx.enable(GfxdCap.stop_on_end)
+        self.ctx.macro_filter(self.IDS, skip=True)
+        self.ctx.execute()
+        self.assertEqual(self.seen, [])
+
+    def test_removed(self):
+        self.ctx.macro_filter(self.IDS, skip=True)
+        self.ctx.macro_filter(None)
+        self.ctx.execute()
+        self.assertEqual(len(self.seen), len(self.ctx.decode_at(0)))
+
+    def test_decode_all(self):
+        expected = self.ctx.decode_at(0)
+        self.ctx.macro_filter(self.IDS, skip=True)
+        self.assertEqual(list(self.ctx.decode_at(0)), list(expected))
+        self.assertEqual(self.seen, [])
+
+
+class TestRefSink(unittest.TestCase):
+    """Test gfxd_ref_sink"""
+
+    CALLBACKS = {
+        gfxd_tlut_callback : GfxdArgType.Tlut,
+        gfxd_timg_callback : GfxdArgType.Timg,
+        gfxd_cimg_callback : GfxdArgType.Cimg,
+        gfxd_zimg_callback : GfxdArgType.Zimg,
+        gfxd_dl_callback : GfxdArgType.Dl,
+        gfxd_mtx_callback : GfxdArgType.Mtxptr,
+        gfxd_lookat_callback : GfxdArgType.Lookatptr,
+        gfxd_light_callback : GfxdArgType.Lightptr,
+        gfxd_lightsn_callback : GfxdArgType.Lightsn,
+        gfxd_seg_callback : GfxdArgType.Segptr,
+        gfxd_vtx_callback : GfxdArgType.Vtxptr,
+        gfxd_vp_callback : GfxdArgType.Vpptr,
+        gfxd_uctext_callback : GfxdArgType.Uctext,
+        gfxd_ucdata_callback : GfxdArgType.Ucdata,
+        gfxd_dram_callback : GfxdArgType.Dram,
+    }
+
+    def setUp(self):
+        gfxd_macro_fn(None)
+        packets = struct.pack(
+            ">16I",
+            0xFD10003F, 0x06000000,     # gsDPSetTextureImage
+            0xDE000000, 0x06001000,     # gsSPDisplayList
+            0xDA380003, 0x06002000,     # gsSPMatrix
+            0xFF10013F, 0x0F000000,     # gsDPSetColorImage
+            0xFE000000, 0x0E000000,     # gsDPSetDepthImage
+            0xDB060004, 0x01000000,     # gsSPSegment
+            0x01004008, 0x06003000,     # gsSPVertex
+            0xDF000000, 0x00000000,     # gsSPEndDisplayList
+        )
+        noise = bytes((i * 37 + 11) & 0xFF for i in range(8192))
+        self.data = packets + bytes(TEST_DATA.data) + noise
+
+    def tearDown(self):
+        gfxd_ref_sink(None)
+        for setter in self.CALLBACKS:
+            setter(None)
+        gfxd_input_buffer(None)
+        gfxd_enable(GfxdCap.stop_on_invalid)
+        gfxd_enable(GfxdCap.stop_on_end)
+
+    def execute(self):
+        gfxd_input_buffer(self.data)
+        gfxd_target(gfxd_f3dex2)
+        gfxd_endian(GfxdEndian.big, 4)
+        gfxd_disable(GfxdCap.stop_on_invalid)
+        gfxd_disable(GfxdCap.stop_on_end)
+        gfxd_output_buffer(None)
+        return gfxd_execute()
+
+    def test_matches_callbacks(self):
+        expected = []
+
+        def callback(arg_type):
+            def fn(address, *params):
+                expected.append(AddressRef(gfxd_macro_offset(), gfxd_macro_id(), arg_type, address, params))
+                return 0
+            return fn
+
+        for setter, arg_type in self.CALLBACKS.items():
+            setter(callback(arg_type))
+        self.execute()
+        for setter in self.CALLBACKS:
+            setter(None)
+
+        sink = RefSink()
+        gfxd_ref_sink(sink)
+        self.execute()
+
+        refs = sink.refs()
+        self.assertGreater(len({ref.type for ref in refs}), 5)
+        self.assertEqual(refs, expected)
+        self.assertEqual(len(sink), len(refs))
+        self.assertEqual(len(sink.raw()), 9 * len(refs))
+
+    def test_batches(self):
+        sink = RefSink()
+        gfxd_ref_sink(sink)
+        self.execute()
+        n = len(sink)
+        self.execute()
+        self.assertEqual(len(sink), 2 * n)
+        sink.clear()
+        self.assertEqual(len(sink), 0)
+
+        gfxd_ref_sink(None)
+        self.execute()
+        self.assertEqual(len(sink), 0)
+
+    def test_context(self):
+        sink = RefSink()
+        ctx = Gfxd(gfxd_f3dex2, cache=DisassemblyCache())
+        ctx.ref_sink(sink)
+        ctx.input_buffer(TEST_DATA.data[16:])
+        ctx.execute_at(0)
+        ctx.execute_at(0)
+        ctx.input_buffer(None)
+
+        self.assertEqual(ctx.cache.hits, 0)
+        refs = sink.refs()
+        self.assertEqual(len(refs), 2)
+        self.assertEqual(refs[0], refs[1])
+        self.assertEqual((refs[0].offset, refs[0].macro_id, refs[0].type),
+                         (0, GfxdMacroId.SPVertex, GfxdArgType.Vtxptr))
+
+    def test_sink_outlives_context(self):
+        def run():
+            ctx = Gfxd(gfxd_f3dex2)
+            ctx.ref_sink(RefSink())
+            ctx.input_buffer(self.data)
+            ctx.execute()
+
+        run()
+        # the sink installed by the collected context still receives the records
+        gc.collect()
+        self.assertEqual(self.execute(), 0)
+        gfxd_ref_sink(None)
+        gc.collect()
+        self.assertEqual(self.execute(), 0)
+
+
+class TestEndian(unittest.TestCase):
+    """Test gfxd_endian and normalize_endian"""
+
+    def setUp(self):
+        self.data = bytes(TEST_DATA.data)
+        self.layouts = []
+        for wordsize in (1, 2, 4, 8):
+            swapped = b"".join(
+                self.data[i : i + wordsize][::-1] for i in range(0, len(self.data), wordsize)
+            )
+            host = swapped if sys.byteorder == "little" else self.data
+            self.layouts.append((GfxdEndian.big, wordsize, self.data))
+            self.layouts.append((GfxdEndian.little, wordsize, swapped))
+            self.layouts.append((GfxdEndian.host, wordsize, host))
+
+    def tearDown(self):
+        gfxd_endian(GfxdEndian.big, 4)
+        gfxd_enable(GfxdCap.stop_on_end)
+
+    def execute(self, data, endian, wordsize):
+        gfxd_input_buffer(data)
+        gfxd_output_growable()
+        gfxd_target(gfxd_f3dex2)
+        gfxd_endian(endian, wordsize)
+        gfxd_disable(GfxdCap.stop_on_end)
+        gfxd_execute()
+        return gfxd_output_string()
+
+    def test_gfxd_endian(self):
+        expected = self.execute(self.data, GfxdEndian.big, 4)
+        for endian, wordsize, data in self.layouts:
+            with self.subTest(endian=endian, wordsize=wordsize):
+                self.assertEqual(self.execute(data, endian, wordsize), expected)
+
+    def test_normalize_endian(self):
+        for endian, wordsize, data in self.layouts:
+            with self.subTest(endian=endian, wordsize=wordsize):
+                self.assertEqual(normalize_endian(data, endian, wordsize), self.data)
+                self.assertEqual(normalize_endian(memoryview(bytearray(data)), endian, wordsize), self.data)
+                # without numpy
+                with unittest.mock.patch.object(pygfxd, "_numpy", lambda: None):
+                    self.assertEqual(normalize_endian(data, endian, wordsize), self.data)
+
+    def test_normalize_endian_invalid(self):
+        with self.assertRaises(ValueError):
+            normalize_endian(self.data, GfxdEndian.little, 3)
+        with self.assertRaises(ValueError):
+            normalize_endian(self.data[:6], GfxdEndian.little, 4)
+
 
 class TestMisc(unittest.TestCase):
     def test_generic(self):